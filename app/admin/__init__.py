@@ -0,0 +1,4 @@
+from apscheduler.schedulers.background import BackgroundScheduler
+
+# jobs run in the api process, started with the app
+scheduler = BackgroundScheduler()
@@ -0,0 +1,198 @@
+"""
+Benchmark chunking profiles against a fixed corpus.
+
+Each profile is ingested into its own temporary vector store and queried
+through a temporary copy of the assistant, so the configured assistant and
+vector store are never touched.
+
+    poetry run benchmark_chunking --assistant competitor \
+        --corpus-dir "Fictional Company Data" \
+        --question "Who are our competitors?"
+"""
+import argparse
+import json
+import logging
+import os
+import time
+import typing
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from openai.types import FileObject
+
+from app.services.openai.openai_service import OpenAIService
+
+# candidates compared against openai's auto chunking and the configured profile
+CHUNKING_PROFILES: Dict[str, Optional[Dict[str, Dict]]] = {
+    "auto": None,
+    "small": {"default": {"max_chunk_size_tokens": 300, "chunk_overlap_tokens": 100}},
+    "medium": {"default": {"max_chunk_size_tokens": 800, "chunk_overlap_tokens": 400}},
+    "large": {"default": {"max_chunk_size_tokens": 1600, "chunk_overlap_tokens": 400}},
+}
+
+DEFAULT_QUESTIONS = [
+    "Who are our competitors and what are their products?",
+    "How does Jupiter Computing Solutions compare to Zeon Tech?",
+]
+
+
+def get_local_corpus(corpus_dir: str) -> Dict[str, bytes]:
+    """
+    Read every file under `corpus_dir` as a dict of filename to bytes. The
+    relative path is kept in the filename with "__" as the separator, the
+    same way ingested s3 files are named.
+
+    :param corpus_dir:
+    :return:
+    """
+    filenames_to_bytes: Dict[str, bytes] = {}
+    for root, _dirs, files in os.walk(corpus_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, corpus_dir).replace(os.path.sep, "__")
+            with open(path, "rb") as f:
+                filenames_to_bytes[filename] = f.read()
+
+    return filenames_to_bytes
+
+
+def get_s3_corpus(ai_config: Dict) -> Dict[str, bytes]:
+    # imported here so a local corpus doesn't need aws credentials
+    from app.routes.openai.utils import get_aws_data
+
+    bucket = ai_config["s3_bucket_vector_store_files"]
+    folders: typing.List[str] = ai_config.get("s3_folder_prefix", [])
+    return {
+        filename.replace(os.path.sep, "__"): content
+        for filename, content in get_aws_data(bucket, folders).items()
+    }
+
+
+def benchmark_profile(
+    openai_service: OpenAIService,
+    profile_name: str,
+    chunking_strategies: Optional[Dict[str, Dict]],
+    ai_files: List[FileObject],
+    questions: List[str],
+) -> Dict:
+    """
+    Ingest `ai_files` into a new vector store using `chunking_strategies`,
+    then time each question against a copy of the assistant that only uses
+    that vector store. Everything created here is removed afterward.
+
+    :param openai_service:
+    :param profile_name:
+    :param chunking_strategies:
+    :param ai_files:
+    :param questions:
+    :return: a dict of the measurements for the profile
+    """
+    client = openai_service.openai_client
+    vector_store = openai_service.ai_vector_store.create(
+        f"chunking-benchmark-{profile_name}"
+    )
+    assistant = openai_service.ai_assistant.get(openai_service.ai_config["assistant_id"])
+    bench_assistant = client.beta.assistants.create(
+        name=f"chunking-benchmark-{profile_name}",
+        model=assistant.model,
+        instructions=assistant.instructions,
+        tools=[{"type": "file_search"}],
+        tool_resources={"file_search": {"vector_store_ids": [vector_store.id]}},
+    )
+
+    try:
+        start = time.perf_counter()
+        statuses = openai_service.ai_vector_store.create_files_from_ai_files(
+            vector_store.id, ai_files, chunking_strategies=chunking_strategies
+        )
+        indexing_secs = time.perf_counter() - start
+
+        usage_bytes = client.vector_stores.retrieve(vector_store.id).usage_bytes
+
+        answer_secs = []
+        for question in questions:
+            start = time.perf_counter()
+            run = client.beta.threads.create_and_run_poll(
+                assistant_id=bench_assistant.id,
+                thread={"messages": [{"role": "user", "content": question}]},
+            )
+            answer_secs.append(round(time.perf_counter() - start, 2))
+            if run.status != "completed":
+                logging.warning("%s run for %r ended %s", profile_name, question, run.status)
+
+        return {
+            "profile": profile_name,
+            "chunking_strategies": chunking_strategies,
+            "files": len(ai_files),
+            "failed_files": len(
+                [s for s in statuses if s.transfer_status != "completed"]
+            ),
+            "indexing_secs": round(indexing_secs, 2),
+            "store_usage_bytes": usage_bytes,
+            "answer_secs": answer_secs,
+            "mean_answer_secs": round(sum(answer_secs) / len(answer_secs), 2)
+            if answer_secs
+            else None,
+        }
+    finally:
+        client.beta.assistants.delete(bench_assistant.id)
+        client.vector_stores.delete(vector_store.id)
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--assistant", default="competitor")
+    parser.add_argument(
+        "--corpus-dir",
+        help="local directory to ingest, defaults to the assistant's s3 folders",
+    )
+    parser.add_argument(
+        "--profile",
+        action="append",
+        help=f"profile(s) to run, any of {list(CHUNKING_PROFILES)} or 'configured'",
+    )
+    parser.add_argument("--question", action="append")
+    args = parser.parse_args()
+
+    openai_service = OpenAIService(args.assistant)
+    ai_config = openai_service.ai_config
+
+    profiles = dict(CHUNKING_PROFILES)
+    profiles["configured"] = ai_config.get("chunking_strategies")
+    if args.profile:
+        profiles = {name: profiles[name] for name in args.profile}
+
+    if args.corpus_dir:
+        filenames_to_bytes = get_local_corpus(args.corpus_dir)
+    else:
+        filenames_to_bytes = get_s3_corpus(ai_config)
+    logging.info("Benchmarking %s files", len(filenames_to_bytes))
+
+    # files are uploaded once and shared by every profile's vector store
+    ai_files = [
+        openai_service.ai_file.create_file(filename, content)
+        for filename, content in filenames_to_bytes.items()
+    ]
+    try:
+        results = [
+            benchmark_profile(
+                openai_service,
+                name,
+                chunking_strategies,
+                ai_files,
+                args.question or DEFAULT_QUESTIONS,
+            )
+            for name, chunking_strategies in profiles.items()
+        ]
+    finally:
+        for ai_file in ai_files:
+            openai_service.ai_file.delete(ai_file.id)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
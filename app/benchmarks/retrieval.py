@@ -0,0 +1,91 @@
+"""
+Benchmark fast answers from the local search index against assistant runs.
+
+Each question is answered both ways, bypassing the answer cache, and the
+latencies are printed with the answers so their quality can be compared.
+
+    poetry run benchmark_retrieval --assistant competitor \
+        --question "Who are our competitors?"
+"""
+import argparse
+import json
+import logging
+import statistics
+import time
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from app.benchmarks.chunking import DEFAULT_QUESTIONS
+from app.services.openai.openai_service import OpenAIService
+from app.services.search.corpus_index import get_corpus_index
+
+
+def benchmark_question(openai_service: OpenAIService, question: str) -> Dict:
+    index = get_corpus_index(openai_service.ai_config["name"])
+
+    start = time.perf_counter()
+    passages = index.search(question, openai_service.ai_config.get("fast_answer_passages", 8))
+    search_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast_answer = openai_service.get_fast_answer(question)
+    fast_answer_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assistant_answer = openai_service.run_ai_assistant_thread(
+        {"role": "user", "content": question}
+    )
+    assistant_secs = time.perf_counter() - start
+
+    return {
+        "question": question,
+        "search_ms": round(search_secs * 1000, 2),
+        "passages": [p.source for p in passages],
+        "fast_answer_secs": round(fast_answer_secs, 2),
+        "assistant_secs": round(assistant_secs, 2),
+        "fast_answer": fast_answer,
+        "assistant_answer": assistant_answer,
+    }
+
+
+def summarize(results: List[Dict]) -> Dict:
+    return {
+        key: {
+            "median": round(statistics.median(r[key] for r in results), 2),
+            "max": max(r[key] for r in results),
+        }
+        for key in ("search_ms", "fast_answer_secs", "assistant_secs")
+    }
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--assistant", default="competitor")
+    parser.add_argument("--question", action="append")
+    parser.add_argument(
+        "--update-index",
+        action="store_true",
+        help="update the local search index from s3 first",
+    )
+    args = parser.parse_args()
+
+    if args.update_index:
+        # imported here so benchmarking an existing index doesn't need aws
+        from app.routes.openai.utils import update_search_index
+
+        update_search_index(args.assistant)
+
+    openai_service = OpenAIService(args.assistant)
+    results = [
+        benchmark_question(openai_service, question)
+        for question in args.question or DEFAULT_QUESTIONS
+    ]
+    print(json.dumps({"summary": summarize(results), "questions": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,11 @@ import uvicorn
 from fastapi import FastAPI
 from multiprocessing import Process
 
+from app.admin import scheduler
 from app.routes import transfer
+from app.routes import metrics
 from app.routes.openai import openai
+from app.services.openai.openai_service import OpenAIService
 from app.services.slack import slack_service
 from app.slack import commands
 from app.slack import views
@@ -23,9 +26,26 @@ logging.basicConfig(
 app = FastAPI()
 app.include_router(transfer.router)
 app.include_router(openai.router)
+app.include_router(metrics.router)
+
+
+@app.on_event("startup")
+def start_s3_event_consumers():
+    openai.start_configured_s3_event_consumers()
+
+
+@app.on_event("startup")
+def start_scheduler():
+    scheduler.add_job(openai.collect_configured_insights, "interval", minutes=10)
+    scheduler.start()
 
 
 def start_slack_bolt():
+    # citations are resolved from this cache, fill it without delaying startup
+    Thread(
+        target=lambda: OpenAIService("competitor").ai_file.warm_filename_cache(),
+        daemon=True,
+    ).start()
     slack_service.run_bolt_app()  # blocking call, must run in main thread of this process
 
 
@@ -1,4 +1,7 @@
+from typing import List, Optional
+
 from fastapi import HTTPException
+from pydantic import BaseModel, Field
 
 from app.services.openai.openai_service import OpenAIService
 
@@ -9,3 +12,10 @@ def validate_assistant_name(assistant_name: str):
         return assistant_name
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid assistant name")
+
+
+class BulkQuestionsRequest(BaseModel):
+    questions: List[str] = []
+    # resume this batch instead of starting a new one
+    batch_id: Optional[str] = None
+    max_concurrent: int = Field(4, ge=1, le=16)
@@ -0,0 +1,44 @@
+import time
+import typing
+
+from fastapi import APIRouter
+
+from app.services.metrics import metrics_service
+
+router = APIRouter(prefix="/metrics")
+
+
+@router.get("/counters")
+def get_counters(name: typing.Optional[str] = None):
+    """
+    Returns the counters recorded by the api and the slack bot,
+    optionally filtered by name.
+    """
+    return {"counters": metrics_service.get_counters(name)}
+
+
+@router.get("/latency")
+def get_latency(
+    assistant: typing.Optional[str] = None,
+    since_hours: float = 24,
+    group_by: str = "stage",
+):
+    """
+    Returns p50/p95/p99 of the time answering questions spent in each
+    stage ("queue", "route", "create_run", "run_queued", "run_in_progress",
+    "citations", "slack_post", "total", ...) and of the tokens runs used,
+    optionally for one assistant.
+
+    :param group_by: comma separated labels to break the stages down by,
+        like "stage,tier" or "stage,outcome"
+    """
+    labels = {"assistant": assistant} if assistant else {}
+    since = time.time() - since_hours * 60 * 60
+    return {
+        "stages": metrics_service.get_percentiles(
+            "question_stage_secs", group_by.split(","), since=since, **labels
+        ),
+        "tokens": metrics_service.get_percentiles(
+            "run_tokens", ["kind"], since=since, **labels
+        ),
+    }
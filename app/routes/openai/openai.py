@@ -1,12 +1,26 @@
 import logging
+import os
+import threading
 import typing
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from app.services.get_secret import get_secret
 import openai
 
+from app.services.aws import aws_service
+from app.services.aws.s3_events import (
+    FileEventSource,
+    QueueEventSource,
+    S3EventConsumer,
+    S3EventSource,
+    SQSEventSource,
+)
+
 # from app.admin import scheduler
-from app.models.requests.openai import validate_assistant_name
+from app.models.requests.openai import BulkQuestionsRequest, validate_assistant_name
+from app.services.openai.bulk_questions import bulk_question_service
+from app.services.openai.insights import InsightsService
 from app.services.openai.openai_service import OpenAIService
 # from app.services.slack import slack_service
 # from app.slack.channels import SlackChannels
@@ -16,12 +30,52 @@ from app.routes.openai.utils import (
     # get_sms_and_spv_data,
     upload_missing_ai_files,
     determine_files_to_upload_to_vs,
-    get_aws_data,
+    get_aws_data_and_metadata,
     upload_ai_files,
+    record_ai_file_ids,
+    collect_orphaned_ai_files,
+    ingest_aws_file_events,
+    schedule_search_index_update,
+    update_search_index,
+    refresh_insights,
+    collect_insights,
 )
 
 router = APIRouter(prefix="/openai")
 
+# in process queues for notifications posted to the api, one per assistant
+s3_event_sources: typing.Dict[str, QueueEventSource] = {}
+s3_event_sources_lock = threading.Lock()
+
+
+def start_s3_event_consumer(
+    assistant_name: str, source: S3EventSource
+) -> S3EventConsumer:
+    consumer = S3EventConsumer(
+        source,
+        handler=lambda events: ingest_aws_file_events(events, assistant_name),
+    )
+    consumer.start()
+    return consumer
+
+
+def start_configured_s3_event_consumers():
+    """
+    Start consuming s3 notifications from the sqs queue in S3_EVENTS_QUEUE_URL
+    and/or the local file in S3_EVENTS_FILE, for the S3_EVENTS_ASSISTANT
+    assistant (defaults to competitor).
+    """
+    assistant_name = os.getenv("S3_EVENTS_ASSISTANT") or "competitor"
+    if queue_url := os.getenv("S3_EVENTS_QUEUE_URL"):
+        sqs_client = aws_service.session.client(
+            "sqs", region_name=os.getenv("AWS_REGION") or "us-east-1"
+        )
+        start_s3_event_consumer(assistant_name, SQSEventSource(sqs_client, queue_url))
+        logging.info(f"Consuming s3 events from {queue_url} for {assistant_name}")
+    if path := os.getenv("S3_EVENTS_FILE"):
+        start_s3_event_consumer(assistant_name, FileEventSource(path))
+        logging.info(f"Consuming s3 events from {path} for {assistant_name}")
+
 # @scheduler.scheduled_job(
 #     "cron",
 #     day_of_week="mon-sun",
@@ -53,7 +107,9 @@ def add_ai_data_to_ingest_to_vector_store(
 
         if purge_all_vs_files:
             logging.info(f"Purging all vector store files for {assistant_name}")
-            openai_service.ai_vector_store.delete_all_files(assistant_name)
+            openai_service.ai_vector_store.delete_all_files(
+                openai_service.ai_config["vector_store_id"]
+            )
 
         bucket = ai_config.get("s3_bucket_vector_store_files")
         folders: typing.List[str] = ai_config.get("s3_folder_prefix", [])
@@ -64,7 +120,9 @@ def add_ai_data_to_ingest_to_vector_store(
         logging.info(f"Assistant name from config: {name}")
 
         if bucket and folders and name:
-            filenames_to_bytes = get_aws_data(bucket, folders)
+            filenames_to_bytes, filenames_to_metadata = get_aws_data_and_metadata(
+                bucket, folders
+            )
             logging.info(f"Fetched {len(filenames_to_bytes)} files from S3 bucket '{bucket}' and folders '{folders}'")
 
             if pre_s3_file_upload_to_vs:
@@ -74,14 +132,16 @@ def add_ai_data_to_ingest_to_vector_store(
             if replace_existing_ai_file:
                 logging.info("Replacing existing AI files")
                 filenames_to_objects = upload_ai_files(
-                    filenames_to_bytes, assistant_name
+                    filenames_to_bytes, assistant_name, filenames_to_metadata
                 )
             else:
                 logging.info("Uploading missing AI files only")
                 filenames_to_objects = upload_missing_ai_files(
-                    filenames_to_bytes, assistant_name
+                    filenames_to_bytes, assistant_name, filenames_to_metadata
                 )
 
+            record_ai_file_ids(bucket, filenames_to_objects, filenames_to_metadata)
+
             filenames_to_objects_for_upload = determine_files_to_upload_to_vs(
                 filenames_to_objects, assistant_name
             )
@@ -91,6 +151,7 @@ def add_ai_data_to_ingest_to_vector_store(
                 statuses = openai_service.ai_vector_store.create_files(
                     filenames_to_objects_for_upload,
                     openai_service.ai_config["vector_store_id"],
+                    chunking_strategies=ai_config.get("chunking_strategies"),
                 )
                 resp = create_response(statuses)
                 resp.update(
@@ -118,6 +179,8 @@ def add_ai_data_to_ingest_to_vector_store(
                 #     message=f"No new files to add to {assistant_name} vector store",
                 # )
 
+            schedule_search_index_update(assistant_name)
+
             return {
                 "message": "Transfer status details sent to vector store",
                 "details": resp if 'resp' in locals() else "No files uploaded"
@@ -201,6 +264,13 @@ def clear_all_openai_files(
             except Exception as e:
                 logging.warning(f"Failed to delete file {f.id}: {e}")
 
+        if deleted_ids:
+            # deleted files are also removed from the vector store
+            openai_service = OpenAIService(assistant_name)
+            openai_service.ai_vector_store.bump_version(
+                openai_service.ai_config["vector_store_id"]
+            )
+
         logging.info(f"Deleted {len(deleted_ids)} OpenAI Files for assistant: {assistant_name}")
         return {
             "message": f"Deleted {len(deleted_ids)} OpenAI Files for assistant: {assistant_name}",
@@ -217,3 +287,190 @@ def clear_all_openai_files(
         }
 
 
+@router.delete("/assistants/{assistant_name}/garbage_collect_files")
+def garbage_collect_files(
+    assistant_name: str = Depends(validate_assistant_name),
+    dry_run: bool = False,
+):
+    """
+    Deletes orphaned OpenAI files and vector store entries for an assistant
+    and reports the reclaimed bytes.
+    """
+    try:
+        logging.info(f"Collecting orphaned OpenAI files for assistant: {assistant_name}")
+        resp = collect_orphaned_ai_files(assistant_name, dry_run=dry_run)
+        logging.info(f"Reclaimed {resp['reclaimed_bytes']} bytes for {assistant_name}")
+        return resp
+
+    except Exception as e:
+        logging.exception(f"Error collecting orphaned OpenAI files for {assistant_name}")
+        return {
+            "status": "error",
+            "message": f"Failed to collect orphaned OpenAI files for '{assistant_name}'",
+            "error": str(e),
+            "type": type(e).__name__,
+        }
+
+
+@router.post("/assistants/{assistant_name}/s3_events")
+def receive_s3_events(
+    notification: typing.Dict,
+    assistant_name: str = Depends(validate_assistant_name),
+):
+    """
+    Queues an s3 event notification (as sent to sqs/sns) to be debounced and
+    ingested for an assistant. Only the objects in the notification are
+    ingested or removed.
+    """
+    with s3_event_sources_lock:
+        if assistant_name not in s3_event_sources:
+            s3_event_sources[assistant_name] = QueueEventSource()
+            start_s3_event_consumer(assistant_name, s3_event_sources[assistant_name])
+
+    try:
+        s3_event_sources[assistant_name].put(notification)
+        return {"message": f"Queued s3 events for {assistant_name}"}
+
+    except Exception as e:
+        logging.exception(f"Error queueing s3 events for {assistant_name}")
+        return {
+            "status": "error",
+            "message": f"Failed to queue s3 events for '{assistant_name}'",
+            "error": str(e),
+            "type": type(e).__name__,
+        }
+
+
+@router.post("/assistants/{assistant_name}/rebuild_search_index")
+def rebuild_search_index(
+    assistant_name: str = Depends(validate_assistant_name),
+    full: bool = False,
+):
+    """
+    Updates the local search index used for fast answers from the
+    assistant's s3 folders. Only changed files are re-indexed unless `full`
+    is set.
+    """
+    try:
+        logging.info(f"Rebuilding search index for assistant: {assistant_name}")
+        return update_search_index(assistant_name, full=full)
+
+    except Exception as e:
+        logging.exception(f"Error rebuilding search index for {assistant_name}")
+        return {
+            "status": "error",
+            "message": f"Failed to rebuild search index for '{assistant_name}'",
+            "error": str(e),
+            "type": type(e).__name__,
+        }
+
+
+def collect_configured_insights():
+    """
+    Collect the insights batches of the assistant in S3_EVENTS_ASSISTANT
+    (defaults to competitor). Run periodically, see main2.
+    """
+    assistant_name = os.getenv("S3_EVENTS_ASSISTANT") or "competitor"
+    try:
+        resp = collect_insights(assistant_name)
+        if resp["status"] not in ("none", "skipped"):
+            logging.info(f"Collected insights for {assistant_name}: {resp}")
+    except Exception:
+        logging.exception(f"Error collecting insights for {assistant_name}")
+
+
+@router.post("/assistants/{assistant_name}/insights/refresh")
+def refresh_assistant_insights(
+    assistant_name: str = Depends(validate_assistant_name),
+):
+    """
+    Recomputes the precomputed competitor x topic insights. In batch mode
+    the batch is submitted and collected later.
+    """
+    try:
+        return refresh_insights(assistant_name)
+
+    except Exception as e:
+        logging.exception(f"Error refreshing insights for {assistant_name}")
+        return {
+            "status": "error",
+            "message": f"Failed to refresh insights for '{assistant_name}'",
+            "error": str(e),
+            "type": type(e).__name__,
+        }
+
+
+@router.post("/assistants/{assistant_name}/insights/collect")
+def collect_assistant_insights(
+    assistant_name: str = Depends(validate_assistant_name),
+):
+    """
+    Stores the answers of the pending insights batch if it's done.
+    """
+    try:
+        return collect_insights(assistant_name)
+
+    except Exception as e:
+        logging.exception(f"Error collecting insights for {assistant_name}")
+        return {
+            "status": "error",
+            "message": f"Failed to collect insights for '{assistant_name}'",
+            "error": str(e),
+            "type": type(e).__name__,
+        }
+
+
+@router.get("/assistants/{assistant_name}/insights")
+def get_assistant_insights(
+    assistant_name: str = Depends(validate_assistant_name),
+):
+    """
+    Returns the stored insights by competitor and topic.
+    """
+    return InsightsService(OpenAIService(assistant_name)).get_insights()
+
+
+@router.post("/assistants/{assistant_name}/questions/bulk")
+def ask_bulk_questions(
+    request: BulkQuestionsRequest,
+    assistant_name: str = Depends(validate_assistant_name),
+):
+    """
+    Answers a list of questions, streaming one json line per answer as they
+    complete, after a header line with the batch id. Answers are kept if the
+    client disconnects: post the batch id again (with or without the
+    questions) to get them and answer the rest.
+    """
+    if not request.questions and not request.batch_id:
+        raise HTTPException(status_code=400, detail="Either questions or batch_id is required")
+    if request.batch_id:
+        batch_assistant = bulk_question_service.store.get_assistant(request.batch_id)
+        if batch_assistant is not None and batch_assistant != assistant_name:
+            raise HTTPException(status_code=404, detail="Batch not found")
+
+    batch_id = bulk_question_service.start(
+        assistant_name,
+        request.questions,
+        batch_id=request.batch_id,
+        max_concurrent=request.max_concurrent,
+    )
+    return StreamingResponse(
+        bulk_question_service.stream(batch_id), media_type="application/x-ndjson"
+    )
+
+
+@router.get("/assistants/{assistant_name}/questions/bulk/{batch_id}")
+def get_bulk_questions(
+    batch_id: str,
+    assistant_name: str = Depends(validate_assistant_name),
+):
+    """
+    Streams a batch's answers so far, then the ones still running in this
+    process as they complete. Doesn't start unanswered questions.
+    """
+    if bulk_question_service.store.get_assistant(batch_id) != assistant_name:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    return StreamingResponse(
+        bulk_question_service.stream(batch_id), media_type="application/x-ndjson"
+    )
@@ -1,15 +1,22 @@
 import json
 import logging
 import os
+import threading
 import typing
 from typing import Dict
 
+from botocore.exceptions import ClientError
 from openai.types import FileObject
 from pydantic import BaseModel
 
 from app.services.aws import aws_file_service
+from app.services.aws.s3_events import S3Event
+from app.services.file_service import OPENAI_FILE_ID_METADATA_KEY
+from app.services.openai.insights import InsightsService
 from app.services.openai.openai_service import OpenAIService
 from app.services.openai.vector_store import OpenAiFileStatus
+from app.services.search.corpus_index import get_corpus_index
+from app.utils import LRUCache
 # from app.services.snowflake import SecurityMasterSnowflakeService
 
 
@@ -40,47 +47,97 @@ def create_response(
     return status
 
 
+SUPPORTED_EXTENSIONS = [
+    ".html",
+    ".doc",
+    ".docx",
+    ".gdoc",
+    "",
+    ".pdf",
+    ".pptx",
+    ".ppt",
+    ".xlsx",
+]
+
+
+def normalize_aws_file_path(aws_file_path: str) -> typing.Optional[str]:
+    """
+    Normalize an s3 path to the path used for ingesting. Google docs and
+    extensionless files are ingested as ".docx". `None` is returned for
+    unsupported file types.
+
+    :param aws_file_path:
+    :return:
+    """
+    _, ext = os.path.splitext(aws_file_path)
+    if ext not in SUPPORTED_EXTENSIONS:
+        return None
+
+    if ext in [".gdoc"]:
+        aws_file_path = aws_file_path.replace(ext, ".docx")
+    elif ext == "":
+        aws_file_path += ".docx"
+
+    return aws_file_path
+
+
+def get_ai_filename(file_path: str) -> str:
+    """
+    openai removes the base path, but we keep it by replacing the
+    separators with a "__"
+
+    :param file_path:
+    :return:
+    """
+    return file_path.replace(os.path.sep, "__")
+
+
 def get_aws_data(bucket: str, folders: typing.List[str]) -> Dict[str, bytes]:
     """
     Get aws data from a bucket and the provided folders as a dict where the
     key is the file path and the value is a bytes object.
 
 
+    :param bucket:
+    :param folders:
+    :return:
+    """
+    filepath_to_bytes, _ = get_aws_data_and_metadata(bucket, folders)
+    return filepath_to_bytes
+
+
+def get_aws_data_and_metadata(
+    bucket: str, folders: typing.List[str]
+) -> typing.Tuple[Dict[str, bytes], Dict[str, Dict[str, str]]]:
+    """
+    Like `get_aws_data`, but also returns each file's s3 metadata keyed by
+    the same file path. The original s3 key is added to the metadata as
+    "s3_key".
+
     :param bucket:
     :param folders:
     :return:
     """
     list_gen = aws_file_service.list_files(bucket)
     filepath_to_bytes: Dict[str, bytes] = {}
+    filepath_to_metadata: Dict[str, Dict[str, str]] = {}
     while True:
         try:
             aws_file_path = next(list_gen)
             if any([aws_file_path.startswith(folder) for folder in folders]):
-                _, ext = os.path.splitext(aws_file_path)
-                content = aws_file_service.get_file_content(bucket, aws_file_path)
-
-                if ext in [
-                    ".html",
-                    ".doc",
-                    ".docx",
-                    ".gdoc",
-                    "",
-                    ".pdf",
-                    ".pptx",
-                    ".ppt",
-                    ".xlsx",
-                ]:
-                    if ext in [".gdoc"]:
-                        aws_file_path = aws_file_path.replace(ext, ".docx")
-                    elif ext == "":
-                        aws_file_path += ".docx"
-
-                    filepath_to_bytes[aws_file_path] = content
+                normalized_path = normalize_aws_file_path(aws_file_path)
+                if normalized_path is not None:
+                    content, metadata = aws_file_service.get_file(bucket, aws_file_path)
+                    filepath_to_bytes[normalized_path] = content
+                    filepath_to_metadata[normalized_path] = {
+                        **metadata,
+                        "s3_key": aws_file_path,
+                    }
 
         except StopIteration:
             break
 
-    return filepath_to_bytes
+    return filepath_to_bytes, filepath_to_metadata
 
 
 def get_response_block(
@@ -174,52 +231,89 @@ def get_response_block(
 
 
 def upload_ai_files(
-    filenames_to_bytes: Dict[str, bytes], assistant_name: str
+    filenames_to_bytes: Dict[str, bytes],
+    assistant_name: str,
+    filenames_to_metadata: typing.Optional[Dict[str, Dict[str, str]]] = None,
 ) -> Dict[str, FileObject]:
     """
     Upload files to openai. This removes all pre-existing files that match
-     filenames in `filenames_to_bytes` first and then uploads
+     filenames in `filenames_to_bytes`, or the openai file id in their
+     metadata, first and then uploads
 
     :param filenames_to_bytes:
     :param assistant_name:
+    :param filenames_to_metadata: s3 metadata per filename, see `get_aws_data_and_metadata`
     :return: A dict of fileobjects where the key is the filename
 
     """
     openai_service = OpenAIService(assistant_name)
+    vector_store_id = openai_service.ai_config["vector_store_id"]
+    filenames_to_metadata = filenames_to_metadata or {}
     filename_to_obj: Dict[str, FileObject] = {}
-    existing_ai_files = {a.filename: a for a in openai_service.ai_file.list()}
-    for filename, file_bytes in filenames_to_bytes.items():
-        # openai removes the base path, but we keep it here by replacing
-        # with a "__"
-        filename = filename.replace(os.path.sep, "__")
-        if filename in existing_ai_files:
-            openai_service.ai_file.delete(
-                existing_ai_files[filename].id,
-            )
+    ai_files = list(openai_service.ai_file.list())
+    openai_service.ai_file.cache_filenames(ai_files)
+    existing_ai_files = {a.filename: a for a in ai_files}
+    deleted_any = False
+    for path, file_bytes in filenames_to_bytes.items():
+        filename = get_ai_filename(path)
+        stale_ids = {
+            filenames_to_metadata.get(path, {}).get(OPENAI_FILE_ID_METADATA_KEY),
+            getattr(existing_ai_files.get(filename), "id", None),
+        } - {None}
+        for file_id in stale_ids:
+            if openai_service.ai_vector_store.delete_file(
+                file_id, vector_store_id, bump_version=False
+            ):
+                deleted_any = True
+            openai_service.ai_file.delete(file_id)
         file_obj = openai_service.ai_file.create_file(filename, file_bytes)
         filename_to_obj[filename] = file_obj
+
+    if deleted_any:
+        openai_service.ai_vector_store.bump_version(vector_store_id)
     return filename_to_obj
 
 
 def upload_missing_ai_files(
-    filenames_to_bytes: Dict[str, bytes], assistant_name: str
+    filenames_to_bytes: Dict[str, bytes],
+    assistant_name: str,
+    filenames_to_metadata: typing.Optional[Dict[str, Dict[str, str]]] = None,
+    claimed_file_ids: typing.Optional[typing.Set[str]] = None,
 ) -> Dict[str, FileObject]:
     """
     Upload files to openai. Only files that do not exist will be uploaded.
 
+    A file exists if the openai file id in its s3 metadata still exists, so
+    files renamed or moved in drive keep their openai file. Otherwise it is
+    matched by filename, unless that file is already claimed by another s3
+    object's metadata, like a renamed file that kept its old filename.
+
     :param filenames_to_bytes:
     :param assistant_name:
+    :param filenames_to_metadata: s3 metadata per filename, see `get_aws_data_and_metadata`
+    :param claimed_file_ids: openai file ids in the metadata of s3 objects
+        not in `filenames_to_metadata`
     :return: A dict of fileobjects where the key is the filename
 
     """
     openai_service = OpenAIService(assistant_name)
+    filenames_to_metadata = filenames_to_metadata or {}
+    claimed_file_ids = set(claimed_file_ids or set()) | {
+        metadata[OPENAI_FILE_ID_METADATA_KEY]
+        for metadata in filenames_to_metadata.values()
+        if OPENAI_FILE_ID_METADATA_KEY in metadata
+    }
     filename_to_obj: Dict[str, FileObject] = {}
-    existing_ai_files = {a.filename: a for a in openai_service.ai_file.list()}
-    for filename, file_bytes in filenames_to_bytes.items():
-        # openai removes the base path, but we keep it here by replacing
-        # with a "__"
-        filename = filename.replace(os.path.sep, "__")
-        if filename not in existing_ai_files:
+    ai_files = list(openai_service.ai_file.list())
+    openai_service.ai_file.cache_filenames(ai_files)
+    existing_ai_files = {a.filename: a for a in ai_files if a.id not in claimed_file_ids}
+    existing_ai_file_ids = {a.id: a for a in ai_files}
+    for path, file_bytes in filenames_to_bytes.items():
+        filename = get_ai_filename(path)
+        file_id = filenames_to_metadata.get(path, {}).get(OPENAI_FILE_ID_METADATA_KEY)
+        if file_id in existing_ai_file_ids:
+            filename_to_obj[filename] = existing_ai_file_ids[file_id]
+        elif filename not in existing_ai_files:
             file_obj = openai_service.ai_file.create_file(filename, file_bytes)
             filename_to_obj[filename] = file_obj
         else:
@@ -228,6 +322,34 @@ def upload_missing_ai_files(
     return filename_to_obj
 
 
+def record_ai_file_ids(
+    bucket: str,
+    filenames_to_objects: Dict[str, FileObject],
+    filenames_to_metadata: Dict[str, Dict[str, str]],
+):
+    """
+    Store each file's openai file id in the metadata of its s3 source, so the
+    openai file follows the source when it is renamed or moved.
+
+    :param bucket:
+    :param filenames_to_objects: as returned by `upload_missing_ai_files`
+    :param filenames_to_metadata: as returned by `get_aws_data_and_metadata`
+    :return:
+    """
+    for path, metadata in filenames_to_metadata.items():
+        file_obj = filenames_to_objects.get(get_ai_filename(path))
+        if not file_obj:
+            continue
+
+        _ai_file_keys.set(file_obj.id, metadata["s3_key"])
+        if metadata.get(OPENAI_FILE_ID_METADATA_KEY) == file_obj.id:
+            continue
+
+        s3_metadata = {k: v for k, v in metadata.items() if k != "s3_key"}
+        s3_metadata[OPENAI_FILE_ID_METADATA_KEY] = file_obj.id
+        aws_file_service.update_metadata(bucket, metadata["s3_key"], s3_metadata)
+
+
 def determine_files_to_upload_to_vs(
     filenames_to_objects: Dict[str, FileObject],
     assistant_name: str,
@@ -250,18 +372,424 @@ def determine_files_to_upload_to_vs(
         f.id: f for f in openai_service.ai_vector_store.list_files(vector_store_id)
     }
     already_in_vs = []
+    purged_any = False
     for filename, file_obj in filenames_to_objects.items():
         if file_obj.id in existing_vs_id_to_files:
             if (
                 purge_incomplete
                 and existing_vs_id_to_files[file_obj.id].status != "completed"
             ):
-                openai_service.ai_vector_store.delete_file(file_obj.id, assistant_name)
+                openai_service.ai_vector_store.delete_file(
+                    file_obj.id, vector_store_id, bump_version=False
+                )
+                purged_any = True
                 continue
 
             already_in_vs.append(filename)
 
+    if purged_any:
+        openai_service.ai_vector_store.bump_version(vector_store_id)
     for filename in already_in_vs:
         filenames_to_objects.pop(filename)
 
     return filenames_to_objects
+
+
+def get_claimed_ai_file_ids(
+    bucket: str,
+    file_ids: typing.Iterable[str],
+    released_keys: typing.Iterable[str] = (),
+) -> typing.Set[str]:
+    """
+    The openai file ids that an s3 object's metadata still points to. Only
+    the object each id was last seen on is checked, with one head request,
+    instead of every object in the bucket.
+
+    :param bucket:
+    :param file_ids: the ids to check
+    :param released_keys: s3 keys that no longer count, like removed ones
+    """
+    released_keys = set(released_keys)
+    claimed = set()
+    for file_id in file_ids:
+        key = _ai_file_keys.get(file_id)
+        if key is None or key in released_keys:
+            continue
+
+        try:
+            metadata = aws_file_service.get_metadata(bucket, key)
+        except ClientError:
+            # the object is gone too
+            _ai_file_keys.pop(file_id)
+            continue
+
+        if metadata.get(OPENAI_FILE_ID_METADATA_KEY) == file_id:
+            claimed.add(file_id)
+
+    return claimed
+
+
+def delete_ai_files_for_aws_paths(
+    aws_file_paths_to_ids: Dict[str, typing.Optional[str]],
+    assistant_name: str,
+    keep_file_ids: typing.Optional[typing.Set[str]] = None,
+) -> Dict:
+    """
+    Remove the openai files, and their vector store entries, that were
+    ingested from the given s3 paths. Used when the source files are deleted.
+
+    Files are deleted by id. The id of a path comes from the deleted file's
+    metadata, or for a path removed without it, like one ingested before
+    ids were recorded, from the openai files named after it. Either way a
+    file is kept if another s3 object's metadata points to it, since a moved
+    or renamed object keeps its openai file under the old name. That is
+    checked on the object the id was last seen on, see
+    `get_claimed_ai_file_ids`, so a move seen before a restart isn't known
+    and its file is uploaded again by the next full ingest.
+
+    :param aws_file_paths_to_ids: s3 keys as stored in the bucket, and the
+        openai file id from each deleted file's metadata if it had one
+    :param assistant_name:
+    :param keep_file_ids: openai file ids still used by other s3 files,
+        e.g. the new key of a moved file
+    :return: a dict with the deleted file ids and reclaimed bytes
+    """
+    openai_service = OpenAIService(assistant_name)
+    ai_config = openai_service.ai_config
+    vector_store_id = ai_config["vector_store_id"]
+    bucket = ai_config["s3_bucket_vector_store_files"]
+
+    ai_files: Dict[str, FileObject] = {}
+    filenames = {
+        get_ai_filename(normalized_path)
+        for aws_file_path, file_id in aws_file_paths_to_ids.items()
+        if file_id is None
+        and (normalized_path := normalize_aws_file_path(aws_file_path)) is not None
+    }
+    if filenames:
+        # finding files by name needs the listing
+        ai_files = {
+            f.id: f for f in openai_service.ai_file.list() if f.filename in filenames
+        }
+
+    candidate_ids = (
+        set(ai_files) | {file_id for file_id in aws_file_paths_to_ids.values() if file_id}
+    ) - set(keep_file_ids or set())
+    candidate_ids -= get_claimed_ai_file_ids(
+        bucket, candidate_ids, released_keys=aws_file_paths_to_ids
+    )
+    ai_files = {file_id: f for file_id, f in ai_files.items() if file_id in candidate_ids}
+    ai_files.update(openai_service.ai_file.get_many(candidate_ids - ai_files.keys()))
+
+    file_ids = sorted(ai_files)
+    if not file_ids:
+        return {"deleted_file_ids": [], "reclaimed_bytes": 0}
+
+    openai_service.ai_vector_store.delete_files(file_ids, vector_store_id)
+    deleted_ids = openai_service.ai_file.delete_many(file_ids)
+    for file_id in deleted_ids:
+        _ai_file_keys.pop(file_id)
+
+    return {
+        "deleted_file_ids": deleted_ids,
+        "reclaimed_bytes": sum(ai_files[i].bytes or 0 for i in deleted_ids),
+    }
+
+
+def ingest_aws_file_events(events: typing.List[S3Event], assistant_name: str) -> Dict:
+    """
+    Ingest or remove only the s3 objects named in `events`, instead of
+    rescanning the bucket.
+
+    Uploaded objects replace their openai file and vector store entry.
+    Copied objects that already have an openai file id in their metadata are
+    moves or metadata updates and are skipped, and that file is kept even if
+    the old key's removal is in the same batch.
+
+    :param events: settled events, at most one per object
+    :param assistant_name:
+    :return: a dict summarizing the ingested and removed files
+    """
+    openai_service = OpenAIService(assistant_name)
+    ai_config = openai_service.ai_config
+    bucket = ai_config["s3_bucket_vector_store_files"]
+    folders: typing.List[str] = ai_config.get("s3_folder_prefix", [])
+
+    events = [
+        e
+        for e in events
+        if e.bucket == bucket
+        and any(e.key.startswith(folder) for folder in folders)
+        and normalize_aws_file_path(e.key) is not None
+    ]
+
+    uploaded: Dict[str, bytes] = {}
+    copied: Dict[str, bytes] = {}
+    filenames_to_metadata: Dict[str, Dict[str, str]] = {}
+    live_file_ids = set()
+    for event in events:
+        if event.is_removed:
+            continue
+
+        path = typing.cast(str, normalize_aws_file_path(event.key))
+        try:
+            if event.is_copy:
+                metadata = aws_file_service.get_metadata(bucket, event.key)
+                if OPENAI_FILE_ID_METADATA_KEY in metadata:
+                    live_file_ids.add(metadata[OPENAI_FILE_ID_METADATA_KEY])
+                    _ai_file_keys.set(metadata[OPENAI_FILE_ID_METADATA_KEY], event.key)
+                    continue
+
+            content, metadata = aws_file_service.get_file(bucket, event.key)
+        except ClientError as e:
+            # removed again since the event was sent
+            logging.warning("Skipping %s: %s", event.key, e)
+            continue
+
+        (copied if event.is_copy else uploaded)[path] = content
+        filenames_to_metadata[path] = {**metadata, "s3_key": event.key}
+
+    filenames_to_objects: Dict[str, FileObject] = {}
+    if uploaded:
+        filenames_to_objects.update(
+            upload_ai_files(uploaded, assistant_name, filenames_to_metadata)
+        )
+    if copied:
+        # files seen on other objects that a copy could be matched to by name
+        copied_filenames = {get_ai_filename(path) for path in copied}
+        known_filenames = openai_service.ai_file.get_filenames(
+            file_id for file_id, _key in _ai_file_keys.items()
+        )
+        filenames_to_objects.update(
+            upload_missing_ai_files(
+                copied,
+                assistant_name,
+                filenames_to_metadata,
+                claimed_file_ids=get_claimed_ai_file_ids(
+                    bucket,
+                    [i for i, name in known_filenames.items() if name in copied_filenames],
+                ),
+            )
+        )
+    record_ai_file_ids(bucket, filenames_to_objects, filenames_to_metadata)
+
+    statuses: typing.List[OpenAiFileStatus] = []
+    filenames_to_objects_for_upload = determine_files_to_upload_to_vs(
+        filenames_to_objects, assistant_name
+    ) if filenames_to_objects else {}
+    if filenames_to_objects_for_upload:
+        statuses = openai_service.ai_vector_store.create_files(
+            filenames_to_objects_for_upload,
+            ai_config["vector_store_id"],
+            chunking_strategies=ai_config.get("chunking_strategies"),
+        )
+
+    removed_keys = [e.key for e in events if e.is_removed]
+    removed = {"deleted_file_ids": [], "reclaimed_bytes": 0}
+    if removed_keys:
+        removed = delete_ai_files_for_aws_paths(
+            dict.fromkeys(removed_keys), assistant_name, keep_file_ids=live_file_ids
+        )
+
+    resp = {"ingested": create_response(statuses), "removed": removed}
+    logging.info(f"Ingested s3 events for {assistant_name}: {resp}")
+    schedule_search_index_update(assistant_name)
+    return resp
+
+
+def update_search_index(assistant_name: str, full: bool = False) -> Dict:
+    """
+    Update an assistant's local search index from the same s3 folders the
+    vector store is ingested from. Objects are versioned by etag, so only
+    changed objects are downloaded.
+
+    :param assistant_name:
+    :param full: re-extract every object
+    :return: counts of what changed
+    """
+    ai_config = OpenAIService(assistant_name).ai_config
+    bucket = ai_config["s3_bucket_vector_store_files"]
+    folders: typing.List[str] = ai_config.get("s3_folder_prefix", [])
+
+    versions: Dict[str, str] = {}
+    keys: Dict[str, str] = {}
+    for folder in folders:
+        for obj in aws_file_service.list_objects(bucket, folder):
+            path = normalize_aws_file_path(obj["Key"])
+            if path is not None:
+                versions[path] = obj["ETag"]
+                keys[path] = obj["Key"]
+
+    return get_corpus_index(assistant_name).update(
+        versions,
+        lambda path: aws_file_service.get_file_content(bucket, keys[path]),
+        full=full,
+    )
+
+
+def refresh_insights(assistant_name: str) -> Dict:
+    """
+    Recompute an assistant's precomputed insights, if it has any. In batch
+    mode this only submits the batch, see `collect_insights`.
+    """
+    openai_service = OpenAIService(assistant_name)
+    if not openai_service.ai_config.get("insights"):
+        return {"status": "skipped", "reason": "no insights config"}
+
+    resp = InsightsService(openai_service).refresh()
+    logging.info(f"Refreshed insights for {assistant_name}: {resp}")
+    return resp
+
+
+def collect_insights(assistant_name: str) -> Dict:
+    """
+    Store the answers of an assistant's insights batch once it's done.
+    """
+    openai_service = OpenAIService(assistant_name)
+    if not openai_service.ai_config.get("insights"):
+        return {"status": "skipped", "reason": "no insights config"}
+
+    return InsightsService(openai_service).collect()
+
+
+# openai file id -> the s3 key whose metadata was last seen pointing to it,
+# from recorded ids and copy events, so removals only check those keys
+_ai_file_keys = LRUCache(maxsize=10000)
+
+# assistants with a search index update running, and whether another was
+# requested while it ran
+_search_index_updates: Dict[str, bool] = {}
+_search_index_updates_lock = threading.Lock()
+
+
+def schedule_search_index_update(assistant_name: str):
+    """
+    Update the local search index in the background, if the assistant uses
+    one. Requests made during an update are folded into one more update.
+    """
+    if not OpenAIService(assistant_name).ai_config.get("local_search"):
+        return
+
+    with _search_index_updates_lock:
+        if assistant_name in _search_index_updates:
+            _search_index_updates[assistant_name] = True
+            return
+        _search_index_updates[assistant_name] = False
+
+    def run():
+        while True:
+            try:
+                stats = update_search_index(assistant_name)
+                if stats["changed"] or stats["removed"]:
+                    refresh_insights(assistant_name)
+            except Exception:
+                logging.exception("Failed to update the %s search index", assistant_name)
+
+            with _search_index_updates_lock:
+                if not _search_index_updates[assistant_name]:
+                    del _search_index_updates[assistant_name]
+                    return
+                _search_index_updates[assistant_name] = False
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def collect_orphaned_ai_files(assistant_name: str, dry_run: bool = False) -> Dict:
+    """
+    Find and delete orphaned openai files and vector store entries for an
+    assistant by diffing the openai files, the vector store files and the
+    source s3 keys.
+
+    Orphans are:
+     - vector store entries whose openai file no longer exists
+     - ingested openai files whose s3 source no longer exists, by filename
+       or by the openai file id in the s3 metadata
+     - older duplicates of an ingested openai file (from re-uploads)
+
+    Only openai files named under the assistant's s3 folders are considered,
+    so attachments uploaded from slack are left alone.
+
+    :param assistant_name:
+    :param dry_run: only report what would be deleted
+    :return: a dict summarizing the deleted ids and reclaimed bytes
+    """
+    openai_service = OpenAIService(assistant_name)
+    ai_config = openai_service.ai_config
+    vector_store_id = ai_config["vector_store_id"]
+    bucket = ai_config["s3_bucket_vector_store_files"]
+    folders: typing.List[str] = ai_config.get("s3_folder_prefix", [])
+
+    source_filenames = set()
+    source_file_ids = set()
+    for folder in folders:
+        for aws_file_path, metadata in aws_file_service.get_files_metadata(
+            bucket, folder
+        ).items():
+            normalized_path = normalize_aws_file_path(aws_file_path)
+            if normalized_path is not None:
+                source_filenames.add(get_ai_filename(normalized_path))
+                source_file_ids.add(metadata.get(OPENAI_FILE_ID_METADATA_KEY))
+
+    # listings are paged to the end, or raise. The vector store goes first, so
+    # a file added to it while listing is also in the files listing and
+    # isn't taken for a dangling entry.
+    vs_files = {f.id: f for f in openai_service.ai_vector_store.list_files(vector_store_id)}
+    ai_files = {f.id: f for f in openai_service.ai_file.list()}
+    namespace = tuple(get_ai_filename(folder) for folder in folders)
+    ingested_ids = {
+        file_id for file_id, f in ai_files.items() if f.filename.startswith(namespace)
+    }
+
+    dangling_vs_ids = vs_files.keys() - ai_files.keys()
+    # renamed sources keep their openai file under the old filename
+    stale_ids = {
+        file_id
+        for file_id in ingested_ids - source_file_ids
+        if ai_files[file_id].filename not in source_filenames
+    }
+
+    # keep the copy an s3 source points to or that is in the vector store,
+    # otherwise the newest one
+    filename_to_ids: Dict[str, typing.List[str]] = {}
+    for file_id in ingested_ids - stale_ids:
+        filename_to_ids.setdefault(ai_files[file_id].filename, []).append(file_id)
+    duplicate_ids = set()
+    for file_ids in filename_to_ids.values():
+        if len(file_ids) > 1:
+            file_ids.sort(
+                key=lambda i: (
+                    i in source_file_ids,
+                    i in vs_files,
+                    ai_files[i].created_at,
+                ),
+                reverse=True,
+            )
+            duplicate_ids.update(set(file_ids[1:]) - source_file_ids)
+
+    orphaned_ids = stale_ids | duplicate_ids
+    vs_ids_to_delete = dangling_vs_ids | (orphaned_ids & vs_files.keys())
+    reclaimed_bytes = sum(ai_files[i].bytes or 0 for i in orphaned_ids) + sum(
+        vs_files[i].usage_bytes or 0 for i in vs_ids_to_delete
+    )
+
+    logging.info(
+        "%s orphans: %s dangling vector store files, %s stale files, %s duplicate files",
+        assistant_name,
+        len(dangling_vs_ids),
+        len(stale_ids),
+        len(duplicate_ids),
+    )
+
+    if not dry_run:
+        openai_service.ai_vector_store.delete_files(
+            list(vs_ids_to_delete), vector_store_id
+        )
+        openai_service.ai_file.delete_many(list(orphaned_ids))
+
+    return {
+        "dry_run": dry_run,
+        "dangling_vector_store_file_ids": sorted(dangling_vs_ids),
+        "stale_file_ids": sorted(stale_ids),
+        "duplicate_file_ids": sorted(duplicate_ids),
+        "reclaimed_bytes": reclaimed_bytes,
+    }
@@ -6,6 +6,8 @@ from app.services.get_secret import get_secret
 
 from app.services.google_service import google_drive_service
 from app.services.aws import aws_file_service
+from app.routes.openai.utils import delete_ai_files_for_aws_paths
+from app.services.file_service import OPENAI_FILE_ID_METADATA_KEY
 
 # from scheduler import scheduler or your preffered scheduler setup
 
@@ -30,7 +32,20 @@ class TransferJob(BaseModel):
 #     timezone="America/New_York",
 # )
 @router.post("/gdrive-battlecards-to-s3")
-def run_transfer_job():
+def run_transfer_job(
+    mirror: bool = False,
+    max_delete_fraction: float = 0.2,
+    assistant_name: str = "competitor",
+    dry_run: bool = False,
+):
+    """
+    Copy new battlecards from the drive folder to s3.
+
+    With `mirror`, files that were deleted, trashed or moved in drive are
+    also removed from s3 and from `assistant_name`'s openai files and vector
+    store. It aborts without deleting if more than `max_delete_fraction` of
+    the s3 files would be removed.
+    """
     folder_id = get_secret('FOLDER_ID')
     transfer_job = TransferJob(
         bucket_name=get_secret('BUCKET_NAME'),
@@ -39,14 +54,25 @@ def run_transfer_job():
     )
 
     try:
-        transferred_file_ct = google_drive_service.copy_my_drive_folder_to_service(
-            
-            bucket_name=transfer_job.bucket_name,
-            prefix=transfer_job.s3_folder_prefix,
-            service=aws_file_service,
-            folder_id=folder_id,
-            dry_run=False
-        )
+        if mirror:
+            transferred_file_ct, deleted_keys = google_drive_service.mirror_my_drive_folder_to_service(
+                bucket_name=transfer_job.bucket_name,
+                prefix=transfer_job.s3_folder_prefix,
+                service=aws_file_service,
+                folder_id=folder_id,
+                max_delete_fraction=max_delete_fraction,
+                dry_run=dry_run,
+            )
+        else:
+            transferred_file_ct = google_drive_service.copy_my_drive_folder_to_service(
+                
+                bucket_name=transfer_job.bucket_name,
+                prefix=transfer_job.s3_folder_prefix,
+                service=aws_file_service,
+                folder_id=folder_id,
+                dry_run=dry_run
+            )
+            deleted_keys = {}
 
         # msg = f"Transfer of {transferred_file_ct} files from {transfer_job.gdrive_name} to {transfer_job.bucket_name} complete."
         # slack_service.send_message(
@@ -57,13 +83,29 @@ def run_transfer_job():
 
         msg = f"✅ Transferred {transferred_file_ct} file(s) from Google Drive folder ID '{folder_id}' to S3 bucket '{transfer_job.bucket_name}' under prefix '{transfer_job.s3_folder_prefix}'."
         print(msg)
-        return {"message": msg} 
+
+        if not mirror:
+            return {"message": msg}
+
+        deleted = {"deleted_file_ids": [], "reclaimed_bytes": 0}
+        if deleted_keys and not dry_run:
+            deleted = delete_ai_files_for_aws_paths(
+                {
+                    key: metadata.get(OPENAI_FILE_ID_METADATA_KEY)
+                    for key, metadata in deleted_keys.items()
+                },
+                assistant_name,
+            )
+
+        msg += f" {'Would delete' if dry_run else 'Deleted'} {len(deleted_keys)} file(s) no longer in Google Drive."
+        return {
+            "message": msg,
+            "deleted_keys": list(deleted_keys),
+            **deleted,
+        }
 
 
     except Exception as e:
         msg = f"Unexpected error transferring from {transfer_job.gdrive_name} to {transfer_job.bucket_name}: {e}"
         logging.error(msg)
         return msg
-
-
-
@@ -1,10 +1,13 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from typing import Dict, Iterator, List, Tuple
 
 from botocore.exceptions import ClientError
 
 from app.services.aws import AWSService
 from app.services.file_service import FileService
+from app.utils import chunker
 
 
 class AWSFilesService(AWSService, FileService):
@@ -20,20 +23,28 @@ class AWSFilesService(AWSService, FileService):
         bytes_to_store.seek(0)
         self.s3_client.upload_fileobj(bytes_to_store, bucket_name, s3_path)
 
-    def list_files(self, bucket_name: str):
+    def list_files(self, bucket_name: str, prefix: str = ""):
         """
         Create a generator that retrieves all files in the bucket.
 
         :param bucket_name:
+        :param prefix: only list keys starting with this prefix
         :return:
         """
+        for obj in self.list_objects(bucket_name, prefix):
+            yield obj["Key"]
+
+    def list_objects(self, bucket_name: str, prefix: str = "") -> Iterator[Dict]:
+        """
+        Like `list_files`, but yields the listed objects, with their "Key",
+        "ETag", "Size" and "LastModified".
+        """
         try:
             paginator = self.s3_client.get_paginator("list_objects_v2")
 
-            for page in paginator.paginate(Bucket=bucket_name):
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
                 if "Contents" in page:
-                    for obj in page["Contents"]:
-                        yield obj["Key"]
+                    yield from page["Contents"]
         except Exception:
             logging.error(f"Unable to list files in {bucket_name}")
             raise
@@ -46,6 +57,74 @@ class AWSFilesService(AWSService, FileService):
             logging.error(f"Unable to get file content for {s3_path}: {e}")
             raise
 
+    def get_file(self, bucket_name: str, s3_path: str) -> Tuple[bytes, Dict[str, str]]:
+        """
+        Get the content and user metadata of a file in one request
+
+        :param bucket_name:
+        :param s3_path:
+        :return:
+        """
+        try:
+            response = self.s3_client.get_object(Bucket=bucket_name, Key=s3_path)
+            return response["Body"].read(), response.get("Metadata", {})
+        except Exception as e:
+            logging.error(f"Unable to get file for {s3_path}: {e}")
+            raise
+
+    def get_metadata(self, bucket_name: str, s3_path: str) -> Dict[str, str]:
+        try:
+            response = self.s3_client.head_object(Bucket=bucket_name, Key=s3_path)
+            return response.get("Metadata", {})
+        except Exception as e:
+            logging.error(f"Unable to get metadata for {s3_path}: {e}")
+            raise
+
+    def get_files_metadata(
+        self, bucket_name: str, prefix: str = "", max_workers: int = 16
+    ) -> Dict[str, Dict[str, str]]:
+        """
+        Get the user metadata of every file under a prefix. Listing doesn't
+        return metadata, so the head requests are made concurrently.
+
+        :param bucket_name:
+        :param prefix:
+        :param max_workers:
+        :return: a dict of s3 path to metadata
+        """
+        s3_paths = list(self.list_files(bucket_name, prefix))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            metadata = executor.map(
+                lambda s3_path: self.get_metadata(bucket_name, s3_path), s3_paths
+            )
+            return dict(zip(s3_paths, metadata))
+
+    def update_metadata(self, bucket: str, file_path: str, metadata: dict) -> None:
+        """
+        Replace the user metadata of a file. This is a server side copy, the
+        content isn't downloaded.
+        """
+        self.s3_client.copy_object(
+            Bucket=bucket,
+            Key=file_path,
+            CopySource={"Bucket": bucket, "Key": file_path},
+            Metadata=metadata,
+            MetadataDirective="REPLACE",
+        )
+
+    def move(self, bucket: str, file_path: str, new_file_path: str, metadata: dict) -> None:
+        """
+        Move a file to a new key with a server side copy, replacing its metadata.
+        """
+        self.s3_client.copy_object(
+            Bucket=bucket,
+            Key=new_file_path,
+            CopySource={"Bucket": bucket, "Key": file_path},
+            Metadata=metadata,
+            MetadataDirective="REPLACE",
+        )
+        self.s3_client.delete_object(Bucket=bucket, Key=file_path)
+
     def does_file_exist(self, bucket: str, file_path: str) -> bool:
         try:
             _ = self.s3_client.head_object(Bucket=bucket, Key=file_path)
@@ -65,3 +144,25 @@ class AWSFilesService(AWSService, FileService):
             Body=record,
             Metadata=metadata,
         )
+
+    def delete_files(self, bucket: str, file_paths: List[str]) -> List[str]:
+        """
+        Delete files in bulk, up to 1000 keys per request.
+
+        :param bucket:
+        :param file_paths:
+        :return: the keys that were deleted
+        """
+        deleted = []
+        for keys in chunker(file_paths, 1000):
+            resp = self.s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": key} for key in keys], "Quiet": False},
+            )
+            deleted.extend(d["Key"] for d in resp.get("Deleted", []))
+            for error in resp.get("Errors", []):
+                logging.error(
+                    "Unable to delete %s: %s", error.get("Key"), error.get("Message")
+                )
+
+        return deleted
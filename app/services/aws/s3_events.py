@@ -0,0 +1,278 @@
+import json
+import logging
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import unquote_plus
+
+from pydantic import BaseModel
+
+
+class S3Event(BaseModel):
+    bucket: str
+    key: str
+    event_name: str
+    event_time: Optional[str] = None
+
+    @property
+    def is_removed(self) -> bool:
+        return self.event_name.startswith("ObjectRemoved")
+
+    @property
+    def is_copy(self) -> bool:
+        return self.event_name == "ObjectCreated:Copy"
+
+
+def parse_s3_notification(body: Dict | str) -> List[S3Event]:
+    """
+    Parse an s3 event notification into `S3Event`s. Notifications delivered
+    through sns are unwrapped, and s3's test event is ignored.
+
+    :param body: the notification as a dict or json string
+    :return:
+    """
+    if isinstance(body, str):
+        body = json.loads(body)
+
+    # sns wraps the s3 notification as a json string
+    if "Message" in body and "Records" not in body:
+        return parse_s3_notification(body["Message"])
+
+    events = []
+    for record in body.get("Records", []):
+        if "s3" not in record:
+            continue
+        events.append(
+            S3Event(
+                bucket=record["s3"]["bucket"]["name"],
+                key=unquote_plus(record["s3"]["object"]["key"]),
+                event_name=record["eventName"].removeprefix("s3:"),
+                event_time=record.get("eventTime"),
+            )
+        )
+
+    return events
+
+
+class S3EventSource(ABC):
+    @abstractmethod
+    def receive(self, wait_secs: float) -> Tuple[List[S3Event], Dict[str, List[S3Event]]]:
+        """
+        Wait up to `wait_secs` for events.
+
+        :return: the events, and the receipts to `ack` once they're handled
+            with the events each one delivered
+        """
+        pass
+
+    def ack(self, receipts: List[str]):
+        pass
+
+
+class SQSEventSource(S3EventSource):
+    """
+    Reads s3 notifications from an sqs queue. Messages are only deleted
+    once acked, so unhandled events are redelivered.
+    """
+
+    def __init__(self, sqs_client, queue_url: str):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+
+    def receive(self, wait_secs: float) -> Tuple[List[S3Event], Dict[str, List[S3Event]]]:
+        resp = self.sqs_client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=min(int(wait_secs), 20),
+        )
+        events: List[S3Event] = []
+        receipts: Dict[str, List[S3Event]] = {}
+        for message in resp.get("Messages", []):
+            message_events: List[S3Event] = []
+            try:
+                message_events = parse_s3_notification(message["Body"])
+            except (ValueError, KeyError) as e:
+                logging.warning("Skipping unparsable s3 notification: %s", e)
+            events.extend(message_events)
+            receipts[message["ReceiptHandle"]] = message_events
+
+        return events, receipts
+
+    def ack(self, receipts: List[str]):
+        for i in range(0, len(receipts), 10):
+            self.sqs_client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {"Id": str(n), "ReceiptHandle": receipt}
+                    for n, receipt in enumerate(receipts[i : i + 10])
+                ],
+            )
+
+
+class FileEventSource(S3EventSource):
+    """
+    Local stand-in for a queue that follows a file of s3 notifications,
+    one json notification per line.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.position = 0
+
+    def receive(self, wait_secs: float) -> Tuple[List[S3Event], Dict[str, List[S3Event]]]:
+        events: List[S3Event] = []
+        try:
+            with open(self.path) as f:
+                f.seek(self.position)
+                for line in iter(f.readline, ""):
+                    if not line.endswith("\n"):
+                        break
+                    self.position = f.tell()
+                    if line.strip():
+                        events.extend(parse_s3_notification(line))
+        except FileNotFoundError:
+            pass
+
+        if not events:
+            time.sleep(wait_secs)
+        return events, {}
+
+
+class QueueEventSource(S3EventSource):
+    """
+    In process stand-in for a queue. Notifications are added with `put`.
+    """
+
+    def __init__(self):
+        self.queue: queue.Queue = queue.Queue()
+
+    def put(self, notification: Dict | str):
+        for event in parse_s3_notification(notification):
+            self.queue.put(event)
+
+    def receive(self, wait_secs: float) -> Tuple[List[S3Event], Dict[str, List[S3Event]]]:
+        try:
+            events = [self.queue.get(timeout=wait_secs)]
+        except queue.Empty:
+            return [], {}
+
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events, {}
+
+
+class S3EventDebouncer:
+    """
+    Collapses bursts of events for the same object. Only the latest event
+    per object is kept, and it is released once the object has been quiet
+    for `quiet_secs`, or `max_wait_secs` after its first event.
+    """
+
+    def __init__(self, quiet_secs: float = 2.0, max_wait_secs: float = 10.0):
+        self.quiet_secs = quiet_secs
+        self.max_wait_secs = max_wait_secs
+        # (bucket, key) -> (event, first seen, last seen)
+        self.pending: Dict[Tuple[str, str], Tuple[S3Event, float, float]] = {}
+
+    def add(self, events: List[S3Event]):
+        now = time.monotonic()
+        for event in events:
+            obj = (event.bucket, event.key)
+            first_seen = self.pending[obj][1] if obj in self.pending else now
+            self.pending[obj] = (event, first_seen, now)
+
+    def pop_ready(self) -> List[S3Event]:
+        now = time.monotonic()
+        ready = [
+            obj
+            for obj, (_, first_seen, last_seen) in self.pending.items()
+            if now - last_seen >= self.quiet_secs
+            or now - first_seen >= self.max_wait_secs
+        ]
+        return [self.pending.pop(obj)[0] for obj in ready]
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __contains__(self, obj: Tuple[str, str]) -> bool:
+        return obj in self.pending
+
+
+class S3EventConsumer:
+    """
+    Consumes events from a source, debounces them and passes the settled
+    events to `handler` in batches.
+    """
+
+    def __init__(
+        self,
+        source: S3EventSource,
+        handler: Callable[[List[S3Event]], None],
+        quiet_secs: float = 2.0,
+        max_wait_secs: float = 10.0,
+        poll_secs: float = 1.0,
+    ):
+        self.source = source
+        self.handler = handler
+        self.debouncer = S3EventDebouncer(quiet_secs, max_wait_secs)
+        self.poll_secs = poll_secs
+        # receipt -> the objects it delivered events for
+        self.pending_receipts: Dict[str, Set[Tuple[str, str]]] = {}
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def run_once(self):
+        events, receipts = self.source.receive(
+            self.poll_secs if len(self.debouncer) else self.poll_secs * 5
+        )
+        self.debouncer.add(events)
+        for receipt, receipt_events in receipts.items():
+            self.pending_receipts[receipt] = {(e.bucket, e.key) for e in receipt_events}
+
+        ready = self.debouncer.pop_ready()
+        if ready:
+            try:
+                self.handler(ready)
+            except Exception:
+                # leaving the receipts un-acked has sources that support acks
+                # redeliver the events
+                logging.exception("Failed to handle %s s3 events", len(ready))
+                failed = {(e.bucket, e.key) for e in ready}
+                self.pending_receipts = {
+                    receipt: objs
+                    for receipt, objs in self.pending_receipts.items()
+                    if not objs & failed
+                }
+                return
+
+        # a receipt can be acked once none of the objects it delivered events
+        # for are still pending
+        acked = [
+            receipt
+            for receipt, objs in self.pending_receipts.items()
+            if not any(obj in self.debouncer for obj in objs)
+        ]
+        if acked:
+            self.source.ack(acked)
+            for receipt in acked:
+                del self.pending_receipts[receipt]
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logging.exception("Error consuming s3 events")
+                time.sleep(self.poll_secs)
+
+    def start(self) -> threading.Thread:
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self.stop_event.set()
@@ -1,4 +1,9 @@
 from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List
+
+# metadata keys are lower case since s3 lower cases them on upload
+DRIVE_FILE_ID_METADATA_KEY = "drive-file-id"
+OPENAI_FILE_ID_METADATA_KEY = "openai-file-id"
 
 
 class FileService(ABC):
@@ -9,3 +14,25 @@ class FileService(ABC):
     @abstractmethod
     def upload(self, bucket: str, file_path: str, record: bytes, metadata: dict):
         pass
+
+    @abstractmethod
+    def list_files(self, location: str, prefix: str = "") -> Iterator[str]:
+        pass
+
+    @abstractmethod
+    def delete_files(self, location: str, file_paths: List[str]) -> List[str]:
+        pass
+
+    @abstractmethod
+    def get_files_metadata(
+        self, location: str, prefix: str = ""
+    ) -> Dict[str, Dict[str, str]]:
+        pass
+
+    @abstractmethod
+    def move(self, location: str, file_path: str, new_file_path: str, metadata: dict):
+        pass
+
+    @abstractmethod
+    def update_metadata(self, location: str, file_path: str, metadata: dict):
+        pass
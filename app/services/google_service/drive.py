@@ -1,10 +1,15 @@
 import logging
 import os
+from typing import Dict, List, Optional, Tuple
 
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
-from app.services.file_service import FileService
+from app.services.file_service import (
+    FileService,
+    DRIVE_FILE_ID_METADATA_KEY,
+    OPENAI_FILE_ID_METADATA_KEY,
+)
 from app.services.google_service.google_service import GoogleService
 
 
@@ -41,7 +46,7 @@ class GoogleDriveService(GoogleService):
 
     # Recursive generator with pagination to get all files with full paths
     def get_all_files_with_paths(self, folder_id="root", drive_id=None, parent_path=""):
-        query = f"'{folder_id}' in parents"
+        query = f"'{folder_id}' in parents and trashed = false"
         next_page_token = None
         while True:
             results = self.list_files(drive_id, query, next_page_token)
@@ -179,7 +184,10 @@ class GoogleDriveService(GoogleService):
                         bucket=bucket_name,
                         file_path=_key,
                         record=record,
-                        metadata={"modifiedTime": file["modifiedTime"]},
+                        metadata={
+                            "modifiedTime": file["modifiedTime"],
+                            DRIVE_FILE_ID_METADATA_KEY: file["id"],
+                        },
                     )
                     transferred_file_ct += 1
 
@@ -188,29 +196,83 @@ class GoogleDriveService(GoogleService):
 
         return transferred_file_ct
 
+    def get_service_key(self, file: Dict, prefix: str) -> str:
+        """
+        Get the remote key for a file yielded by `get_all_files_with_paths`
+
+        :param file:
+        :param prefix:
+        :return:
+        """
+        item_name = file["name"].replace("/", "-")
+        target_mime_type = file.get("shortcutDetails", {}).get("targetMimeType", file["mimeType"])
+        ext = self.get_common_ext_from_mime_type(target_mime_type)
+
+        _key = os.path.join(prefix, file["directory"].removeprefix("/"), item_name).strip()
+        return _key.removesuffix(ext) + ext
+
     def copy_my_drive_folder_to_service(
         self,
         folder_id: str,
         bucket_name: str,
         prefix: str,
         service: FileService,
-        dry_run: bool = False 
+        dry_run: bool = False,
+        files: Optional[List[Dict]] = None,
+        remote_metadata: Optional[Dict[str, Dict[str, str]]] = None,
     ) -> int:
         """
         Copies a specific folder from My Drive (not Shared Drive) to a remote service.
+
+        Remote files carry their drive file id in their metadata, so a file
+        that was renamed or moved in drive is moved on the remote instead of
+        being downloaded and uploaded again. The move keeps the openai file
+        id metadata, so it isn't re-embedded either.
+
+        `files` and `remote_metadata` can be passed if the folder and the
+        remote prefix were already listed.
         """
         transferred_file_ct = 0
         try:
-            for file in self.get_all_files_with_paths(folder_id=folder_id, drive_id=None):
-                item_name = file["name"].replace("/", "-")
+            if files is None:
+                files = self.get_all_files_with_paths(folder_id=folder_id, drive_id=None)
+            if remote_metadata is None:
+                remote_metadata = service.get_files_metadata(bucket_name, prefix.rstrip("/") + "/")
+
+            drive_id_to_key = {
+                metadata[DRIVE_FILE_ID_METADATA_KEY]: key
+                for key, metadata in remote_metadata.items()
+                if DRIVE_FILE_ID_METADATA_KEY in metadata
+            }
+
+            for file in files:
                 target_id = file.get("shortcutDetails", {}).get("targetId", file["id"])
-                target_mime_type = file.get("shortcutDetails", {}).get("targetMimeType", file["mimeType"])
-                ext = self.get_common_ext_from_mime_type(target_mime_type)
+                _key = self.get_service_key(file, prefix)
+                metadata = {
+                    "modifiedTime": file["modifiedTime"],
+                    DRIVE_FILE_ID_METADATA_KEY: file["id"],
+                }
+
+                old_key = drive_id_to_key.get(file["id"])
+                if old_key == _key:
+                    continue
+
+                existing_metadata = remote_metadata.get(old_key or _key, {})
+                if OPENAI_FILE_ID_METADATA_KEY in existing_metadata:
+                    metadata[OPENAI_FILE_ID_METADATA_KEY] = existing_metadata[OPENAI_FILE_ID_METADATA_KEY]
 
-                _key = os.path.join(prefix, file["directory"].removeprefix("/"), item_name).strip()
-                _key = _key.removesuffix(ext) + ext
+                if old_key is not None:
+                    if dry_run:
+                        print(f"[DRY RUN] Would move file: {old_key} -> {_key}")
+                    else:
+                        logging.info("%s was renamed or moved, moving to %s", old_key, _key)
+                        service.move(bucket_name, old_key, _key, metadata)
+                    continue
 
-                if service.does_file_exist(bucket_name, _key):
+                if _key in remote_metadata:
+                    # copied before drive ids were tracked, record it for next time
+                    if not dry_run:
+                        service.update_metadata(bucket_name, _key, metadata)
                     continue
 
                 if "md5Checksum" in file:
@@ -229,7 +291,7 @@ class GoogleDriveService(GoogleService):
                         bucket=bucket_name,
                         file_path=_key,
                         record=record,
-                        metadata={"modifiedTime": file["modifiedTime"]},
+                        metadata=metadata,
                     )
                 transferred_file_ct += 1
 
@@ -238,4 +300,74 @@ class GoogleDriveService(GoogleService):
 
         return transferred_file_ct
 
-    
+    def mirror_my_drive_folder_to_service(
+        self,
+        folder_id: str,
+        bucket_name: str,
+        prefix: str,
+        service: FileService,
+        max_delete_fraction: float = 0.2,
+        dry_run: bool = False,
+    ) -> Tuple[int, Dict[str, Dict[str, str]]]:
+        """
+        Copies a My Drive folder to a remote service like
+        `copy_my_drive_folder_to_service`, then deletes remote files under
+        `prefix` that were deleted or trashed in drive. Renamed and moved
+        files are moved rather than deleted.
+
+        Nothing is deleted if more than `max_delete_fraction` of the remote
+        files would be removed, since that is more likely a sharing or
+        listing problem than a cleanup.
+
+        :param folder_id:
+        :param bucket_name:
+        :param prefix:
+        :param service:
+        :param max_delete_fraction:
+        :param dry_run:
+        :return: the number of transferred files and the deleted remote
+            keys with the metadata they had
+        """
+        remote_prefix = prefix.rstrip("/") + "/"
+        # a listing error must not be mistaken for deleted files, so it is
+        # not caught here
+        files = list(self.get_all_files_with_paths(folder_id=folder_id, drive_id=None))
+        remote_metadata = service.get_files_metadata(bucket_name, remote_prefix)
+        transferred_file_ct = self.copy_my_drive_folder_to_service(
+            folder_id=folder_id,
+            bucket_name=bucket_name,
+            prefix=prefix,
+            service=service,
+            dry_run=dry_run,
+            files=files,
+            remote_metadata=remote_metadata,
+        )
+
+        # listed again since renamed files were moved by the copy
+        drive_keys = {self.get_service_key(file, prefix) for file in files}
+        drive_ids = {file["id"] for file in files}
+        remote_keys = set(service.list_files(bucket_name, remote_prefix))
+        stale_keys = sorted(
+            key
+            for key in remote_keys - drive_keys
+            if remote_metadata.get(key, {}).get(DRIVE_FILE_ID_METADATA_KEY) not in drive_ids
+        )
+
+        if not stale_keys:
+            return transferred_file_ct, {}
+
+        delete_fraction = len(stale_keys) / len(remote_keys)
+        if delete_fraction > max_delete_fraction:
+            raise ValueError(
+                f"Refusing to delete {len(stale_keys)} of {len(remote_keys)} files "
+                f"under {prefix} ({delete_fraction:.0%} > {max_delete_fraction:.0%})"
+            )
+
+        if dry_run:
+            for key in stale_keys:
+                print(f"[DRY RUN] Would delete file: {key}")
+            return transferred_file_ct, {key: remote_metadata.get(key, {}) for key in stale_keys}
+
+        deleted_keys = service.delete_files(bucket_name, stale_keys)
+        logging.info("Deleted %s files no longer in drive", len(deleted_keys))
+        return transferred_file_ct, {key: remote_metadata.get(key, {}) for key in deleted_keys}
@@ -0,0 +1,3 @@
+from app.services.metrics.metrics import MetricsService
+
+metrics_service = MetricsService()
@@ -0,0 +1,150 @@
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+
+class MetricsService:
+    """
+    Counters and samples kept in a local sqlite database, so the fastapi
+    process can report on what the slack bolt process records.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv("METRICS_DB_PATH") or "metrics.sqlite3"
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared across threads or forked processes
+        if getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._create_tables(connection)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return self._local.connection
+
+    @staticmethod
+    def _create_tables(connection: sqlite3.Connection):
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT NOT NULL,
+                labels TEXT NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY (name, labels)
+            )
+            """
+        )
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS samples (
+                name TEXT NOT NULL,
+                labels TEXT NOT NULL,
+                value REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS samples_name ON samples (name, created_at)"
+        )
+
+    def increment(self, name: str, value: float = 1, **labels: str):
+        """
+        Increment a counter. Failures are logged and never raised, metrics
+        shouldn't break a request.
+
+        :param name:
+        :param value:
+        :param labels: e.g. assistant="competitor"
+        :return:
+        """
+        try:
+            self.connection.execute(
+                """
+                INSERT INTO counters (name, labels, value) VALUES (?, ?, ?)
+                ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value
+                """,
+                (name, json.dumps(labels, sort_keys=True), value),
+            )
+        except sqlite3.Error as e:
+            logging.warning("Failed to increment %s: %s", name, e)
+
+    def get_counters(self, name: Optional[str] = None) -> List[Dict]:
+        query = "SELECT name, labels, value FROM counters"
+        params: tuple = ()
+        if name:
+            query += " WHERE name = ?"
+            params = (name,)
+
+        return [
+            {"name": row[0], "labels": json.loads(row[1]), "value": row[2]}
+            for row in self.connection.execute(query + " ORDER BY name, labels", params)
+        ]
+
+    def observe(self, name: str, value: float, **labels: str):
+        """
+        Record a sample, e.g. a duration. Like `increment`, failures are only
+        logged.
+
+        :param name:
+        :param value:
+        :param labels:
+        :return:
+        """
+        try:
+            self.connection.execute(
+                "INSERT INTO samples (name, labels, value, created_at) VALUES (?, ?, ?, ?)",
+                (name, json.dumps(labels, sort_keys=True), value, time.time()),
+            )
+        except sqlite3.Error as e:
+            logging.warning("Failed to observe %s: %s", name, e)
+
+    def get_percentiles(
+        self,
+        name: str,
+        group_by: Sequence[str] = (),
+        since: Optional[float] = None,
+        percentiles: Sequence[int] = (50, 95, 99),
+        **labels: str,
+    ) -> List[Dict]:
+        """
+        Percentiles of a sample, by nearest rank.
+
+        :param name:
+        :param group_by: labels to report separately, e.g. ["stage"]
+        :param since: only samples recorded after this `time.time()`
+        :param percentiles:
+        :param labels: only samples with these labels
+        :return: per group its labels, sample count and "p<n>" values
+        """
+        query = "SELECT labels, value FROM samples WHERE name = ?"
+        params: tuple = (name,)
+        if since is not None:
+            query += " AND created_at >= ?"
+            params += (since,)
+
+        groups: Dict[tuple, List[float]] = {}
+        for row in self.connection.execute(query, params):
+            sample_labels = json.loads(row[0])
+            if any(sample_labels.get(k) != v for k, v in labels.items()):
+                continue
+            key = tuple(sample_labels.get(label) for label in group_by)
+            groups.setdefault(key, []).append(row[1])
+
+        results = []
+        for key, values in sorted(groups.items(), key=lambda item: str(item[0])):
+            values.sort()
+            result: Dict = {"labels": dict(zip(group_by, key)), "count": len(values)}
+            for p in percentiles:
+                rank = max(math.ceil(p / 100 * len(values)), 1)
+                result[f"p{p}"] = round(values[rank - 1], 3)
+            results.append(result)
+        return results
@@ -0,0 +1,140 @@
+import contextvars
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from app.services.metrics import metrics_service
+
+QA_LOG_PREFIX = "ai_assistant_qa"
+
+_current_timeline: contextvars.ContextVar[Optional["RunTimeline"]] = contextvars.ContextVar(
+    "run_timeline", default=None
+)
+
+
+class RunTimeline:
+    """
+    Where the time answering one question went, stage by stage, and the
+    tokens its runs used.
+
+    Stages add up if they happen more than once, like polling a run that's
+    back in the queue. Code records into the current timeline with the
+    module's functions like `stage` and `annotate`, which do nothing when no
+    timeline is active, so services don't need one passed around.
+    """
+
+    def __init__(self, assistant_name: str, **labels: str):
+        self.assistant_name = assistant_name
+        self.labels: Dict[str, str] = labels
+        self.stages: Dict[str, float] = {}
+        self.tokens: Dict[str, int] = {}
+        self.info: Dict = {}
+        self.started_at = time.monotonic()
+
+    def add_stage(self, name: str, secs: float):
+        self.stages[name] = self.stages.get(name, 0) + max(secs, 0)
+
+    def add_usage(self, usage):
+        """
+        Add a run's or completion's `usage`, which may be missing.
+        """
+        if usage is None:
+            return
+        for kind in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            self.tokens[kind] = self.tokens.get(kind, 0) + (getattr(usage, kind, 0) or 0)
+
+    def record(self):
+        """
+        Store the stage durations and token counts as metrics samples, and
+        write the structured Q&A log line.
+        """
+        self.add_stage("total", time.monotonic() - self.started_at)
+        labels = {"assistant": self.assistant_name, "tier": "none", "outcome": "none", **self.labels}
+        for name, secs in self.stages.items():
+            metrics_service.observe("question_stage_secs", secs, stage=name, **labels)
+        for kind, count in self.tokens.items():
+            metrics_service.increment("run_tokens", count, kind=kind, **labels)
+            metrics_service.observe("run_tokens", count, kind=kind, **labels)
+
+        log_qa(self)
+
+
+def log_qa(timeline: RunTimeline):
+    logging.info(
+        "%s: %s",
+        QA_LOG_PREFIX,
+        json.dumps(
+            {
+                "ai_assistant": timeline.assistant_name,
+                **timeline.labels,
+                **timeline.info,
+                "stages": {name: round(secs, 3) for name, secs in timeline.stages.items()},
+                "tokens": timeline.tokens,
+            }
+        ),
+    )
+
+
+@contextmanager
+def run_timeline(assistant_name: str, **labels: str) -> Iterator[RunTimeline]:
+    """
+    Make a timeline current for the block and record it at the end. If one
+    is already current, like one started by the slack handler to include
+    queueing and posting, it's used and recorded by its owner instead.
+    """
+    timeline = _current_timeline.get()
+    if timeline is not None:
+        yield timeline
+        return
+
+    timeline = RunTimeline(assistant_name, **labels)
+    token = _current_timeline.set(timeline)
+    try:
+        yield timeline
+    finally:
+        _current_timeline.reset(token)
+        timeline.record()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a block as a stage of the current timeline.
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        add_stage(name, time.monotonic() - start)
+
+
+def add_stage(name: str, secs: float):
+    timeline = _current_timeline.get()
+    if timeline is not None:
+        timeline.add_stage(name, secs)
+
+
+def add_usage(usage):
+    timeline = _current_timeline.get()
+    if timeline is not None:
+        timeline.add_usage(usage)
+
+
+def set_labels(**labels: str):
+    """
+    Label the current timeline's metrics, like with the tier it ran in.
+    """
+    timeline = _current_timeline.get()
+    if timeline is not None:
+        timeline.labels.update(labels)
+
+
+def annotate(**info):
+    """
+    Add details to the current timeline's Q&A log line, like the run id.
+    """
+    timeline = _current_timeline.get()
+    if timeline is not None:
+        timeline.info.update(info)
@@ -0,0 +1,112 @@
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.services.metrics import metrics_service
+from app.services.metrics.timeline import set_labels
+from app.utils import LRUCache, SingleFlight, normalize_text
+
+
+class AnswerCache:
+    """
+    Caches assistant answers by assistant, normalized question and vector
+    store version. Ingesting into or purging the vector store changes its
+    version, so stale answers are never served.
+
+    Identical questions asked while the first is still being answered are
+    coalesced onto its run with `coalesce`.
+    """
+
+    def __init__(self, maxsize: int = 512):
+        self.cache = LRUCache(maxsize=maxsize)
+        self.flights = SingleFlight()
+
+    @staticmethod
+    def get_key(assistant_name: str, question: str, version: str) -> tuple:
+        return assistant_name, normalize_text(question), version
+
+    def get(self, assistant_name: str, question: str, version: str) -> Optional[str]:
+        answer = self.cache.get(self.get_key(assistant_name, question, version))
+        if answer is None:
+            metrics_service.increment("answer_cache_misses", assistant=assistant_name)
+        else:
+            logging.info("Answer cache hit for %s", assistant_name)
+            metrics_service.increment("answer_cache_hits", assistant=assistant_name)
+
+        return answer
+
+    def set(
+        self,
+        assistant_name: str,
+        question: str,
+        version: str,
+        answer: str,
+        ttl_secs: Optional[float] = None,
+    ):
+        self.cache.set(
+            self.get_key(assistant_name, question, version), answer, ttl_secs=ttl_secs
+        )
+
+    def coalesce(
+        self,
+        assistant_name: str,
+        question: str,
+        get_answer: Callable[[], str],
+        variant: str = "",
+    ) -> str:
+        """
+        Answer a question with `get_answer`, unless the same question is
+        already being answered, in which case wait for that answer.
+
+        :param variant: only questions with the same variant, like the
+            latency tier, are coalesced
+        """
+        answer, shared = self.flights.do(
+            (assistant_name, normalize_text(question), variant), get_answer
+        )
+        if shared:
+            self.record_coalesced(assistant_name)
+        return answer
+
+    async def coalesce_async(
+        self,
+        assistant_name: str,
+        question: str,
+        get_answer: Callable[[], Awaitable[str]],
+        variant: str = "",
+    ) -> str:
+        """
+        See `coalesce`
+        """
+        answer, shared = await self.flights.do_async(
+            (assistant_name, normalize_text(question), variant), get_answer
+        )
+        if shared:
+            self.record_coalesced(assistant_name)
+        return answer
+
+    @staticmethod
+    def record_coalesced(assistant_name: str):
+        logging.info("Coalesced a question for %s onto an in-flight run", assistant_name)
+        metrics_service.increment("answer_coalesced", assistant=assistant_name)
+        set_labels(outcome="coalesced")
+
+    def get_recent_answers(self, assistant_name: str, limit: int = 10) -> List[Tuple[str, str]]:
+        """
+        The most recently used questions and answers for an assistant,
+        regardless of vector store version.
+
+        :param assistant_name:
+        :param limit:
+        :return: a list of (normalized question, answer)
+        """
+        recent: Dict[str, str] = {}
+        for (name, question, _version), answer in reversed(self.cache.items()):
+            if name == assistant_name and question not in recent:
+                recent[question] = answer
+            if len(recent) >= limit:
+                break
+
+        return list(recent.items())
+
+
+answer_cache = AnswerCache()
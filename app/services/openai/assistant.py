@@ -2,8 +2,15 @@ import logging
 from typing import List
 from openai.types.beta import Assistant
 from .mixin import OpenAIMixin
+from app.utils import LRUCache
 from openai import OpenAI
 
+# assistant ids known to have the file_search tool. The tool is only ever
+# added here, the ttl covers it being removed in the openai ui.
+_file_search_assistants = LRUCache(maxsize=64, ttl_secs=60 * 60)
+# assistant id -> assistant, so warm-ups and checks don't refetch it
+_assistants = LRUCache(maxsize=64, ttl_secs=10 * 60)
+
 
 class OpenAIAssistant:
     def __init__(self, client: OpenAI):
@@ -18,6 +25,33 @@ class OpenAIAssistant:
             logging.error("Error while getting assistant, %s", assistant_id)
             raise
 
+    def get_cached(self, assistant_id: str) -> Assistant:
+        """
+        Like `get`, cached for a few minutes.
+        """
+        assistant = _assistants.get(assistant_id)
+        if assistant is None:
+            assistant = self.get(assistant_id)
+            _assistants.set(assistant_id, assistant)
+        return assistant
+
+    def ensure_file_search(self, assistant_id: str) -> None:
+        """
+        Add the file_search tool to an assistant if it doesn't have it, which
+        message attachments need. The check is cached.
+        """
+        if assistant_id in _file_search_assistants:
+            return
+
+        assistant = self.get_cached(assistant_id)
+        if "file_search" not in [t.type for t in assistant.tools]:
+            tools = list(assistant.tools)
+            tools.append({"type": "file_search"})  # type: ignore
+            self.openai_client.beta.assistants.update(assistant_id, tools=tools)  # type: ignore
+            _assistants.pop(assistant_id)
+
+        _file_search_assistants.set(assistant_id, True)
+
     @OpenAIMixin.paginate_decorator
     def list(self, **kwargs) -> List[Assistant]:
         try:
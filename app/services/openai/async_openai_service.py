@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import AsyncExitStack
+from typing import Callable, Dict, List, Optional
+
+from openai import APITimeoutError, AsyncOpenAI, BadRequestError
+from openai.lib.streaming import AsyncAssistantEventHandler
+from openai.types.beta.threads import Run
+
+from app.services.metrics.timeline import (
+    add_stage,
+    annotate,
+    run_timeline,
+    stage,
+)
+from app.services.openai.answer_cache import answer_cache
+from app.services.openai.openai_service import (
+    POLLED_RUN_STATUSES,
+    OpenAIService,
+)
+from app.services.openai.sessions import ConversationSession
+
+
+class AsyncOpenAIService:
+    """
+    An asyncio version of `OpenAIService.ask_ai_assistant_question`. Runs are
+    awaited instead of pinning a thread each, so one event loop can have
+    thousands in flight.
+
+    Config, caching, attachments, citations and fallbacks are shared with
+    `OpenAIService`. Its blocking helpers run in a worker thread.
+    """
+
+    def __init__(self, assistant_name: str):
+        self.sync_service = OpenAIService(assistant_name)
+        self.ai_config = self.sync_service.ai_config
+        self.openai_client = AsyncOpenAI(api_key=self.ai_config.get("api_key"))
+
+    async def ask_ai_assistant_question(
+        self,
+        question: str,
+        file_urls: Optional[List[str]] = None,
+        tier: Optional[str] = None,
+        session: Optional[ConversationSession] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        # see `OpenAIService.ask_ai_assistant_question`
+        with run_timeline(self.ai_config["name"]):
+            annotate(question=question, attachments=len(file_urls or []))
+            if session is None:
+                answer = await self.answer_question(question, file_urls, tier, on_text=on_text)
+            else:
+                # shared with OpenAIService, so wait for it off the event loop
+                await asyncio.to_thread(session.lock.acquire)
+                try:
+                    annotate(follow_up=session.is_follow_up)
+                    answer = await self.answer_question(
+                        question, file_urls, tier, session, on_text
+                    )
+                    session.add_turn(question, answer)
+                finally:
+                    session.lock.release()
+            annotate(answer=answer)
+            return answer
+
+    async def answer_question(
+        self,
+        question: str,
+        file_urls: Optional[List[str]] = None,
+        tier: Optional[str] = None,
+        session: Optional[ConversationSession] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """
+        See `OpenAIService.answer_question`. The steps before and after the
+        run are the sync service's, in a worker thread.
+        """
+        prepared = await asyncio.to_thread(
+            self.sync_service.prepare_question, question, file_urls, tier, session
+        )
+        if prepared.answer is not None:
+            return prepared.answer
+
+        async def get_answer() -> str:
+            start = time.monotonic()
+            answer = await asyncio.to_thread(self.sync_service.get_prepared_fast_answer, prepared)
+            used_fast_answer = answer is not None
+            if answer is None and on_text:
+                answer = await self.stream_ai_assistant_thread(
+                    prepared.message, on_text, prepared.tier, session
+                )
+            elif answer is None:
+                answer = await self.run_ai_assistant_thread(
+                    prepared.message, prepared.tier, session
+                )
+
+            self.sync_service.finish_question(prepared, answer, used_fast_answer, start)
+            return answer
+
+        if not prepared.shared:
+            return await get_answer()
+
+        # shares flights with OpenAIService, see `AnswerCache.coalesce`
+        return await answer_cache.coalesce_async(
+            self.ai_config["name"], prepared.question, get_answer, variant=prepared.tier or ""
+        )
+
+    async def run_ai_assistant_thread(
+        self,
+        message: Dict,
+        tier: Optional[str] = None,
+        session: Optional[ConversationSession] = None,
+    ) -> str:
+        """
+        See `OpenAIService.run_ai_assistant_thread`. Only the polling is
+        async, creating the run and answering from it are the sync service's
+        single requests, made in a worker thread.
+        """
+        start = time.monotonic()
+        deadline = self.sync_service.get_run_deadline(start, tier)
+        with stage("create_run"):
+            run = await asyncio.to_thread(self.sync_service.create_run, message, tier, session)
+        self.sync_service.start_run(run, session)
+        run = await self.poll_run(run, deadline)
+        return await asyncio.to_thread(
+            self.sync_service.finish_run, run, message, start, deadline, session
+        )
+
+    async def poll_run(self, run: Run, deadline: Optional[float] = None) -> Run:
+        """
+        See `OpenAIService.poll_run`
+        """
+        polls = 0
+        while run.status in POLLED_RUN_STATUSES:
+            interval = self.sync_service.get_poll_interval(polls, deadline)
+            if interval is None:
+                return await asyncio.to_thread(self.sync_service.cancel_run, run)
+
+            with stage(f"run_{run.status}"):
+                await asyncio.sleep(interval)
+                polls += 1
+                run = await self.openai_client.beta.threads.runs.retrieve(
+                    run.id, thread_id=run.thread_id
+                )
+
+        return run
+
+    async def stream_ai_assistant_thread(
+        self,
+        message: Dict,
+        on_text: Callable[[str], None],
+        tier: Optional[str] = None,
+        session: Optional[ConversationSession] = None,
+    ) -> str:
+        """
+        See `OpenAIService.stream_ai_assistant_thread`. `on_text` may block,
+        like posting to slack, so it's called in a worker thread.
+        """
+        start = time.monotonic()
+        deadline = self.sync_service.get_run_deadline(start, tier)
+        client = self.openai_client
+        if deadline is not None:
+            client = client.with_options(timeout=deadline - start)
+
+        run = None
+        stream = None
+        answer_message = None
+        try:
+            async with AsyncExitStack() as stack:
+                stream = await self.open_run_stream(stack, client, message, tier, session)
+                text = ""
+                async for delta in stream.text_deltas:
+                    run = stream.current_run
+                    if deadline is not None and time.monotonic() >= deadline:
+                        break
+                    if not text:
+                        add_stage("first_text", time.monotonic() - start)
+                    text += delta
+                    with stage("post_text"):
+                        await asyncio.to_thread(on_text, text)
+                else:
+                    run = await stream.get_final_run()
+                    answer_message = self.sync_service.get_last_assistant_message(
+                        await stream.get_final_messages()
+                    )
+        except APITimeoutError:
+            logging.warning("Assistant stream timed out")
+            run = stream.current_run if stream is not None else None
+        add_stage("stream", time.monotonic() - start)
+
+        if run is not None:
+            self.sync_service.start_run(run, session)
+        return await asyncio.to_thread(
+            self.sync_service.finish_run, run, message, start, deadline, session, answer_message
+        )
+
+    async def open_run_stream(
+        self,
+        stack: AsyncExitStack,
+        client: AsyncOpenAI,
+        message: Dict,
+        tier: Optional[str],
+        session: Optional[ConversationSession],
+    ) -> AsyncAssistantEventHandler:
+        """
+        See `OpenAIService.open_run_stream`
+        """
+        args = self.sync_service.get_thread_run_args(message, tier, session)
+        if "thread_id" not in args:
+            return await stack.enter_async_context(
+                client.beta.threads.create_and_run_stream(**args)
+            )
+
+        try:
+            return await stack.enter_async_context(client.beta.threads.runs.stream(**args))
+        except BadRequestError as e:
+            self.sync_service.handle_refused_thread(session, args["thread_id"], e)
+            return await self.open_run_stream(stack, client, message, tier, session)
+
+
+class AsyncOpenAIRunner:
+    """
+    Runs `AsyncOpenAIService` questions on one background event loop, for
+    callers that aren't async. Services, and so their connection pools, are
+    reused per assistant.
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.services: Dict[str, AsyncOpenAIService] = {}
+        self.lock = threading.Lock()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, daemon=True).start()
+            return self.loop
+
+    def get_service(self, assistant_name: str) -> AsyncOpenAIService:
+        with self.lock:
+            if assistant_name not in self.services:
+                self.services[assistant_name] = AsyncOpenAIService(assistant_name)
+            return self.services[assistant_name]
+
+    def submit(
+        self,
+        assistant_name: str,
+        question: str,
+        file_urls: Optional[List[str]] = None,
+        tier: Optional[str] = None,
+        session: Optional[ConversationSession] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+    ) -> Future:
+        """
+        Start answering a question without blocking.
+
+        :param on_text: streams the answer, see
+            `OpenAIService.stream_ai_assistant_thread`
+        :return: a future for the answer
+        """
+        service = self.get_service(assistant_name)
+        return asyncio.run_coroutine_threadsafe(
+            service.ask_ai_assistant_question(question, file_urls, tier, session, on_text),
+            self.get_loop(),
+        )
+
+    def ask_ai_assistant_question(
+        self,
+        assistant_name: str,
+        question: str,
+        file_urls: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+        tier: Optional[str] = None,
+    ) -> str:
+        """
+        Blocking version of `AsyncOpenAIService.ask_ai_assistant_question`.
+        """
+        return self.submit(assistant_name, question, file_urls, tier).result(timeout)
+
+
+async_openai_runner = AsyncOpenAIRunner()
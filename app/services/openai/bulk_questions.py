@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, as_completed
+from typing import Dict, Iterator, List, Optional
+
+from app.services.openai.openai_service import OpenAIService
+from app.services.openai.question_scheduler import PRIORITY_BATCH, question_scheduler
+
+
+class BulkQuestionStore:
+    """
+    Questions and answers of bulk batches, kept in sqlite so a batch can be
+    resumed after the client disconnects or the api restarts.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv("BULK_QUESTIONS_DB_PATH") or "bulk_questions.sqlite3"
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared across threads or forked processes
+        if getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS bulk_questions (
+                    batch_id TEXT NOT NULL,
+                    assistant TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    question TEXT NOT NULL,
+                    answer TEXT,
+                    error TEXT,
+                    secs REAL,
+                    PRIMARY KEY (batch_id, idx)
+                )
+                """
+            )
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(bulk_questions)")]
+            if "error" not in columns:
+                # failures used to be stored as the answer, move them so they're retried
+                connection.execute("ALTER TABLE bulk_questions ADD COLUMN error TEXT")
+                connection.execute(
+                    """
+                    UPDATE bulk_questions SET error = substr(answer, 8), answer = NULL
+                    WHERE answer LIKE 'Error: %'
+                    """
+                )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return self._local.connection
+
+    def add_questions(
+        self, batch_id: str, assistant_name: str, questions: List[str], start_idx: int = 0
+    ):
+        self.connection.executemany(
+            """
+            INSERT OR IGNORE INTO bulk_questions (batch_id, assistant, idx, question)
+            VALUES (?, ?, ?, ?)
+            """,
+            [
+                (batch_id, assistant_name, idx, q)
+                for idx, q in enumerate(questions, start=start_idx)
+            ],
+        )
+
+    def get_questions(self, batch_id: str) -> List[Dict]:
+        rows = self.connection.execute(
+            """
+            SELECT idx, question, answer, error, secs FROM bulk_questions
+            WHERE batch_id = ? ORDER BY idx
+            """,
+            (batch_id,),
+        )
+        return [
+            {
+                "index": row[0],
+                "question": row[1],
+                "answer": row[2],
+                "error": row[3],
+                "secs": row[4],
+            }
+            for row in rows
+        ]
+
+    def get_assistant(self, batch_id: str) -> Optional[str]:
+        row = self.connection.execute(
+            "SELECT assistant FROM bulk_questions WHERE batch_id = ? LIMIT 1", (batch_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_answer(self, batch_id: str, idx: int, answer: str, secs: float):
+        self.connection.execute(
+            """
+            UPDATE bulk_questions SET answer = ?, error = NULL, secs = ?
+            WHERE batch_id = ? AND idx = ?
+            """,
+            (answer, secs, batch_id, idx),
+        )
+
+    def set_error(self, batch_id: str, idx: int, error: str):
+        self.connection.execute(
+            """
+            UPDATE bulk_questions SET answer = NULL, error = ?, secs = NULL
+            WHERE batch_id = ? AND idx = ?
+            """,
+            (error, batch_id, idx),
+        )
+
+
+class BulkQuestionService:
+    """
+    Answers batches of questions through the question scheduler at batch
+    priority, so interactive questions go first, with at most
+    `max_concurrent` of a batch running at once.
+
+    Answers are stored as they complete, whether or not the client is still
+    reading, and resuming a batch only runs its unanswered questions,
+    including the ones that failed. A batch already running in this process
+    isn't started twice.
+    """
+
+    def __init__(self, store: Optional[BulkQuestionStore] = None):
+        self.store = store or BulkQuestionStore()
+        # batch id -> question index -> future, for batches running here
+        self.running: Dict[str, Dict[int, Future]] = {}
+        self._lock = threading.Lock()
+
+    def start(
+        self,
+        assistant_name: str,
+        questions: Optional[List[str]] = None,
+        batch_id: Optional[str] = None,
+        max_concurrent: int = 4,
+    ) -> str:
+        """
+        Start a new batch, or resume one by id. When resuming, questions past
+        the batch's existing ones are added to it, so the same list can be
+        sent again.
+
+        :return: the batch id
+        """
+        batch_id = batch_id or uuid.uuid4().hex
+        existing = self.store.get_questions(batch_id)
+        if questions:
+            self.store.add_questions(
+                batch_id, assistant_name, questions[len(existing):], start_idx=len(existing)
+            )
+
+        openai_service = OpenAIService(assistant_name)
+        started: Dict[int, Future] = {}
+        with self._lock:
+            running = self.running.setdefault(batch_id, {})
+            for item in self.store.get_questions(batch_id):
+                if item["answer"] is not None or item["index"] in running:
+                    continue
+                future, _position = question_scheduler.submit(
+                    lambda question=item["question"]: self.answer(openai_service, question),
+                    user_id=f"bulk:{batch_id}",
+                    priority=PRIORITY_BATCH,
+                    user_limit=max_concurrent,
+                )
+                running[item["index"]] = started[item["index"]] = future
+            if not running:
+                self.running.pop(batch_id, None)
+
+        # outside the lock, a future that's already done runs `finish` here
+        for idx, future in started.items():
+            future.add_done_callback(lambda done, idx=idx: self.finish(batch_id, idx, done))
+
+        return batch_id
+
+    @staticmethod
+    def answer(openai_service: OpenAIService, question: str) -> Dict:
+        start = time.monotonic()
+        answer = openai_service.ask_ai_assistant_question(question, [])
+        if answer.startswith("Error: "):
+            # a failed run, see `OpenAIService.handle_failed_run`
+            raise RuntimeError(answer[len("Error: "):])
+        return {"answer": answer, "secs": round(time.monotonic() - start, 2)}
+
+    @staticmethod
+    def get_result(done: Future) -> Dict:
+        if done.exception() is not None:
+            return {"answer": None, "error": str(done.exception()), "secs": None}
+        return {**done.result(), "error": None}
+
+    def finish(self, batch_id: str, idx: int, done: Future):
+        result = self.get_result(done)
+        if result["error"] is not None:
+            logging.error("Bulk question %s/%s failed: %s", batch_id, idx, result["error"])
+            self.store.set_error(batch_id, idx, result["error"])
+        else:
+            self.store.set_answer(batch_id, idx, result["answer"], result["secs"])
+
+        with self._lock:
+            running = self.running.get(batch_id)
+            if running is not None:
+                running.pop(idx, None)
+                if not running:
+                    self.running.pop(batch_id, None)
+
+    def stream(self, batch_id: str) -> Iterator[str]:
+        """
+        NDJSON lines for a batch: a header with the counts, then every
+        answered or failed question, then the running ones as they complete.
+        """
+        with self._lock:
+            running = dict(self.running.get(batch_id, {}))
+        # answers are stored before a question leaves `running`
+        items = self.store.get_questions(batch_id)
+        done = [
+            item
+            for item in items
+            if (item["answer"] is not None or item["error"] is not None)
+            and item["index"] not in running
+        ]
+
+        yield json.dumps(
+            {
+                "batch_id": batch_id,
+                "total": len(items),
+                "answered": sum(item["answer"] is not None for item in done),
+                "failed": sum(item["answer"] is None for item in done),
+                "running": len(running),
+            }
+        ) + "\n"
+        for item in done:
+            yield json.dumps({"batch_id": batch_id, **item}) + "\n"
+
+        indexes = {future: idx for idx, future in running.items()}
+        questions = {item["index"]: item["question"] for item in items}
+        for future in as_completed(indexes):
+            result = self.get_result(future)
+            idx = indexes[future]
+            yield json.dumps(
+                {"batch_id": batch_id, "index": idx, "question": questions[idx], **result}
+            ) + "\n"
+
+
+bulk_question_service = BulkQuestionService()
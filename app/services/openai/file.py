@@ -1,27 +1,124 @@
 import io
 import logging
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Dict, Iterable, List, Optional
 
 from app.services.openai.mixin import OpenAIMixin
+from app.utils import LRUCache
 from openai import OpenAI
 from openai.types import FileObject, FileDeleted
 
+# file id -> filename, shared by every client in the process. Filenames
+# never change, so entries only leave when the cache is full.
+_filename_cache = LRUCache(maxsize=10000)
+
+# sha256 of uploaded content -> file id, so the same attachment is uploaded once
+_content_file_ids = LRUCache(maxsize=1024, ttl_secs=24 * 60 * 60)
+
 
 class OpenAIFile:
     def __init__(self, client: OpenAI):
         self.openai_client = client
 
-    def create_file(self, name: str, obj_bytes: bytes) -> FileObject:
-        bytes_file = io.BytesIO(obj_bytes)
-        bytes_file.name = name
+    @staticmethod
+    def cache_filenames(files: Iterable[FileObject]):
+        for f in files:
+            _filename_cache.set(f.id, f.filename)
+
+    def warm_filename_cache(self):
+        """
+        Cache the filename of every file with a single listing, so citations
+        don't need a lookup per file.
+        """
+        try:
+            self.cache_filenames(self.list())
+        except Exception as e:
+            logging.warning("Failed to warm the filename cache %s", e)
+
+    def get_filenames(self, file_ids: Iterable[str], max_workers: int = 8) -> Dict[str, str]:
+        """
+        Get the filenames for file ids. Ids that aren't cached are retrieved
+        concurrently. Ids that can't be retrieved are left out.
+
+        :param file_ids:
+        :param max_workers:
+        :return: a dict of file id to filename
+        """
+        filenames: Dict[str, str] = {}
+        missing = []
+        for file_id in set(file_ids):
+            filename = _filename_cache.get(file_id)
+            if filename is None:
+                missing.append(file_id)
+            else:
+                filenames[file_id] = filename
+
+        retrieved = self.get_many(missing, max_workers=max_workers)
+        filenames.update({file_id: f.filename for file_id, f in retrieved.items()})
+        return filenames
+
+    def get_many(self, file_ids: Iterable[str], max_workers: int = 8) -> Dict[str, FileObject]:
+        """
+        Retrieve files concurrently. Ids that can't be retrieved, like deleted
+        files, are left out.
+
+        :param file_ids:
+        :param max_workers:
+        :return: a dict of file id to file
+        """
+        file_ids = list(set(file_ids))
+        if not file_ids:
+            return {}
+
+        def retrieve(file_id: str) -> FileObject | None:
+            try:
+                return self.get(file_id)
+            except Exception as e:
+                logging.warning("Unable to retrieve file %s: %s", file_id, e)
+                return None
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(file_ids))) as executor:
+            retrieved = [f for f in executor.map(retrieve, file_ids) if f]
+        self.cache_filenames(retrieved)
+        return {f.id: f for f in retrieved}
+
+    def create_file(self, name: str, obj_bytes: bytes | IO[bytes]) -> FileObject:
+        """
+        :param name:
+        :param obj_bytes: the content, or a file object to stream it from
+        :return:
+        """
+        if isinstance(obj_bytes, bytes):
+            obj_bytes = io.BytesIO(obj_bytes)
 
         message_file = self.openai_client.files.create(
-            file=bytes_file,
+            file=(name, obj_bytes),
             purpose="assistants",
         )
+        _filename_cache.set(message_file.id, message_file.filename)
 
         return message_file
 
+    def get_or_create_file(
+        self, name: str, obj_bytes: bytes | IO[bytes], content_hash: str
+    ) -> str:
+        """
+        Upload a file unless the same content was uploaded recently.
+
+        :param name:
+        :param obj_bytes:
+        :param content_hash: a hash of the content, like its sha256
+        :return: the file id
+        """
+        file_id: Optional[str] = _content_file_ids.get(content_hash)
+        if file_id is not None:
+            logging.info("Reusing file %s for %s", file_id, name)
+            return file_id
+
+        file_id = self.create_file(name, obj_bytes).id
+        _content_file_ids.set(content_hash, file_id)
+        return file_id
+
     def get(self, file_id: str) -> FileObject:
         return self.openai_client.files.retrieve(file_id=file_id)
 
@@ -34,8 +131,26 @@ class OpenAIFile:
             logging.error("Error while listing files %s", e)
 
     def delete(self, file_id: str) -> FileDeleted | None:
+        # the content may be uploaded again, don't hand out the deleted id
+        for content_hash, cached_id in _content_file_ids.items():
+            if cached_id == file_id:
+                _content_file_ids.pop(content_hash)
+
         try:
             return self.openai_client.files.delete(file_id)
         except Exception as e:
             logging.warning(str(e))
             return None
+
+    def delete_many(self, file_ids: List[str], max_workers: int = 8) -> List[str]:
+        """
+        Delete files concurrently. There is no bulk delete in the files api,
+        so this fans the single deletes out over a thread pool.
+
+        :param file_ids:
+        :param max_workers:
+        :return: the ids that were deleted
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(self.delete, file_ids)
+            return [file_id for file_id, resp in zip(file_ids, results) if resp]
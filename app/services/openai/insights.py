@@ -0,0 +1,286 @@
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from app.services.aws import aws_file_service
+from app.services.search.competitors import get_competitor_directory
+from app.services.search.corpus_index import Passage, get_corpus_index
+from app.utils import LRUCache, format_age, normalize_text
+
+if TYPE_CHECKING:
+    from app.services.openai.openai_service import OpenAIService
+
+DEFAULT_TOPICS = {
+    "pricing": "How does {competitor}'s pricing compare to ours?",
+    "product": "How does {competitor}'s product compare to ours?",
+    "positioning": "How is {competitor} positioned in the market compared to us?",
+}
+
+# s3 key -> insights document, read by the slack process
+_insights_documents = LRUCache(maxsize=16, ttl_secs=5 * 60)
+
+
+class InsightsService:
+    """
+    Precomputes answers to a matrix of competitor x topic questions, so the
+    comparisons asked most often are served without a run.
+
+    With "mode": "batch" (the default) each question is answered from the
+    local search index's passages by a chat completion, sent together
+    through the Batch API. `refresh` submits the batch and `collect` stores
+    the answers once it's done. With "mode": "assistant" the questions are
+    run through the assistant right away instead.
+
+    Answers are stored in s3 under the "insights" config's "s3_prefix",
+    which must be outside the folders ingested into the vector store.
+    """
+
+    def __init__(self, openai_service: "OpenAIService"):
+        self.openai_service = openai_service
+        self.ai_config = openai_service.ai_config
+        self.insights_config: Dict = self.ai_config.get("insights") or {}
+        self.bucket = self.ai_config["s3_bucket_vector_store_files"]
+        prefix = self.insights_config.get("s3_prefix") or f"insights/{self.ai_config['name']}/"
+        self.insights_key = f"{prefix}insights.json"
+        self.pending_batch_key = f"{prefix}pending_batch.json"
+
+    def get_competitors(self) -> List[str]:
+        """
+        See `CompetitorDirectory`
+        """
+        return get_competitor_directory(self.ai_config).get_names()
+
+    def get_matrix(self) -> List[Dict]:
+        topics: Dict[str, str] = self.insights_config.get("topics") or DEFAULT_TOPICS
+        return [
+            {
+                "competitor": competitor,
+                "topic": topic,
+                "question": template.format(competitor=competitor),
+            }
+            for competitor in self.get_competitors()
+            for topic, template in topics.items()
+        ]
+
+    def get_passages(self, competitor: str, question: str) -> List[Passage]:
+        """
+        The passages that best match a question, preferring the competitor's
+        own files.
+        """
+        k = self.ai_config.get("fast_answer_passages", 8)
+        passages = get_corpus_index(self.ai_config["name"]).search(
+            f"{competitor} {question}", k * 3
+        )
+        passages.sort(key=lambda p: (f"/{competitor}/" not in p.source, -p.score))
+        return passages[:k]
+
+    def get_version(self) -> str:
+        return self.openai_service.ai_vector_store.get_version(self.ai_config["vector_store_id"])
+
+    def refresh(self) -> Dict:
+        """
+        Recompute the insights, see the class docstring.
+
+        :return: a summary of what was started or stored
+        """
+        matrix = self.get_matrix()
+        if not matrix:
+            return {"status": "skipped", "reason": "no competitors"}
+
+        if self.insights_config.get("mode") == "assistant":
+            return self.refresh_with_assistant(matrix)
+        return self.submit_batch(matrix)
+
+    def refresh_with_assistant(self, matrix: List[Dict]) -> Dict:
+        version = self.get_version()
+
+        def answer(item: Dict) -> Dict:
+            answer = self.openai_service.run_ai_assistant_thread(
+                {"role": "user", "content": item["question"]}, tier="thorough"
+            )
+            return {**item, "answer": answer}
+
+        with ThreadPoolExecutor(max_workers=self.insights_config.get("max_concurrent", 4)) as executor:
+            answered = [
+                item
+                for item in executor.map(answer, matrix)
+                if not item["answer"].startswith("Error:")
+            ]
+
+        self.save_insights(answered, version)
+        return {"status": "completed", "answered": len(answered), "questions": len(matrix)}
+
+    def submit_batch(self, matrix: List[Dict]) -> Dict:
+        client = self.openai_service.openai_client
+        pending = self.get_json(self.pending_batch_key)
+        if pending and time.time() - pending["created_at"] < self.insights_config.get(
+            "min_refresh_secs", 60 * 60
+        ):
+            # ingests come in bursts, `collect` resubmits if the files changed
+            return {"status": "pending", "batch_id": pending["batch_id"]}
+        if pending:
+            # the corpus changed, so the pending answers would be stale
+            try:
+                client.batches.cancel(pending["batch_id"])
+            except Exception as e:
+                logging.warning("Unable to cancel insights batch %s: %s", pending["batch_id"], e)
+
+        items = {}
+        lines = []
+        model = self.insights_config.get("model", "gpt-4o")
+        for custom_id, item in enumerate(matrix):
+            passages = self.get_passages(item["competitor"], item["question"])
+            items[str(custom_id)] = {**item, "passages": [p.__dict__ for p in passages]}
+            lines.append(
+                {
+                    "custom_id": str(custom_id),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": model,
+                        "messages": [
+                            {
+                                "role": "system",
+                                "content": self.openai_service.get_passage_context(passages),
+                            },
+                            {"role": "user", "content": item["question"]},
+                        ],
+                        "temperature": 0.3,
+                        "max_tokens": 1500,
+                    },
+                }
+            )
+
+        input_file = client.files.create(
+            file=("insights.jsonl", "\n".join(json.dumps(line) for line in lines).encode()),
+            purpose="batch",
+        )
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"assistant": self.ai_config["name"], "kind": "insights"},
+        )
+        self.put_json(
+            self.pending_batch_key,
+            {
+                "batch_id": batch.id,
+                "created_at": time.time(),
+                "vector_store_version": self.get_version(),
+                "items": items,
+            },
+        )
+        logging.info("Submitted insights batch %s with %s questions", batch.id, len(lines))
+        return {"status": "submitted", "batch_id": batch.id, "questions": len(lines)}
+
+    def collect(self) -> Dict:
+        """
+        Store the answers of the pending batch if it's done.
+
+        :return: the batch status, and how many answers were stored
+        """
+        pending = self.get_json(self.pending_batch_key)
+        if not pending:
+            return {"status": "none"}
+
+        client = self.openai_service.openai_client
+        batch = client.batches.retrieve(pending["batch_id"])
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return {"status": batch.status, "batch_id": batch.id}
+
+        answered = []
+        if batch.status == "completed" and batch.output_file_id:
+            output = client.files.content(batch.output_file_id).text
+            for line in filter(None, output.splitlines()):
+                result = json.loads(line)
+                item = pending["items"].get(result["custom_id"])
+                response = result.get("response") or {}
+                if item is None or response.get("status_code") != 200:
+                    continue
+
+                answer = response["body"]["choices"][0]["message"]["content"]
+                passages = [Passage(**p) for p in item.pop("passages")]
+                answered.append({**item, "answer": self.openai_service.cite_passages(answer, passages)})
+
+            self.save_insights(answered, pending["vector_store_version"], pending["created_at"])
+        else:
+            logging.warning("Insights batch %s ended %s", batch.id, batch.status)
+
+        for file_id in (batch.input_file_id, batch.output_file_id, batch.error_file_id):
+            if file_id:
+                self.openai_service.ai_file.delete(file_id)
+        # a refresh may have submitted a newer batch since, which is kept
+        current = self.get_json(self.pending_batch_key)
+        if current and current["batch_id"] == pending["batch_id"]:
+            aws_file_service.delete_files(self.bucket, [self.pending_batch_key])
+
+        resp = {"status": batch.status, "batch_id": batch.id, "answered": len(answered)}
+        if pending["vector_store_version"] != self.get_version():
+            resp["resubmitted"] = self.refresh()
+        return resp
+
+    def save_insights(
+        self, answered: List[Dict], version: str, generated_at: Optional[float] = None
+    ):
+        """
+        Merge answers into the stored insights. Questions that failed keep
+        their previous answer.
+        """
+        document = self.get_insights()
+        insights = document.setdefault("insights", {})
+        for item in answered:
+            insights.setdefault(item["competitor"], {})[item["topic"]] = {
+                "question": item["question"],
+                "answer": item["answer"],
+                "generated_at": generated_at or time.time(),
+                "vector_store_version": version,
+            }
+
+        self.put_json(self.insights_key, document)
+        _insights_documents.set(self.insights_key, document)
+        logging.info("Stored %s insights for %s", len(answered), self.ai_config["name"])
+
+    def get_insights(self) -> Dict:
+        """
+        The stored insights, as {"insights": {competitor: {topic: insight}}}.
+        """
+        document = _insights_documents.get(self.insights_key)
+        if document is None:
+            document = self.get_json(self.insights_key) or {}
+            _insights_documents.set(self.insights_key, document)
+        return document
+
+    def format_insight(self, insight: Dict) -> str:
+        """
+        An insight's answer with how fresh it is.
+        """
+        freshness = f"_Precomputed {format_age(time.time() - insight['generated_at'])} ago"
+        if insight["vector_store_version"] != self.get_version():
+            freshness += ", the files have changed since"
+        return f"{insight['answer']}\n\n{freshness}_"
+
+    def get_materialized_answer(self, question: str) -> Optional[str]:
+        """
+        The precomputed answer to a question, if it's one of the matrix's.
+        """
+        normalized = normalize_text(question)
+        for topics in self.get_insights().get("insights", {}).values():
+            for insight in topics.values():
+                if normalize_text(insight["question"]) == normalized:
+                    return self.format_insight(insight)
+        return None
+
+    def get_json(self, key: str) -> Optional[Dict]:
+        try:
+            return json.loads(aws_file_service.get_file_content(self.bucket, key))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+
+    def put_json(self, key: str, data: Dict):
+        aws_file_service.upload(self.bucket, key, json.dumps(data).encode(), metadata={})
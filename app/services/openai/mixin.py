@@ -7,9 +7,13 @@ class OpenAIMixin:
                 for datum in resp.data:
                     yield datum
 
-                if not getattr(resp, "has_next", False):
+                if not resp.has_next_page():
+                    # callers diff these listings, so a partial one must not
+                    # pass for the whole thing
+                    if getattr(resp, "has_more", False):
+                        raise RuntimeError("Listing has more pages but no way to get them")
                     break
 
-                resp = resp.get_next()
+                resp = resp.get_next_page()
 
         return inner
@@ -1,21 +1,68 @@
 # openai_service.py
 
+from app.services.openai.answer_cache import answer_cache
 from app.services.openai.assistant import OpenAIAssistant
 from app.services.openai.file import OpenAIFile
+from app.services.openai.insights import InsightsService
+from app.services.openai.question_router import QuestionRouter, THOROUGH_TIER
+from app.services.openai.sessions import ConversationSession
 from app.services.openai.vector_store import OpenAIVectorStore
-from typing import List, Optional, Dict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Dict
 import requests
 import logging
-import io
-import fitz
+import re
+import time
 
 import os
 
-from openai import OpenAI
-
+from openai import APITimeoutError, BadRequestError, OpenAI
+from openai.lib.streaming import AssistantEventHandler
+from openai.types.beta.threads import Message, Run
+
+from app.services.metrics import metrics_service
+from app.services.metrics.timeline import (
+    add_stage,
+    add_usage,
+    annotate,
+    run_timeline,
+    set_labels,
+    stage,
+)
+from app.services.pdf import pdf_service
+from app.services.search.corpus_index import Passage, get_corpus_index
 from app.services.slack import slack_service
 from app.services.get_secret import get_secret
 
+# seconds between run status polls, the last one repeats
+DEFAULT_POLL_SCHEDULE_SECS = [0.25, 0.25, 0.5, 0.5, 0.75, 1.0, 1.0, 1.5, 2.0]
+
+# statuses of a run that's still going, or stopping
+POLLED_RUN_STATUSES = ("queued", "in_progress", "cancelling")
+
+FALLBACK_NOTICE = "_The assistant couldn't answer in time, this is a quick answer without a file search._"
+
+
+@dataclass
+class PreparedQuestion:
+    """
+    A question after the steps before answering it with a run, see
+    `OpenAIService.prepare_question`.
+    """
+
+    question: str
+    message: Dict
+    tier: Optional[str] = None
+    # no attachments and not a follow-up, so the answer can be shared
+    # with other users
+    shared: bool = False
+    # set if the answer is to be cached
+    cache_version: Optional[str] = None
+    # a precomputed or cached answer, nothing is left to run
+    answer: Optional[str] = None
+
 
 class OpenAIService:
     def __init__(self, assistant_name: str):
@@ -39,6 +86,73 @@ class OpenAIService:
                 """,
                 "s3_bucket_vector_store_files": "competitor-bot-bucket",
                 "s3_folder_prefix": ["competitor-bot/"],
+                "stream_answers": True,
+                # answer on the shared asyncio loop, streamed answers too
+                "use_async_client": True,
+                # answers to questions without attachments are reused until
+                # the vector store changes or the ttl runs out
+                "answer_cache_ttl_secs": 6 * 60 * 60,
+                "poll_schedule_secs": DEFAULT_POLL_SCHEDULE_SECS,
+                # runs still going after this are cancelled, and answered with
+                # a single chat completion if fallback_to_chat is set
+                "run_deadline_secs": 90,
+                "fallback_to_chat": True,
+                # keep a local bm25 index of the s3 folders, and answer from
+                # its passages with one chat completion instead of a run
+                "local_search": True,
+                "fast_answers": False,
+                "fast_answer_passages": 8,
+                # questions are routed to a latency tier, whose settings
+                # override the ones above. "model" and "max_num_results"
+                # override the assistant's for runs, "model" is also used
+                # for fast answers
+                "tiers": {
+                    "fast": {
+                        "model": "gpt-4o-mini",
+                        "max_num_results": 5,
+                        "run_deadline_secs": 30,
+                        "fast_answers": True,
+                    },
+                    "thorough": {},
+                },
+                "routing": {
+                    "max_fast_words": 20,
+                    "llm_classification": False,
+                    "classifier_model": "gpt-4o-mini",
+                    "default_tier": "thorough",
+                },
+                # follow-up questions in the modal reuse the user's thread
+                # until it's idle this long. Runs on it only send the last
+                # messages to the model
+                "sessions": {
+                    "idle_secs": 30 * 60,
+                    "truncation_strategy": {"type": "last_messages", "last_messages": 10},
+                },
+                # opening the modal creates an empty thread for the user's
+                # question, held this long, see WarmupService
+                "warm_thread_ttl_secs": 10 * 60,
+                # precomputed competitor x topic answers, see InsightsService.
+                # "competitors" defaults to the folders under s3_folder_prefix,
+                # "topics" to DEFAULT_TOPICS
+                "insights": {
+                    "mode": "batch",
+                    "model": "gpt-4o",
+                    "s3_prefix": "insights/competitor/",
+                },
+                # the best matching sections of attached pdfs are sent with
+                # a question, up to this many and this many characters
+                "pdf_top_k_sections": 8,
+                "pdf_max_chars": 200000,
+                # static chunking per file extension, "default" covers the rest.
+                # max_chunk_size_tokens: 100-4096, chunk_overlap_tokens: <= half of it
+                "chunking_strategies": {
+                    "default": {"max_chunk_size_tokens": 800, "chunk_overlap_tokens": 400},
+                    ".docx": {"max_chunk_size_tokens": 400, "chunk_overlap_tokens": 100},
+                    ".html": {"max_chunk_size_tokens": 600, "chunk_overlap_tokens": 200},
+                    ".pdf": {"max_chunk_size_tokens": 1200, "chunk_overlap_tokens": 400},
+                    ".pptx": {"max_chunk_size_tokens": 400, "chunk_overlap_tokens": 100},
+                    ".xlsx": {"max_chunk_size_tokens": 1000, "chunk_overlap_tokens": 200},
+                },
             }
         raise ValueError(f"Unknown assistant model: {model_name}")
     
@@ -47,36 +161,28 @@ class OpenAIService:
         openai_client: OpenAI,
         assistant_id: str,
         file_urls: Optional[List[str]] = None,
+        max_workers: int = 4,
     ) -> List[Dict]:
-        attachments: list[dict[str, list[dict[str, str]] | str]] = []
-        if file_urls:
-            assistant = openai_client.beta.assistants.retrieve(assistant_id)
-
-            if "file_search" not in [a.type for a in assistant.tools]:
-                tools = assistant.tools
-                tools.append({"type": "file_search"})  # type: ignore
-                self.openai_client.beta.assistants.update(assistant_id, tools=tools)  # type: ignore
-
-            attachments = []
-            for file_url in file_urls or []:
-                resp = requests.get(
-                    file_url,
-                    headers={
-                        "Authorization": f"Bearer {slack_service.slack_bot_token}"
-                    },
-                )
-                message_file = self.ai_file.create_file(
-                    name=os.path.split(resp.url)[-1],
-                    obj_bytes=resp.content,
-                )
-                attachments.append(
-                    {"file_id": message_file.id, "tools": [{"type": "file_search"}]}
-                )
+        """
+        Download slack files concurrently and upload them as message
+        attachments. Content that was attached before reuses its file.
+        """
+        if not file_urls:
+            return []
 
-        return attachments
+        OpenAIAssistant(openai_client).ensure_file_search(assistant_id)
+
+        def attach(file_url: str) -> Dict:
+            name, content, content_hash = slack_service.download_file(file_url)
+            with content:
+                file_id = self.ai_file.get_or_create_file(name, content, content_hash)
+            return {"file_id": file_id, "tools": [{"type": "file_search"}]}
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(file_urls))) as executor:
+            return list(executor.map(attach, file_urls))
 
     @staticmethod
-    def get_response_from_openai(context: str, user_content: str):
+    def get_response_from_openai(context: str, user_content: str, model: str = "gpt-4o"):
         try:
             prep = f"""
             {context}
@@ -85,7 +191,7 @@ class OpenAIService:
             """
             openai_key = get_secret('OPENAI_API_KEY')
             response = OpenAI(api_key=openai_key).chat.completions.create(
-                model="gpt-4o",
+                model=model,
                 messages=[{"role": "system", "content": prep}],
                 temperature=0.7,
                 max_tokens=2000,
@@ -95,6 +201,7 @@ class OpenAIService:
             )
 
             logging.debug(response.choices[0].message.content)
+            add_usage(response.usage)
             return response.choices[0].message.content
 
         except Exception as e:
@@ -110,41 +217,38 @@ class OpenAIService:
         Returns:
             str: Combined response from the AI assistant
         """
-        combined_text = ""
-
+        pdfs = []
+        file_names = []
         for raw_file_url in raw_file_urls:
             logging.info(f"Processing file: {raw_file_url}")
 
             try:
                 # Download file from Slack
-                file_info_response = requests.get(
-                    raw_file_url,
-                    headers={
-                        "Authorization": f"Bearer {slack_service.slack_bot_token}"
-                    },
-                    allow_redirects=True,
-                )
+                name, content, _content_hash = slack_service.download_file(raw_file_url)
+                with content:
+                    pdfs.append(content.read())
+                file_names.append(name)
             except Exception as e:
                 error_msg = f"Error downloading file {raw_file_url}: {str(e)}"
                 logging.error(error_msg)
                 return error_msg
 
-            try:
-                # Extract text from PDF
-                pdf_stream = io.BytesIO(file_info_response.content)
-                pdf_document = fitz.open(stream=pdf_stream, filetype="pdf")
-
-                # Extract text from all pages
-                for page_num in range(len(pdf_document)):
-                    page = pdf_document[page_num]
-                    combined_text += f"\n--- Page {page_num + 1} ---\n{page.get_text()}"
-
-                pdf_document.close()
-
-            except Exception as e:
-                error_msg = f"Error processing PDF {raw_file_url}: {str(e)}"
-                logging.error(error_msg)
-                return error_msg
+        try:
+            # Extract text from all pages of all files at once
+            documents = pdf_service.extract_many(pdfs)
+        except Exception as e:
+            error_msg = f"Error processing PDFs {raw_file_urls}: {str(e)}"
+            logging.error(error_msg)
+            return error_msg
+
+        # only the pages relevant to the question are sent, not whole decks
+        combined_text = pdf_service.get_relevant_text(
+            question,
+            documents,
+            file_names,
+            top_k=self.ai_config.get("pdf_top_k_sections", 8),
+            max_chars=self.ai_config.get("pdf_max_chars"),
+        )
 
         # Create a single message with all content - Assistants API will handle context window management
         message = {
@@ -163,71 +267,646 @@ class OpenAIService:
         self,
         question: str,
         file_urls: Optional[List[str]] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        tier: Optional[str] = None,
+        session: Optional[ConversationSession] = None,
     ):
+        """
+        Ask the assistant a question. If `on_text` is given, the answer is
+        streamed and `on_text` is called with the answer so far as it is
+        generated, see `stream_ai_assistant_thread`.
+
+        :param tier: the latency tier to answer in, routed by the question
+            if not given or "auto", see `get_tier`
+        :param session: the conversation the question follows up on, see
+            `ConversationSession`
+        """
+        # records the stages and tokens of answering, see `RunTimeline`
+        with run_timeline(self.ai_config["name"]):
+            annotate(question=question, attachments=len(file_urls or []))
+            if session is None:
+                answer = self.answer_question(question, file_urls, on_text, tier)
+            else:
+                with session.lock:
+                    annotate(follow_up=session.is_follow_up)
+                    answer = self.answer_question(question, file_urls, on_text, tier, session)
+                    session.add_turn(question, answer)
+            annotate(answer=answer)
+            return answer
+
+    def answer_question(
+        self,
+        question: str,
+        file_urls: Optional[List[str]] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        tier: Optional[str] = None,
+        session: Optional[ConversationSession] = None,
+    ) -> str:
+        prepared = self.prepare_question(question, file_urls, tier, session)
+        if prepared.answer is not None:
+            return prepared.answer
+
+        def get_answer() -> str:
+            start = time.monotonic()
+            answer = self.get_prepared_fast_answer(prepared)
+            used_fast_answer = answer is not None
+
+            if answer is None and on_text:
+                answer = self.stream_ai_assistant_thread(
+                    prepared.message, on_text, prepared.tier, session
+                )
+            elif answer is None:
+                answer = self.run_ai_assistant_thread(prepared.message, prepared.tier, session)
+
+            self.finish_question(prepared, answer, used_fast_answer, start)
+            return answer
+
+        if not prepared.shared:
+            return get_answer()
+
+        # the same question asked while this one is running waits for its
+        # answer instead of starting another run
+        return answer_cache.coalesce(
+            self.ai_config["name"], prepared.question, get_answer, variant=prepared.tier or ""
+        )
+
+    def prepare_question(
+        self,
+        question: str,
+        file_urls: Optional[List[str]] = None,
+        tier: Optional[str] = None,
+        session: Optional[ConversationSession] = None,
+    ) -> PreparedQuestion:
+        """
+        The steps before a run, shared with `AsyncOpenAIService`: answer
+        from the precomputed insights or the answer cache if possible,
+        otherwise route the question to a tier and upload its attachments.
+
+        :return: the question, with `answer` set if no run is needed
+        """
+        # follow-ups depend on the conversation, so they aren't shared with
+        # other users and always run on the thread
+        follow_up = session is not None and session.is_follow_up
+
         if len(question) >= 256000:
             logging.warning("Question is too long. Truncating question...")
             question = question[:255999]
 
-        message = {"role": "user", "content": question}
+        prepared = PreparedQuestion(
+            question=question,
+            message={"role": "user", "content": question},
+            shared=not file_urls and not follow_up,
+        )
+
+        if self.ai_config.get("insights") and prepared.shared:
+            try:
+                with stage("insights"):
+                    prepared.answer = InsightsService(self).get_materialized_answer(question)
+            except Exception as e:
+                logging.warning("Unable to read precomputed insights: %s", e)
+            if prepared.answer is not None:
+                set_labels(outcome="materialized")
+                return prepared
+
+        with stage("route"):
+            prepared.tier = self.get_tier(question, tier, file_urls)
+        set_labels(tier=prepared.tier or "none")
+
+        if self.ai_config.get("answer_cache_ttl_secs") and prepared.shared:
+            with stage("cache"):
+                # answers from different tiers are cached separately
+                version = self.ai_vector_store.get_version(self.ai_config["vector_store_id"])
+                prepared.cache_version = f"{version}:{prepared.tier}" if prepared.tier else version
+                prepared.answer = answer_cache.get(
+                    self.ai_config["name"], question, prepared.cache_version
+                )
+            if prepared.answer is not None:
+                set_labels(outcome="cached")
+                return prepared
+
         if file_urls:
-            attachments = self.get_open_ai_attachments(
-                self.openai_client, self.ai_config["assistant_id"], file_urls
+            with stage("attachments"):
+                prepared.message["attachments"] = self.get_open_ai_attachments(
+                    self.openai_client, self.ai_config["assistant_id"], file_urls
+                )
+
+        return prepared
+
+    def get_prepared_fast_answer(self, prepared: PreparedQuestion) -> Optional[str]:
+        """
+        A fast answer if the question's tier uses them, see `get_fast_answer`.
+        """
+        tier_config = self.get_tier_config(prepared.tier)
+        if not tier_config.get("fast_answers") or not prepared.shared:
+            return None
+
+        with stage("fast_answer"):
+            return self.get_fast_answer(prepared.question, tier_config.get("model"))
+
+    def finish_question(
+        self, prepared: PreparedQuestion, answer: str, used_fast_answer: bool, start: float
+    ):
+        """
+        Record how a question was answered, and cache the answer.
+        """
+        self.record_question(prepared.tier, answer, used_fast_answer, start)
+        if prepared.cache_version is not None and not answer.startswith(
+            ("Error:", FALLBACK_NOTICE)
+        ):
+            answer_cache.set(
+                self.ai_config["name"],
+                prepared.question,
+                prepared.cache_version,
+                answer,
+                ttl_secs=self.ai_config["answer_cache_ttl_secs"],
             )
-            message["attachments"] = attachments  # type: ignore
 
-        return self.run_ai_assistant_thread(message)
+    def get_tier(
+        self, question: str, tier: Optional[str] = None, file_urls: Optional[List[str]] = None
+    ) -> Optional[str]:
+        """
+        The latency tier for a question. A requested tier is used if the
+        assistant has it. Questions with attachments are thorough, and the
+        rest are classified by a `QuestionRouter`.
 
-    # Helper method to run an assistant thread and return the response
-    def run_ai_assistant_thread(self, message: Dict):
-        thread = self.openai_client.beta.threads.create(messages=[message])  # type: ignore
-        run = self.openai_client.beta.threads.runs.create_and_poll(
-            thread_id=thread.id,
-            assistant_id=self.ai_config["assistant_id"],
-        )
+        :return: the tier, or None if the assistant has no tiers
+        """
+        tiers = self.ai_config.get("tiers")
+        if not tiers:
+            return None
+        if tier in tiers:
+            return tier
+        if file_urls:
+            return THOROUGH_TIER
+
+        router = QuestionRouter(self.openai_client, self.ai_config.get("routing", {}))
+        return router.route(self.ai_config["name"], question)
+
+    def get_tier_config(self, tier: Optional[str]) -> Dict:
+        """
+        The assistant's config with a tier's settings applied.
+        """
+        return {**self.ai_config, **self.ai_config.get("tiers", {}).get(tier, {})}
+
+    def get_run_options(self, tier: Optional[str]) -> Dict:
+        """
+        Overrides of the assistant's model and file search for a tier's runs.
+        """
+        tier_settings = self.ai_config.get("tiers", {}).get(tier, {})
+        options: Dict = {}
+        if "model" in tier_settings:
+            options["model"] = tier_settings["model"]
+        if "max_num_results" in tier_settings:
+            options["tools"] = [
+                {
+                    "type": "file_search",
+                    "file_search": {"max_num_results": tier_settings["max_num_results"]},
+                }
+            ]
+        return options
+
+    def record_question(
+        self, tier: Optional[str], answer: str, used_fast_answer: bool, start: float
+    ):
+        """
+        Record the latency and outcome of answering a question in a tier, to
+        tune the routing with.
+        """
+        if used_fast_answer:
+            outcome = "fast_answer"
+        elif answer.startswith(FALLBACK_NOTICE):
+            outcome = "fallback"
+        elif answer.startswith("Error:"):
+            outcome = "error"
+        else:
+            outcome = "completed"
+
+        labels = {"assistant": self.ai_config["name"], "tier": tier or "none", "outcome": outcome}
+        set_labels(outcome=outcome)
+        metrics_service.increment("questions", **labels)
+        metrics_service.observe("question_secs", time.monotonic() - start, **labels)
 
+    def get_thread_run_args(
+        self, message: Dict, tier: Optional[str], session: Optional[ConversationSession]
+    ) -> Dict:
+        """
+        Arguments to run a message on a new thread, or on the session's
+        thread if it has one, with the session's pending messages first.
+        """
+        args: Dict = {"assistant_id": self.ai_config["assistant_id"], **self.get_run_options(tier)}
+        if session is None:
+            args["thread"] = {"messages": [message]}
+            return args
+
+        truncation_strategy = self.ai_config.get("sessions", {}).get("truncation_strategy")
+        if truncation_strategy:
+            args["truncation_strategy"] = truncation_strategy
+        messages = session.pending_messages + [message]
+        if session.thread_id:
+            args["thread_id"] = session.thread_id
+            args["additional_messages"] = messages
+        else:
+            args["thread"] = {"messages": messages}
+        return args
+
+    # Helper method to run an assistant thread and return the response
+    def run_ai_assistant_thread(
+        self,
+        message: Dict,
+        tier: Optional[str] = None,
+        session: Optional[ConversationSession] = None,
+    ):
+        start = time.monotonic()
+        deadline = self.get_run_deadline(start, tier)
+        with stage("create_run"):
+            run = self.create_run(message, tier, session)
+        self.start_run(run, session)
+        run = self.poll_run(run, deadline)
         logging.debug(f"Thread run status: {run.status}")
-        
-        if run.status == "completed":
-            messages = list(
-                self.openai_client.beta.threads.messages.list(
-                    thread_id=thread.id, run_id=run.id
-                )
+        return self.finish_run(run, message, start, deadline, session)
+
+    def create_run(
+        self, message: Dict, tier: Optional[str], session: Optional[ConversationSession]
+    ) -> Run:
+        """
+        Create a run of the message, see `get_thread_run_args` and
+        `handle_refused_thread`.
+        """
+        args = self.get_thread_run_args(message, tier, session)
+        if "thread_id" not in args:
+            # the thread and run are created in one request
+            return self.openai_client.beta.threads.create_and_run(**args)
+
+        try:
+            return self.openai_client.beta.threads.runs.create(**args)
+        except BadRequestError as e:
+            self.handle_refused_thread(session, args["thread_id"], e)
+            return self.create_run(message, tier, session)
+
+    @staticmethod
+    def handle_refused_thread(
+        session: Optional[ConversationSession], thread_id: str, error: Exception
+    ):
+        """
+        Move a session to a new thread after its thread refused a run, like
+        when an earlier run is still active on it. Without a session the
+        error is raised.
+        """
+        if session is None:
+            raise error
+        logging.warning(f"Unable to run on thread {thread_id}, starting a new one: {error}")
+        session.fail_run()
+
+    @staticmethod
+    def start_run(run: Run, session: Optional[ConversationSession]):
+        annotate(thread_id=run.thread_id, run_id=run.id)
+        if session is not None:
+            session.start_run(run.thread_id)
+
+    def finish_run(
+        self,
+        run: Optional[Run],
+        message: Dict,
+        start: float,
+        deadline: Optional[float],
+        session: Optional[ConversationSession],
+        answer_message: Optional[Message] = None,
+    ) -> str:
+        """
+        The answer of a run that stopped, with its citations, or the answer
+        of `handle_failed_run` if it didn't complete. A run still going at
+        the deadline is cancelled. Shared by polled and streamed runs, and
+        with `AsyncOpenAIService`.
+
+        :param run: None if a stream stopped before the run was created
+        :param answer_message: the run's last assistant message if a stream
+            already has it, otherwise it is fetched
+        """
+        if run is not None:
+            add_usage(run.usage)
+
+        if run is None or run.status != "completed":
+            if session is not None:
+                session.fail_run()
+            timed_out = deadline is not None and time.monotonic() >= deadline
+            if run is not None:
+                if timed_out and run.status in ("queued", "in_progress"):
+                    self.cancel_run(run)
+                # Log detailed info on failure
+                logging.error(f"Assistant thread run failed with status: {run.status}")
+                logging.error(f"Thread ID: {run.thread_id}, Run ID: {run.id}")
+            return self.handle_failed_run(
+                message,
+                "deadline_exceeded" if timed_out else getattr(run, "status", "failed"),
+                start,
             )
-            message_content = messages[0].content[0].text  # type: ignore
-            annotations = message_content.annotations
-            citations = []
-            for index, annotation in enumerate(annotations):
-                message_content.value = message_content.value.replace(
-                    annotation.text, f"[{index}]"
+
+        if answer_message is None:
+            # only the run's final assistant message is needed
+            with stage("fetch_message"):
+                answer_message = self.openai_client.beta.threads.messages.list(
+                    thread_id=run.thread_id, run_id=run.id, order="desc", limit=1
+                ).data[0]
+        answer = self.get_answer_with_citations(answer_message)
+
+        self.record_run("completed", start)
+        if session is not None:
+            session.complete_run()
+        return answer
+
+    def get_run_deadline(self, start: float, tier: Optional[str] = None) -> Optional[float]:
+        run_deadline_secs = self.get_tier_config(tier).get("run_deadline_secs")
+        return start + run_deadline_secs if run_deadline_secs else None
+
+    def get_poll_interval(self, polls: int, deadline: Optional[float] = None) -> Optional[float]:
+        """
+        How long to wait before polling a run again. Polls start fast, since
+        most of a short run's latency is the last poll interval, and back off
+        following the assistant's "poll_schedule_secs". The last interval
+        repeats.
+
+        :param polls: how many polls were made so far
+        :param deadline: a `time.monotonic()` value, intervals end there
+        :return: None once the deadline has passed
+        """
+        now = time.monotonic()
+        if deadline is not None and now >= deadline:
+            return None
+
+        schedule = self.ai_config.get("poll_schedule_secs") or DEFAULT_POLL_SCHEDULE_SECS
+        interval = schedule[min(polls, len(schedule) - 1)]
+        if deadline is not None:
+            interval = max(min(interval, deadline - now), 0)
+        return interval
+
+    def poll_run(self, run: Run, deadline: Optional[float] = None) -> Run:
+        """
+        Poll a run until it stops, see `get_poll_interval`.
+
+        If the run is still going at `deadline` (a `time.monotonic()` value)
+        it is cancelled and returned without waiting for the cancellation.
+
+        :param run:
+        :param deadline:
+        :return: the run in its final state
+        """
+        polls = 0
+        while run.status in POLLED_RUN_STATUSES:
+            interval = self.get_poll_interval(polls, deadline)
+            if interval is None:
+                return self.cancel_run(run)
+
+            # the time until a poll sees the status change counts as the
+            # status' stage, e.g. "run_queued"
+            with stage(f"run_{run.status}"):
+                time.sleep(interval)
+                polls += 1
+                run = self.openai_client.beta.threads.runs.retrieve(
+                    run.id, thread_id=run.thread_id
                 )
-                if file_citation := getattr(annotation, "file_citation", None):
-                    cited_file = self.openai_client.files.retrieve(
-                        file_citation.file_id
-                    )
-                    citations.append(f"[{index}] {cited_file.filename}")
 
-            answer = message_content.value + "\n".join(citations)
+        logging.debug(f"Run {run.id} finished after {polls} polls")
+        return run
+
+    def cancel_run(self, run: Run) -> Run:
+        logging.warning(f"Run {run.id} passed its deadline while {run.status}, cancelling")
+        try:
+            return self.openai_client.beta.threads.runs.cancel(
+                run.id, thread_id=run.thread_id
+            )
+        except Exception as e:
+            # it may have finished in the meantime
+            logging.warning(f"Failed to cancel run {run.id}: {e}")
+            return run
 
-            question = message.get("content", "No content")
-            logging.info(f"Q: {question}\nA: {answer}")
+    def stream_ai_assistant_thread(
+        self,
+        message: Dict,
+        on_text: Callable[[str], None],
+        tier: Optional[str] = None,
+        session: Optional[ConversationSession] = None,
+    ) -> str:
+        """
+        Run an assistant thread over the assistants event stream. `on_text`
+        is called with the answer so far each time text arrives, and the
+        answer with its citations resolved is returned once the run is done.
+
+        Like `run_ai_assistant_thread`, the run is cancelled at the
+        assistant's deadline.
+
+        :param message:
+        :param on_text:
+        :param tier: see `get_run_options`
+        :param session: see `get_thread_run_args`
+        :return:
+        """
+        start = time.monotonic()
+        deadline = self.get_run_deadline(start, tier)
+        client = self.openai_client
+        if deadline is not None:
+            # the read timeout catches a stream that stops sending events
+            client = client.with_options(timeout=deadline - start)
+
+        run = None
+        stream = None
+        answer_message = None
+        try:
+            with ExitStack() as stack:
+                stream = self.open_run_stream(stack, client, message, tier, session)
+                text = ""
+                for delta in stream.text_deltas:
+                    run = stream.current_run
+                    if deadline is not None and time.monotonic() >= deadline:
+                        break
+                    if not text:
+                        add_stage("first_text", time.monotonic() - start)
+                    text += delta
+                    with stage("post_text"):
+                        on_text(text)
+                else:
+                    run = stream.get_final_run()
+                    answer_message = self.get_last_assistant_message(stream.get_final_messages())
+        except APITimeoutError:
+            logging.warning("Assistant stream timed out")
+            run = stream.current_run if stream is not None else None
+        add_stage("stream", time.monotonic() - start)
+
+        if run is not None:
+            self.start_run(run, session)
+        return self.finish_run(run, message, start, deadline, session, answer_message)
+
+    def open_run_stream(
+        self,
+        stack: ExitStack,
+        client: OpenAI,
+        message: Dict,
+        tier: Optional[str],
+        session: Optional[ConversationSession],
+    ) -> AssistantEventHandler:
+        """
+        Start streaming a run of the message, closed with `stack`, see
+        `create_run`.
+        """
+        args = self.get_thread_run_args(message, tier, session)
+        if "thread_id" not in args:
+            return stack.enter_context(client.beta.threads.create_and_run_stream(**args))
 
-            return answer
+        try:
+            return stack.enter_context(client.beta.threads.runs.stream(**args))
+        except BadRequestError as e:
+            self.handle_refused_thread(session, args["thread_id"], e)
+            return self.open_run_stream(stack, client, message, tier, session)
 
-        else:
-            # Log detailed info on failure
-            logging.error(f"Assistant thread run failed with status: {run.status}")
-            # Optionally you can also log thread and run IDs for easier tracing
-            logging.error(f"Thread ID: {thread.id}, Run ID: {run.id}")
-            return f"Error: Assistant run status {run.status}"
-
-
-    # @staticmethod
-    # def log_qa(ai_assistant: str, question: str, answer: str):
-    #     history_log_prefix = ElasticService.ai_assistant_history_log_prefix
-    #     logging.info(
-    #         "%s: %s",
-    #         history_log_prefix,
-    #         json.dumps(
-    #             {"ai_assistant": ai_assistant, "question": question, "answer": answer}
-    #         ),
-    #     )
+    @staticmethod
+    def get_last_assistant_message(messages: List[Message]) -> Optional[Message]:
+        assistant_messages = [m for m in messages if m.role == "assistant"]
+        return assistant_messages[-1] if assistant_messages else None
+
+    def handle_failed_run(self, message: Dict, outcome: str, start: float) -> str:
+        """
+        Answer through `get_fallback_answer` if the assistant allows it,
+        otherwise return the error.
+
+        :param message:
+        :param outcome: the run status, or "deadline_exceeded"
+        :param start: when the run started, from `time.monotonic()`
+        :return:
+        """
+        answer = None
+        try:
+            if self.ai_config.get("fallback_to_chat"):
+                with stage("fallback"):
+                    answer = self.get_fallback_answer(message.get("content", ""))
+        finally:
+            # one outcome per run, "fallback" if the fallback answered
+            self.record_run("fallback" if answer else outcome, start)
+
+        return answer or f"Error: Assistant run status {outcome}"
+
+    def get_fallback_answer(self, question: str) -> Optional[str]:
+        """
+        A quick answer from a single chat completion when the assistant run
+        fails or is too slow. It has no file search, so the context is the
+        system instructions and the assistant's recently cached answers.
+
+        :param question:
+        :return: the answer prefixed with `FALLBACK_NOTICE`, or None
+        """
+        recent_answers = answer_cache.get_recent_answers(self.ai_config["name"])
+        context = self.ai_config.get("system_instructions", "")
+        if recent_answers:
+            context += "\nAnswers you gave recently, use them if they are relevant:\n"
+            context += "\n".join(f"Q: {q}\nA: {a}" for q, a in recent_answers)
+
+        answer = self.get_response_from_openai(context, question)
+        if not answer:
+            return None
+
+        return f"{FALLBACK_NOTICE}\n\n{answer}"
+
+    def get_fast_answer(self, question: str, model: Optional[str] = None) -> Optional[str]:
+        """
+        Answer from the passages of the local search index that best match
+        the question, with a single chat completion instead of an assistant
+        run. Cited passages are listed like assistant citations.
+
+        :param question:
+        :param model: the chat model, gpt-4o by default
+        :return: the answer, or None if nothing matched or the completion
+            failed
+        """
+        start = time.monotonic()
+        passages = get_corpus_index(self.ai_config["name"]).search(
+            question, self.ai_config.get("fast_answer_passages", 8)
+        )
+        if not passages:
+            return None
+
+        context = self.get_passage_context(passages)
+        answer = self.get_response_from_openai(context, question, model or "gpt-4o")
+        metrics_service.observe(
+            "fast_answer_secs", time.monotonic() - start, assistant=self.ai_config["name"]
+        )
+        if not answer:
+            return None
+
+        return self.cite_passages(answer, passages)
+
+    def get_passage_context(self, passages: List[Passage]) -> str:
+        """
+        The system instructions with numbered passages to answer from.
+        """
+        context = self.ai_config.get("system_instructions", "")
+        context += (
+            "\nAnswer using only the numbered excerpts below, citing them like [1]. "
+            "If they don't answer the question, say so.\n"
+        )
+        context += "\n\n".join(
+            f"[{n}] ({p.source})\n{p.text}" for n, p in enumerate(passages, start=1)
+        )
+        return context
+
+    @staticmethod
+    def cite_passages(answer: str, passages: List[Passage]) -> str:
+        """
+        Append the source of each passage cited in an answer like [1].
+        """
+        cited = sorted({int(n) for n in re.findall(r"\[(\d+)\]", answer) if 0 < int(n) <= len(passages)})
+        citations = [f"[{n}] {passages[n - 1].source}" for n in cited]
+        return "\n".join([answer, *citations])
+
+    def record_run(self, outcome: str, start: float):
+        labels = {"assistant": self.ai_config["name"], "outcome": outcome}
+        metrics_service.increment("assistant_runs", **labels)
+        metrics_service.observe("assistant_run_secs", time.monotonic() - start, **labels)
+
+    def get_answer_with_citations(self, message: Message) -> str:
+        """
+        Replace the annotations in an assistant message with "[n]" and append
+        the filename each one cites.
+
+        :param message:
+        :return:
+        """
+        with stage("citations"):
+            filenames = self.ai_file.get_filenames(self.get_cited_file_ids(message))
+        return self.format_answer_with_citations(message, filenames)
+
+    @staticmethod
+    def get_cited_file_ids(message: Message) -> List[str]:
+        return [
+            file_citation.file_id
+            for annotation in message.content[0].text.annotations  # type: ignore
+            if (file_citation := getattr(annotation, "file_citation", None))
+        ]
+
+    @staticmethod
+    def format_answer_with_citations(message: Message, filenames: Dict[str, str]) -> str:
+        """
+        See `get_answer_with_citations`.
+
+        :param message:
+        :param filenames: file id to filename for the cited files
+        :return:
+        """
+        message_content = message.content[0].text  # type: ignore
+        annotations = message_content.annotations
+        if not annotations:
+            return message_content.value
+
+        # the first annotation with a given text numbers all of its occurrences
+        text_to_index: Dict[str, int] = {}
+        for index, annotation in enumerate(annotations):
+            text_to_index.setdefault(annotation.text, index)
+        pattern = re.compile(
+            "|".join(re.escape(t) for t in sorted(text_to_index, key=len, reverse=True))
+        )
+        value = pattern.sub(lambda m: f"[{text_to_index[m.group(0)]}]", message_content.value)
+
+        citations = []
+        for index, annotation in enumerate(annotations):
+            if file_citation := getattr(annotation, "file_citation", None):
+                filename = filenames.get(file_citation.file_id, file_citation.file_id)
+                citations.append(f"[{index}] {filename}")
+
+        return value + "\n".join(citations)
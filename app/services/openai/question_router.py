@@ -0,0 +1,105 @@
+import logging
+import re
+from typing import Dict, Tuple
+
+from openai import OpenAI
+
+from app.services.metrics import metrics_service
+from app.utils import LRUCache, normalize_text
+
+FAST_TIER = "fast"
+THOROUGH_TIER = "thorough"
+
+# questions that need analysis across documents
+THOROUGH_PATTERN = re.compile(
+    r"\b(compar\w*|versus|vs\.?|differ\w*|why|analy\w*|strateg\w*|pros and cons|swot|"
+    r"recommend\w*|should (we|i)|trend\w*|position\w*|evaluat\w*|implications?|"
+    r"all (of )?(our |the )?competitors|each competitor|overview)\b",
+    re.IGNORECASE,
+)
+# questions that are usually a single fact
+LOOKUP_PATTERN = re.compile(
+    r"^\s*(what|who|when|where|which|how (many|much|old|big)|does|do|is|are|list)\b",
+    re.IGNORECASE,
+)
+
+CLASSIFIER_INSTRUCTIONS = """
+Classify the user's question about competitors. Reply with one word:
+"fast" if it is a quick factual lookup that one document can answer,
+"thorough" if it needs analysis, comparison or several documents.
+"""
+
+# normalized question -> (tier, reason)
+_classifications = LRUCache(maxsize=2048, ttl_secs=24 * 60 * 60)
+
+
+class QuestionRouter:
+    """
+    Picks the latency tier for a question from the assistant's "routing"
+    config. Cheap heuristics decide most questions. Ones they can't decide
+    go to an LLM classifier if "llm_classification" is set, otherwise to the
+    "default_tier".
+    """
+
+    def __init__(self, openai_client: OpenAI, routing_config: Dict):
+        self.openai_client = openai_client
+        self.routing_config = routing_config
+
+    def classify(self, question: str) -> Tuple[str, str]:
+        """
+        :param question:
+        :return: the tier and the reason it was picked
+        """
+        words = len(question.split())
+        max_fast_words = self.routing_config.get("max_fast_words", 20)
+
+        if THOROUGH_PATTERN.search(question):
+            return THOROUGH_TIER, "keyword"
+        if words > 2 * max_fast_words or question.count("?") > 1:
+            return THOROUGH_TIER, "long"
+        if words <= max_fast_words and LOOKUP_PATTERN.search(question):
+            return FAST_TIER, "lookup"
+
+        if self.routing_config.get("llm_classification"):
+            tier = self.classify_with_llm(question)
+            if tier is not None:
+                return tier, "llm"
+
+        return self.routing_config.get("default_tier", THOROUGH_TIER), "default"
+
+    def classify_with_llm(self, question: str) -> str | None:
+        try:
+            response = self.openai_client.chat.completions.create(
+                model=self.routing_config.get("classifier_model", "gpt-4o-mini"),
+                messages=[
+                    {"role": "system", "content": CLASSIFIER_INSTRUCTIONS},
+                    {"role": "user", "content": question},
+                ],
+                temperature=0,
+                max_tokens=3,
+            )
+        except Exception as e:
+            logging.warning("Question classification failed: %s", e)
+            return None
+
+        answer = (response.choices[0].message.content or "").strip().lower()
+        if answer.startswith(FAST_TIER):
+            return FAST_TIER
+        if answer.startswith(THOROUGH_TIER):
+            return THOROUGH_TIER
+        return None
+
+    def route(self, assistant_name: str, question: str) -> str:
+        """
+        Classify a question, reusing earlier classifications of the same
+        question, and count the decision.
+        """
+        key = (assistant_name, normalize_text(question))
+        tier, reason = _classifications.get(key) or self.classify(question)
+        _classifications.set(key, (tier, reason))
+
+        logging.info("Routing question to the %s tier (%s)", tier, reason)
+        metrics_service.increment(
+            "routed_questions", assistant=assistant_name, tier=tier, reason=reason
+        )
+        return tier
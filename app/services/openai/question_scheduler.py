@@ -0,0 +1,191 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Tuple
+
+from app.services.metrics import metrics_service
+
+# lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+
+@dataclass
+class ScheduledQuestion:
+    start: Callable[[], Future]
+    user_id: str
+    channel_id: Optional[str]
+    priority: int
+    seq: int
+    user_limit: Optional[int] = None
+    future: Future = field(default_factory=Future)
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class QuestionScheduler:
+    """
+    Limits how many assistant questions run at once.
+
+    Questions over the global cap, or from a user already at their own
+    limit, wait in a queue. Interactive questions go before batch ones, and
+    within a priority the channel and then the user with the fewest
+    questions running goes next, so one user pasting ten questions can't
+    starve everyone else.
+    """
+
+    def __init__(self, max_concurrent: Optional[int] = None, max_per_user: Optional[int] = None):
+        self.max_concurrent = max_concurrent or int(os.getenv("QUESTION_MAX_CONCURRENT", 8))
+        self.max_per_user = max_per_user or int(os.getenv("QUESTION_MAX_PER_USER", 2))
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrent, thread_name_prefix="question"
+        )
+        self.queue: List[ScheduledQuestion] = []
+        self.running_by_user: Counter = Counter()
+        self.running_by_channel: Counter = Counter()
+        self.running = 0
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        fn: Callable[[], Any],
+        user_id: str,
+        channel_id: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        user_limit: Optional[int] = None,
+    ) -> Tuple[Future, int]:
+        """
+        Schedule a blocking call, run on the scheduler's threads.
+
+        :param user_limit: how many of the user's questions may run at once,
+            instead of the scheduler's max_per_user
+        :return: a future for the result, and the place in line, 0 if it
+            started right away
+        """
+        return self.submit_future(
+            lambda: self.executor.submit(fn), user_id, channel_id, priority, user_limit
+        )
+
+    def submit_future(
+        self,
+        start: Callable[[], Future],
+        user_id: str,
+        channel_id: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        user_limit: Optional[int] = None,
+    ) -> Tuple[Future, int]:
+        """
+        Schedule work that runs elsewhere, like on the asyncio runner.
+        `start` is called when it's the question's turn, and the slot is held
+        until the future it returns is done.
+
+        :return: see `submit`
+        """
+        question = ScheduledQuestion(
+            start=start,
+            user_id=user_id,
+            channel_id=channel_id,
+            priority=priority,
+            seq=next(self._seq),
+            user_limit=user_limit,
+        )
+        with self._lock:
+            self.queue.append(question)
+            started = self._dispatch()
+            position = self._position(question) if question not in started else 0
+
+        for scheduled in started:
+            self._start(scheduled)
+
+        if position:
+            metrics_service.increment("questions_queued", priority=priority)
+        return question.future, position
+
+    def _position(self, question: ScheduledQuestion) -> int:
+        """
+        An estimate of the place in line: higher priorities go first, then
+        users take turns.
+        """
+        ranks: Counter = Counter()
+        turns = {}
+        for queued in sorted(self.queue, key=lambda queued: queued.seq):
+            turns[queued.seq] = (queued.priority, ranks[queued.user_id], queued.seq)
+            ranks[queued.user_id] += 1
+
+        return 1 + sum(turn < turns[question.seq] for turn in turns.values())
+
+    def _next(self) -> Optional[ScheduledQuestion]:
+        eligible = [
+            question
+            for question in self.queue
+            if self.running_by_user[question.user_id] < (question.user_limit or self.max_per_user)
+        ]
+        if not eligible:
+            return None
+
+        return min(
+            eligible,
+            key=lambda question: (
+                question.priority,
+                self.running_by_channel[question.channel_id],
+                self.running_by_user[question.user_id],
+                question.seq,
+            ),
+        )
+
+    def _dispatch(self) -> List[ScheduledQuestion]:
+        """
+        Take as many questions off the queue as there are free slots. Must
+        hold the lock, the questions are started once it's released.
+        """
+        started = []
+        while self.running < self.max_concurrent:
+            question = self._next()
+            if question is None:
+                break
+
+            self.queue.remove(question)
+            self.running += 1
+            self.running_by_user[question.user_id] += 1
+            self.running_by_channel[question.channel_id] += 1
+            started.append(question)
+
+        return started
+
+    def _start(self, question: ScheduledQuestion):
+        metrics_service.observe(
+            "question_queue_secs",
+            time.monotonic() - question.queued_at,
+            priority=question.priority,
+        )
+        try:
+            future = question.start()
+        except Exception as e:
+            logging.exception("Unable to start question for %s", question.user_id)
+            future = Future()
+            future.set_exception(e)
+
+        future.add_done_callback(lambda done: self._finish(question, done))
+
+    def _finish(self, question: ScheduledQuestion, done: Future):
+        with self._lock:
+            self.running -= 1
+            self.running_by_user[question.user_id] -= 1
+            self.running_by_channel[question.channel_id] -= 1
+            started = self._dispatch()
+
+        if done.exception() is not None:
+            question.future.set_exception(done.exception())  # type: ignore
+        else:
+            question.future.set_result(done.result())
+
+        for scheduled in started:
+            self._start(scheduled)
+
+
+question_scheduler = QuestionScheduler()
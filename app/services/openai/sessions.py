@@ -0,0 +1,108 @@
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from app.utils import LRUCache
+
+DEFAULT_SESSION_IDLE_SECS = 30 * 60
+
+
+@dataclass
+class ConversationSession:
+    """
+    A user's conversation with an assistant in a channel. Follow-up
+    questions are run on the same assistant thread, so they don't have to
+    restate the earlier ones.
+
+    Turns answered without a run on the thread, like cached or fast
+    answers, are kept in `pending_messages` and added to the thread with the
+    next run.
+    """
+
+    thread_id: Optional[str] = None
+    pending_messages: List[Dict] = field(default_factory=list)
+    turns: int = 0
+    # a thread can only have one active run, so turns take the lock
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    _run_started: bool = False
+    _run_completed: bool = False
+
+    @property
+    def is_follow_up(self) -> bool:
+        return self.turns > 0
+
+    def start_run(self, thread_id: str):
+        """
+        Called once a run of the turn is created, the pending messages are
+        now on the thread.
+        """
+        self.thread_id = thread_id
+        self.pending_messages = []
+        self._run_started = True
+
+    def complete_run(self):
+        self._run_completed = True
+
+    def fail_run(self):
+        """
+        Called when a run of the turn didn't complete, or couldn't be
+        created. The run may still be active on the thread, which refuses
+        new runs until it stops, so the next turn starts a new thread with
+        this turn's question pending.
+        """
+        self.thread_id = None
+        self._run_started = False
+
+    def add_turn(self, question: str, answer: str, max_pending: int = 20):
+        """
+        Finish a turn, keeping whatever of it the thread doesn't have.
+        """
+        if not self._run_started:
+            self.pending_messages.append({"role": "user", "content": question})
+        if not self._run_completed and not answer.startswith("Error:"):
+            self.pending_messages.append({"role": "assistant", "content": answer})
+        del self.pending_messages[:-max_pending]
+
+        self.turns += 1
+        self._run_started = False
+        self._run_completed = False
+
+
+class SessionStore:
+    """
+    Conversation sessions by assistant, user and channel. Sessions expire
+    after `idle_secs` without a question, and the least recently used are
+    dropped past SESSION_MAX_COUNT (defaults to 1000).
+    """
+
+    def __init__(self, maxsize: Optional[int] = None):
+        self.sessions = LRUCache(maxsize=maxsize or int(os.getenv("SESSION_MAX_COUNT", 1000)))
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(assistant_name: str, user_id: str, channel_id: Optional[str]) -> tuple:
+        return assistant_name, user_id, channel_id
+
+    def get(
+        self,
+        assistant_name: str,
+        user_id: str,
+        channel_id: Optional[str] = None,
+        idle_secs: float = DEFAULT_SESSION_IDLE_SECS,
+    ) -> ConversationSession:
+        """
+        The current session, or a new one. Getting a session restarts its
+        idle timer.
+        """
+        key = self.get_key(assistant_name, user_id, channel_id)
+        with self._lock:
+            session = self.sessions.get(key) or ConversationSession()
+            self.sessions.set(key, session, ttl_secs=idle_secs)
+            return session
+
+    def end(self, assistant_name: str, user_id: str, channel_id: Optional[str] = None):
+        self.sessions.pop(self.get_key(assistant_name, user_id, channel_id))
+
+
+session_store = SessionStore()
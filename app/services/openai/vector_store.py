@@ -1,5 +1,8 @@
 import logging
+import os
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Literal, Optional, Dict
 
 from openai.types import FileObject
@@ -7,7 +10,7 @@ from openai.types import VectorStore
 
 from .file import OpenAIFile
 from .mixin import OpenAIMixin
-from app.utils import chunker
+from app.utils import chunker, LRUCache
 from openai import OpenAI, NOT_GIVEN, NotGiven, BaseModel
 from openai.types.vector_stores import (
     VectorStoreFile,
@@ -21,11 +24,50 @@ class OpenAiFileStatus(BaseModel):
     transfer_status: Optional[str] = None
 
 
+# vector store id -> version, shared so version checks stay cheap
+_version_cache = LRUCache(maxsize=64, ttl_secs=15)
+
+
 class OpenAIVectorStore:
+    VERSION_METADATA_KEY = "ingest_version"
+
     def __init__(self, client: OpenAI):
         self.openai_client = client
         self.ai_file = OpenAIFile(client)
 
+    @staticmethod
+    def get_chunking_strategy(
+        file_name: str, chunking_strategies: Optional[Dict[str, Dict]] = None
+    ) -> Dict | NotGiven:
+        """
+        Get the static chunking strategy for a file based on its extension.
+
+        `chunking_strategies` maps an extension (e.g. ".pdf") or "default" to
+        a dict with `max_chunk_size_tokens` and `chunk_overlap_tokens`. If
+        nothing matches, openai's auto chunking is used.
+
+        :param file_name:
+        :param chunking_strategies:
+        :return:
+        """
+        if not chunking_strategies:
+            return NOT_GIVEN
+
+        _, ext = os.path.splitext(file_name)
+        profile = chunking_strategies.get(ext.lower()) or chunking_strategies.get(
+            "default"
+        )
+        if not profile:
+            return NOT_GIVEN
+
+        return {
+            "type": "static",
+            "static": {
+                "max_chunk_size_tokens": profile["max_chunk_size_tokens"],
+                "chunk_overlap_tokens": profile["chunk_overlap_tokens"],
+            },
+        }
+
     @OpenAIMixin.paginate_decorator
     def list(self, **kwargs) -> List[VectorStore]:
         try:
@@ -42,6 +84,42 @@ class OpenAIVectorStore:
             logging.error("Failed to create vector store %s", name)
             raise
 
+    def get_version(self, vector_store_id: str) -> str:
+        """
+        Get the version of a vector store's contents. It changes whenever
+        files are added or removed through this class, and is cached for a
+        few seconds.
+
+        :param vector_store_id:
+        :return:
+        """
+        version = _version_cache.get(vector_store_id)
+        if version is None:
+            vs = self.openai_client.vector_stores.retrieve(vector_store_id)
+            version = (vs.metadata or {}).get(self.VERSION_METADATA_KEY, "0")
+            _version_cache.set(vector_store_id, version)
+
+        return version
+
+    def bump_version(self, vector_store_id: str):
+        """
+        Record that a vector store's contents changed, which invalidates
+        anything keyed on `get_version`.
+
+        :param vector_store_id:
+        :return:
+        """
+        try:
+            vs = self.openai_client.vector_stores.retrieve(vector_store_id)
+            version = str(time.time_ns())
+            self.openai_client.vector_stores.update(
+                vector_store_id,
+                metadata={**(vs.metadata or {}), self.VERSION_METADATA_KEY: version},
+            )
+            _version_cache.set(vector_store_id, version)
+        except Exception as e:
+            logging.warning("Failed to bump vector store version %s", e)
+
     def get_by_name(self, name: str) -> List[VectorStore]:
         try:
             return [v for v in self.list() if v.name == name]
@@ -51,21 +129,50 @@ class OpenAIVectorStore:
             raise
 
     def delete_file(
-        self, file_id: str, vector_store_id
+        self, file_id: str, vector_store_id, bump_version: bool = True
     ) -> VectorStoreFileDeleted | None:
+        """
+        :param bump_version: see `bump_version`, off for callers that bump
+            once after deleting several files
+        """
         try:
             deleted_vector_store_file = self.openai_client.vector_stores.files.delete(
                 vector_store_id=vector_store_id,
                 file_id=file_id,
             )
+            if bump_version:
+                self.bump_version(vector_store_id)
             return deleted_vector_store_file
         except Exception as e:
             logging.warning(str(e))
             return None
 
+    def delete_files(
+        self, file_ids: List[str], vector_store_id: str, max_workers: int = 8
+    ) -> List[str]:
+        """
+        Delete files from a vector store concurrently.
+
+        :param file_ids:
+        :param vector_store_id:
+        :param max_workers:
+        :return: the ids that were deleted
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                lambda file_id: self.delete_file(file_id, vector_store_id, bump_version=False),
+                file_ids,
+            )
+            deleted = [file_id for file_id, resp in zip(file_ids, results) if resp]
+
+        if deleted:
+            self.bump_version(vector_store_id)
+        return deleted
+
     def delete_all_files(self, vector_store_id: str):
         for f in self.list_files(vector_store_id):
-            self.delete_file(f.id, vector_store_id)
+            self.delete_file(f.id, vector_store_id, bump_version=False)
+        self.bump_version(vector_store_id)
 
     @OpenAIMixin.paginate_decorator
     def list_files(
@@ -108,21 +215,33 @@ class OpenAIVectorStore:
         self,
         vector_store_id: str,
         ai_files: List[FileObject],
+        chunking_strategies: Optional[Dict[str, Dict]] = None,
         _attempt: int = 0,
         _max_attempts: int = 5,
         _cumulative_statuses: Optional[Dict[str, OpenAiFileStatus]] = None,
     ) -> List[OpenAiFileStatus]:
         id_to_ai_files = {f.id: f for f in ai_files}
 
+        # a batch can only have one chunking strategy, so group files by it
+        ext_to_file_ids: Dict[str, List[str]] = defaultdict(list)
+        for f in id_to_ai_files.values():
+            _, ext = os.path.splitext(f.filename)
+            ext_to_file_ids[ext.lower()].append(f.id)
+
         chunk_size = 50
-        for files_chunk in chunker([f.id for f in id_to_ai_files.values()], chunk_size):
-            _vector_store_file_batch = (
-                self.openai_client.vector_stores.file_batches.create(
-                    vector_store_id=vector_store_id,
-                    file_ids=files_chunk,
-                )
+        for file_ids in ext_to_file_ids.values():
+            chunking_strategy = self.get_chunking_strategy(
+                id_to_ai_files[file_ids[0]].filename, chunking_strategies
             )
-            time.sleep(2)
+            for files_chunk in chunker(file_ids, chunk_size):
+                _vector_store_file_batch = (
+                    self.openai_client.vector_stores.file_batches.create(
+                        vector_store_id=vector_store_id,
+                        file_ids=files_chunk,
+                        chunking_strategy=chunking_strategy,  # type: ignore
+                    )
+                )
+                time.sleep(2)
 
         max_secs = 100
         start = time.time()
@@ -171,6 +290,7 @@ class OpenAIVectorStore:
             return self.create_files_from_ai_files(
                 vector_store_id,
                 incomplete,
+                chunking_strategies=chunking_strategies,
                 _attempt=_attempt + 1,
                 _max_attempts=_max_attempts,
                 _cumulative_statuses=id_to_ai_file_status,
@@ -182,6 +302,7 @@ class OpenAIVectorStore:
         self,
         files_to_info: Dict[str, FileObject] | Dict[str, bytes],
         vector_store_id: str,
+        chunking_strategies: Optional[Dict[str, Dict]] = None,
     ) -> List[OpenAiFileStatus]:
         """
         Create vector store files given a dict of filenames to bytes (or file object)
@@ -195,6 +316,8 @@ class OpenAIVectorStore:
 
         :param files_to_info:
         :param vector_store_id:
+        :param chunking_strategies: extension to static chunking profile,
+            see `get_chunking_strategy`
         :return:
         """
 
@@ -206,4 +329,8 @@ class OpenAIVectorStore:
             else:
                 ai_files.append(file_bytes_or_name)
 
-        return self.create_files_from_ai_files(vector_store_id, ai_files)
+        statuses = self.create_files_from_ai_files(
+            vector_store_id, ai_files, chunking_strategies=chunking_strategies
+        )
+        self.bump_version(vector_store_id)
+        return statuses
@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from app.services.openai.openai_service import OpenAIService
+from app.services.search.competitors import get_competitor_directory
+from app.services.slack import slack_service
+from app.utils import LRUCache
+
+
+class WarmupService:
+    """
+    Gets ready for a question while the user is still typing it in the
+    modal: a constructed `OpenAIService` whose client has live connections,
+    the assistant's metadata and the vector store version cached, the
+    user's profile and the competitor names cached, and an empty thread
+    created for the user.
+
+    Services are reused until they've been idle for `service_ttl_secs`.
+    Threads are held for the assistant's "warm_thread_ttl_secs", and ones
+    that expire unused are deleted the next time anything is warmed.
+    """
+
+    def __init__(self, service_ttl_secs: float = 15 * 60):
+        self.services = LRUCache(maxsize=16, ttl_secs=service_ttl_secs)
+        # (assistant, user) -> (thread id, expires at)
+        self.threads: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="warmup")
+        self._lock = threading.Lock()
+
+    def get_service(self, assistant_name: str) -> OpenAIService:
+        """
+        The warm service for an assistant, or a new one.
+        """
+        service = self.services.get(assistant_name)
+        if service is None:
+            service = OpenAIService(assistant_name)
+        # re-set to restart the idle timer
+        self.services.set(assistant_name, service)
+        return service
+
+    def warm_in_background(self, assistant_name: str, user_id: str):
+        self.executor.submit(self.warm, assistant_name, user_id)
+
+    def warm(self, assistant_name: str, user_id: str):
+        """
+        Warm everything answering the user's question needs. Failures are
+        only logged, the question is answered either way.
+        """
+        start = time.monotonic()
+        try:
+            self.delete_expired_threads()
+            service = self.get_service(assistant_name)
+            ai_config = service.ai_config
+
+            # these requests also open the client's connections
+            service.ai_assistant.get_cached(ai_config["assistant_id"])
+            service.ai_vector_store.get_version(ai_config["vector_store_id"])
+            slack_service.get_user_info(user_id)
+            # for the competitor typeahead
+            get_competitor_directory(ai_config).get_index()
+
+            thread_ttl_secs = ai_config.get("warm_thread_ttl_secs")
+            key = (assistant_name, user_id)
+            with self._lock:
+                has_thread = key in self.threads
+            if thread_ttl_secs and not has_thread:
+                thread = service.openai_client.beta.threads.create()
+                with self._lock:
+                    self.threads[key] = (thread.id, time.monotonic() + thread_ttl_secs)
+        except Exception as e:
+            logging.warning("Unable to warm up %s for %s: %s", assistant_name, user_id, e)
+            return
+
+        logging.info(
+            "Warmed up %s for %s in %.2fs", assistant_name, user_id, time.monotonic() - start
+        )
+
+    def take_thread(self, assistant_name: str, user_id: str) -> Optional[str]:
+        """
+        The user's warm thread, if there's one left. It's the caller's from
+        then on.
+        """
+        with self._lock:
+            thread_id, expires_at = self.threads.pop((assistant_name, user_id), (None, 0))
+        if thread_id is not None and expires_at <= time.monotonic():
+            self.executor.submit(self.delete_thread, assistant_name, thread_id)
+            return None
+        return thread_id
+
+    def delete_expired_threads(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = {
+                key: thread_id
+                for key, (thread_id, expires_at) in self.threads.items()
+                if expires_at <= now
+            }
+            for key in expired:
+                del self.threads[key]
+
+        for (assistant_name, _user_id), thread_id in expired.items():
+            self.delete_thread(assistant_name, thread_id)
+
+    def delete_thread(self, assistant_name: str, thread_id: str):
+        try:
+            self.get_service(assistant_name).openai_client.beta.threads.delete(thread_id)
+        except Exception as e:
+            logging.warning("Unable to delete warm thread %s: %s", thread_id, e)
+
+
+warmup_service = WarmupService()
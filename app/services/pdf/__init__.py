@@ -0,0 +1,3 @@
+from app.services.pdf.pdf import PDFService
+
+pdf_service = PDFService()
@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import fitz
+
+from app.services.search.bm25 import BM25Index
+from app.utils import LRUCache
+
+
+def extract_page_range(pdf_bytes: bytes, start: int, stop: int) -> List[str]:
+    """
+    Extract the text of pages [start, stop). Module level so it can run in
+    a worker process.
+    """
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        return [pdf_document[page_num].get_text() for page_num in range(start, stop)]
+
+
+class PDFService:
+    """
+    Extracts text from PDFs. Large documents are split into page ranges
+    that are extracted in a process pool, since PyMuPDF holds the GIL.
+    Extracted pages are cached by the sha256 of the document.
+    """
+
+    def __init__(self, pages_per_task: int = 8, max_workers: Optional[int] = None):
+        self.pages_per_task = pages_per_task
+        self.max_workers = max_workers or min(os.cpu_count() or 1, 4)
+        self.cache = LRUCache(maxsize=32)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawned, forking the threaded slack and api processes isn't safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    @staticmethod
+    def get_content_hash(pdf_bytes: bytes) -> str:
+        return hashlib.sha256(pdf_bytes).hexdigest()
+
+    def extract_pages(self, pdf_bytes: bytes) -> List[str]:
+        """
+        :param pdf_bytes:
+        :return: the text of each page
+        """
+        return self.extract_many([pdf_bytes])[0]
+
+    def extract_many(self, pdfs: List[bytes]) -> List[List[str]]:
+        """
+        Extract the pages of several PDFs, fanning out across the pages of
+        all of them at once.
+
+        :param pdfs:
+        :return: the text of each page, per PDF
+        """
+        hashes = [self.get_content_hash(pdf_bytes) for pdf_bytes in pdfs]
+        results: Dict[str, List[str]] = {}
+        tasks: Dict[str, List[Tuple[int, Future | List[str]]]] = {}
+
+        for content_hash, pdf_bytes in zip(hashes, pdfs):
+            if content_hash in results or content_hash in tasks:
+                continue
+
+            cached = self.cache.get(content_hash)
+            if cached is not None:
+                results[content_hash] = cached
+                continue
+
+            with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+                page_count = len(pdf_document)
+
+            if page_count <= self.pages_per_task:
+                # not worth the round trip to a worker
+                tasks[content_hash] = [(0, extract_page_range(pdf_bytes, 0, page_count))]
+                continue
+
+            tasks[content_hash] = [
+                (
+                    start,
+                    self.executor.submit(
+                        extract_page_range,
+                        pdf_bytes,
+                        start,
+                        min(start + self.pages_per_task, page_count),
+                    ),
+                )
+                for start in range(0, page_count, self.pages_per_task)
+            ]
+
+        for content_hash, ranges in tasks.items():
+            pages: List[str] = []
+            for _start, task in ranges:
+                pages.extend(task.result() if isinstance(task, Future) else task)
+            self.cache.set(content_hash, pages)
+            results[content_hash] = pages
+
+        return [results[content_hash] for content_hash in hashes]
+
+    @staticmethod
+    def split_sections(pages: List[str], max_section_chars: int = 2000) -> List[Tuple[int, str]]:
+        """
+        Split pages into sections of at most about `max_section_chars`, on
+        paragraph breaks. Short pages are a single section.
+
+        :param pages:
+        :param max_section_chars:
+        :return: a list of (1-based page number, section text)
+        """
+        sections = []
+        for page_num, text in enumerate(pages, start=1):
+            if len(text) <= max_section_chars:
+                sections.append((page_num, text))
+                continue
+
+            parts: List[str] = []
+            size = 0
+            for paragraph in text.split("\n\n"):
+                if parts and size + len(paragraph) > max_section_chars:
+                    sections.append((page_num, "\n\n".join(parts)))
+                    parts, size = [], 0
+                parts.append(paragraph)
+                size += len(paragraph) + 2
+            if parts:
+                sections.append((page_num, "\n\n".join(parts)))
+
+        return sections
+
+    def get_relevant_text(
+        self,
+        question: str,
+        documents: List[List[str]],
+        file_names: List[str],
+        top_k: int = 8,
+        max_chars: Optional[int] = None,
+    ) -> str:
+        """
+        Pick the sections of the documents' pages that best match a question
+        with BM25, instead of sending whole documents. Sections are kept in
+        document order under their page headers. If nothing matches, like for
+        "summarize this", the first pages are used.
+
+        :param question:
+        :param documents: the pages of each document
+        :param file_names: a name per document, for the headers
+        :param top_k:
+        :param max_chars:
+        :return:
+        """
+        sections = [
+            (doc_num, page_num, text)
+            for doc_num, pages in enumerate(documents)
+            for page_num, text in self.split_sections(pages)
+        ]
+        matches = BM25Index([text for _, _, text in sections]).search(question, top_k)
+        selected = sorted(section_id for section_id, _score in matches) or range(len(sections))
+
+        parts = []
+        size = 0
+        for section_id in selected:
+            doc_num, page_num, text = sections[section_id]
+            part = f"\n--- {file_names[doc_num]}, Page {page_num} ---\n{text}"
+            if max_chars is not None and size + len(part) > max_chars:
+                break
+            parts.append(part)
+            size += len(part)
+
+        logging.info(
+            "Sending %s of %s pdf sections for the question", len(parts), len(sections)
+        )
+        return "".join(parts)
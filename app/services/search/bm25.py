@@ -0,0 +1,110 @@
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:['.-][a-z0-9]+)*")
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by can do does for from has have how i in is it its "
+    "me my of on or our so than that the their them there these they this to us was "
+    "we were what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower case word tokens without stop words.
+    """
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOP_WORDS]
+
+
+def bm25_idf(doc_freqs: np.ndarray, doc_count: int) -> np.ndarray:
+    return np.log1p((doc_count - doc_freqs + 0.5) / (doc_freqs + 0.5))
+
+
+def bm25_scores(
+    query_terms: Iterable[Tuple[np.ndarray, np.ndarray, float]],
+    doc_lengths: np.ndarray,
+    k1: float = 1.2,
+    b: float = 0.75,
+) -> np.ndarray:
+    """
+    Score every document for a query.
+
+    :param query_terms: per query term, the ids of the documents it's in,
+        its frequency in each, and its idf
+    :param doc_lengths: the length in tokens of every document
+    :param k1:
+    :param b:
+    :return: a score per document
+    """
+    scores = np.zeros(len(doc_lengths), dtype=np.float32)
+    if not len(doc_lengths):
+        return scores
+
+    norms = k1 * (1 - b + b * doc_lengths / max(float(doc_lengths.mean()), 1.0))
+    for doc_ids, freqs, idf in query_terms:
+        freqs = freqs.astype(np.float32)
+        np.add.at(scores, doc_ids, idf * freqs * (k1 + 1) / (freqs + norms[doc_ids]))
+
+    return scores
+
+
+def top_k(scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    """
+    :return: the ids and scores of the k best scoring documents, best first,
+        leaving out documents that didn't match
+    """
+    k = min(k, int(np.count_nonzero(scores)))
+    if k <= 0:
+        return []
+
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return [(int(doc_id), float(scores[doc_id])) for doc_id in best]
+
+
+class BM25Index:
+    """
+    An in memory BM25 index over a small set of documents, like the pages
+    of the files attached to one question.
+    """
+
+    def __init__(self, documents: Sequence[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+        term_docs: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = []
+        for doc_id, document in enumerate(documents):
+            tokens = tokenize(document)
+            lengths.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                term_docs.setdefault(term, []).append((doc_id, freq))
+
+        self.doc_lengths = np.array(lengths, dtype=np.float32)
+        for term, docs in term_docs.items():
+            doc_ids, freqs = zip(*docs)
+            self.postings[term] = (
+                np.array(doc_ids, dtype=np.int32),
+                np.array(freqs, dtype=np.int32),
+            )
+
+        doc_freqs = np.array([len(d) for d, _ in self.postings.values()], dtype=np.float32)
+        self.idf = dict(zip(self.postings, bm25_idf(doc_freqs, len(documents))))
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """
+        :return: the ids, as indexes into the documents, and scores of the
+            best matching documents
+        """
+        query_terms = [
+            (*self.postings[term], self.idf[term])
+            for term in set(tokenize(query))
+            if term in self.postings
+        ]
+        scores = bm25_scores(query_terms, self.doc_lengths, self.k1, self.b)
+        return top_k(scores, k)
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from app.services.aws import aws_file_service
+from app.services.search.corpus_index import get_corpus_index
+from app.services.search.prefix_index import PrefixIndex
+
+
+def get_top_folders(keys: Iterable[str], prefixes: List[str]) -> List[str]:
+    """
+    The names of the folders directly under any of the prefixes.
+    """
+    folders = set()
+    for key in keys:
+        for prefix in prefixes:
+            rest = key.removeprefix(prefix)
+            if rest != key and "/" in rest:
+                folders.add(rest.split("/")[0])
+
+    return sorted(folders)
+
+
+class CompetitorDirectory:
+    """
+    An assistant's competitor names, and a `PrefixIndex` of them for
+    typeahead.
+
+    The names are the insights config's "competitors" if set, otherwise the
+    top level folders under "s3_folder_prefix", as listed in the local
+    search index, or in s3 if there isn't one. They're reloaded when the
+    search index gets a new build, after ingests, or after `ttl_secs`.
+
+    The index is only built in the caller the first time. After that it's
+    rebuilt in the background and the old one is served meanwhile, since
+    it's looked up on every keystroke.
+    """
+
+    def __init__(self, ai_config: Dict, ttl_secs: float = 10 * 60):
+        self.ai_config = ai_config
+        self.ttl_secs = ttl_secs
+        self._index: Optional[PrefixIndex] = None
+        self._build: Optional[str] = None
+        self._expires_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def load_names(self, build: Optional[str]) -> List[str]:
+        configured = (self.ai_config.get("insights") or {}).get("competitors")
+        if configured:
+            return configured
+
+        prefixes: List[str] = self.ai_config.get("s3_folder_prefix", [])
+        if build is not None:
+            keys: Iterable[str] = get_corpus_index(self.ai_config["name"]).get_manifest()
+        else:
+            bucket = self.ai_config["s3_bucket_vector_store_files"]
+            keys = [
+                obj["Key"]
+                for prefix in prefixes
+                for obj in aws_file_service.list_objects(bucket, prefix)
+            ]
+        return get_top_folders(keys, prefixes)
+
+    def get_index(self) -> PrefixIndex:
+        build = get_corpus_index(self.ai_config["name"]).get_current_build()
+        with self._lock:
+            if self._index is None:
+                index = PrefixIndex(self.load_names(build))
+                self.set_index(index, build)
+                return index
+
+            if (
+                self._build != build or time.monotonic() >= self._expires_at
+            ) and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self.refresh, args=(build,), daemon=True).start()
+            return self._index
+
+    def set_index(self, index: PrefixIndex, build: Optional[str]):
+        self._index = index
+        self._build = build
+        self._expires_at = time.monotonic() + self.ttl_secs
+
+    def refresh(self, build: Optional[str]):
+        try:
+            index = PrefixIndex(self.load_names(build))
+        except Exception as e:
+            logging.warning("Unable to reload the competitors of %s: %s", self.ai_config["name"], e)
+            index = None
+
+        with self._lock:
+            if index is not None:
+                self.set_index(index, build)
+            self._refreshing = False
+
+    def get_names(self) -> List[str]:
+        return list(self.get_index().names)
+
+    def search(self, query: str, limit: int = 100) -> List[str]:
+        return self.get_index().search(query, limit)
+
+
+_directories: Dict[str, CompetitorDirectory] = {}
+_directories_lock = threading.Lock()
+
+
+def get_competitor_directory(ai_config: Dict) -> CompetitorDirectory:
+    with _directories_lock:
+        if ai_config["name"] not in _directories:
+            _directories[ai_config["name"]] = CompetitorDirectory(ai_config)
+        return _directories[ai_config["name"]]
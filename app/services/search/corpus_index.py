@@ -0,0 +1,283 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.services.search.bm25 import bm25_idf, bm25_scores, tokenize, top_k
+from app.services.search.text import get_texts, split_passages
+
+
+@dataclass
+class Passage:
+    source: str
+    text: str
+    score: float
+
+
+class CorpusIndex:
+    """
+    A BM25 index over the passages of a corpus, kept on disk so the api
+    process can build it and the slack process can search it.
+
+    Layout of `index_dir`:
+
+        documents/<version hash>.json   passages and term counts of one
+                                        version of a document
+        build-<n>/manifest.json         source -> version of the documents
+        build-<n>/terms.json            term -> [start, stop] in the postings
+        build-<n>/doc_ids.npy           postings: passage ids, by term
+        build-<n>/freqs.npy             postings: term frequencies
+        build-<n>/lengths.npy           tokens per passage
+        build-<n>/passages.json         [source, text] per passage
+        CURRENT                         the name of the live build
+
+    The postings arrays are memory mapped. Updating only extracts and
+    tokenizes documents whose version changed, then writes a new build and
+    points CURRENT at it.
+    """
+
+    def __init__(self, index_dir: str, k1: float = 1.2, b: float = 0.75):
+        self.index_dir = index_dir
+        self.k1 = k1
+        self.b = b
+        self._build_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded: Optional[Tuple[str, Dict]] = None
+
+    @property
+    def documents_dir(self) -> str:
+        return os.path.join(self.index_dir, "documents")
+
+    @property
+    def current_path(self) -> str:
+        return os.path.join(self.index_dir, "CURRENT")
+
+    def get_current_build(self) -> Optional[str]:
+        try:
+            with open(self.current_path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def get_manifest(self) -> Dict[str, str]:
+        try:
+            return self.read_manifest()
+        except FileNotFoundError:
+            # replaced twice since CURRENT was read, so read it again
+            return self.read_manifest()
+
+    def read_manifest(self) -> Dict[str, str]:
+        build = self.get_current_build()
+        if build is None:
+            return {}
+
+        with open(os.path.join(self.index_dir, build, "manifest.json")) as f:
+            return json.load(f)
+
+    def get_document_path(self, version: str) -> str:
+        name = hashlib.sha1(version.encode()).hexdigest()
+        return os.path.join(self.documents_dir, f"{name}.json")
+
+    def index_document(self, source: str, version: str, content: bytes):
+        passages = split_passages(get_texts(source, content))
+        document = {
+            "passages": passages,
+            "terms": [Counter(tokenize(f"{source} {p}")) for p in passages],
+        }
+        with open(self.get_document_path(version), "w") as f:
+            json.dump(document, f)
+
+    def update(
+        self,
+        versions: Dict[str, str],
+        load: Callable[[str], bytes],
+        full: bool = False,
+    ) -> Dict:
+        """
+        Bring the index up to date with a corpus.
+
+        :param versions: every source in the corpus and its current version,
+            like an s3 key and its etag
+        :param load: gets the content of a source
+        :param full: re-extract every document, not just changed ones
+        :return: counts of what changed
+        """
+        start = time.monotonic()
+        with self._build_lock:
+            os.makedirs(self.documents_dir, exist_ok=True)
+            manifest = self.get_manifest()
+
+            changed = [
+                source
+                for source, version in versions.items()
+                if full
+                or manifest.get(source) != version
+                or not os.path.exists(self.get_document_path(version))
+            ]
+            for source in changed:
+                try:
+                    self.index_document(source, versions[source], load(source))
+                except Exception as e:
+                    logging.warning("Unable to index %s: %s", source, e)
+
+            indexed = {
+                source: version
+                for source, version in versions.items()
+                if os.path.exists(self.get_document_path(version))
+            }
+            if changed or indexed.keys() != manifest.keys():
+                stats = self.write_build(indexed)
+            else:
+                stats = {"passages": None, "terms": None}
+
+        stats.update(
+            {
+                "documents": len(indexed),
+                "changed": len(changed),
+                "removed": len(manifest.keys() - versions.keys()),
+                "secs": round(time.monotonic() - start, 2),
+            }
+        )
+        logging.info("Updated search index %s: %s", self.index_dir, stats)
+        return stats
+
+    def write_build(self, manifest: Dict[str, str]) -> Dict:
+        passages: List[Tuple[str, str]] = []
+        lengths: List[int] = []
+        term_postings: Dict[str, List[Tuple[int, int]]] = {}
+        for source, version in sorted(manifest.items()):
+            with open(self.get_document_path(version)) as f:
+                document = json.load(f)
+
+            for text, terms in zip(document["passages"], document["terms"]):
+                passage_id = len(passages)
+                passages.append((source, text))
+                lengths.append(sum(terms.values()))
+                for term, freq in terms.items():
+                    term_postings.setdefault(term, []).append((passage_id, freq))
+
+        terms: Dict[str, List[int]] = {}
+        doc_ids: List[int] = []
+        freqs: List[int] = []
+        for term in sorted(term_postings):
+            terms[term] = [len(doc_ids), len(doc_ids) + len(term_postings[term])]
+            for passage_id, freq in term_postings[term]:
+                doc_ids.append(passage_id)
+                freqs.append(freq)
+
+        build = f"build-{time.time_ns()}"
+        build_dir = os.path.join(self.index_dir, build)
+        os.makedirs(build_dir)
+        np.save(os.path.join(build_dir, "doc_ids.npy"), np.array(doc_ids, dtype=np.int32))
+        np.save(os.path.join(build_dir, "freqs.npy"), np.array(freqs, dtype=np.int32))
+        np.save(os.path.join(build_dir, "lengths.npy"), np.array(lengths, dtype=np.float32))
+        for name, data in (
+            ("terms.json", terms),
+            ("passages.json", passages),
+            ("manifest.json", manifest),
+        ):
+            with open(os.path.join(build_dir, name), "w") as f:
+                json.dump(data, f)
+
+        # readers pick up the new build on their next search
+        previous = self.get_current_build()
+        tmp_path = self.current_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(build)
+        os.replace(tmp_path, self.current_path)
+
+        self.remove_unused({build, previous}, manifest)
+        return {"passages": len(passages), "terms": len(terms)}
+
+    def remove_unused(self, builds: Set[Optional[str]], manifest: Dict[str, str]):
+        """
+        :param builds: the builds to keep. The previous one is kept until the
+            next build, for readers that read CURRENT just before the swap.
+        """
+        for name in os.listdir(self.index_dir):
+            if name.startswith("build-") and name not in builds:
+                shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+
+        used = {os.path.basename(self.get_document_path(v)) for v in manifest.values()}
+        for name in os.listdir(self.documents_dir):
+            if name not in used:
+                os.remove(os.path.join(self.documents_dir, name))
+
+    def load(self) -> Optional[Dict]:
+        try:
+            return self.load_current()
+        except FileNotFoundError:
+            # replaced twice since CURRENT was read, so read it again
+            return self.load_current()
+
+    def load_current(self) -> Optional[Dict]:
+        build = self.get_current_build()
+        if build is None:
+            return None
+
+        with self._load_lock:
+            if self._loaded is None or self._loaded[0] != build:
+                build_dir = os.path.join(self.index_dir, build)
+                with open(os.path.join(build_dir, "terms.json")) as f:
+                    terms = json.load(f)
+                with open(os.path.join(build_dir, "passages.json")) as f:
+                    passages = json.load(f)
+                self._loaded = (
+                    build,
+                    {
+                        "terms": terms,
+                        "passages": passages,
+                        "doc_ids": np.load(os.path.join(build_dir, "doc_ids.npy"), mmap_mode="r"),
+                        "freqs": np.load(os.path.join(build_dir, "freqs.npy"), mmap_mode="r"),
+                        "lengths": np.load(os.path.join(build_dir, "lengths.npy")),
+                    },
+                )
+            return self._loaded[1]
+
+    def search(self, query: str, k: int = 8) -> List[Passage]:
+        """
+        :return: the best matching passages, best first. Nothing if the
+            index hasn't been built.
+        """
+        index = self.load()
+        if index is None:
+            return []
+
+        passage_count = len(index["passages"])
+        query_terms = []
+        for term in set(tokenize(query)):
+            if term not in index["terms"]:
+                continue
+            start, stop = index["terms"][term]
+            idf = bm25_idf(np.float32(stop - start), passage_count)
+            query_terms.append((index["doc_ids"][start:stop], index["freqs"][start:stop], idf))
+
+        scores = bm25_scores(query_terms, index["lengths"], self.k1, self.b)
+        return [
+            Passage(*index["passages"][passage_id], score=score)
+            for passage_id, score in top_k(scores, k)
+        ]
+
+
+_corpus_indexes: Dict[str, CorpusIndex] = {}
+_corpus_indexes_lock = threading.Lock()
+
+
+def get_corpus_index(assistant_name: str) -> CorpusIndex:
+    """
+    The local search index for an assistant, under SEARCH_INDEX_DIR
+    (defaults to "search_index").
+    """
+    with _corpus_indexes_lock:
+        if assistant_name not in _corpus_indexes:
+            index_dir = os.path.join(os.getenv("SEARCH_INDEX_DIR") or "search_index", assistant_name)
+            _corpus_indexes[assistant_name] = CorpusIndex(index_dir)
+        return _corpus_indexes[assistant_name]
@@ -0,0 +1,56 @@
+from typing import Dict, Iterable, List, Set
+
+from app.services.search.bm25 import TOKEN_PATTERN
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower case word tokens. Unlike the search index's, stop words are kept,
+    since they're part of names like "The Home Depot".
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class PrefixIndex:
+    """
+    A trie of names for typeahead. A name matches a query if each word of
+    the query is a prefix of one of the name's words, so "acme rob" finds
+    "Acme Robotics" and "rob" finds it too.
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.names: List[str] = []
+        self.root: Dict = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str):
+        name_id = len(self.names)
+        self.names.append(name)
+        for word in set(tokenize(name)):
+            node = self.root
+            for char in word:
+                node = node.setdefault(char, {})
+                # every name with a word under this node
+                node.setdefault("", set()).add(name_id)
+
+    def get_ids(self, prefix: str) -> Set[int]:
+        node = self.root
+        for char in prefix:
+            if char not in node:
+                return set()
+            node = node[char]
+        return node.get("", set())
+
+    def search(self, query: str, limit: int = 100) -> List[str]:
+        """
+        :return: the matching names, alphabetically, all of them for an
+            empty query
+        """
+        words = tokenize(query)
+        if not words:
+            ids = set(range(len(self.names)))
+        else:
+            ids = set.intersection(*(self.get_ids(word) for word in words))
+
+        return sorted((self.names[i] for i in ids), key=str.lower)[:limit]
@@ -0,0 +1,88 @@
+import html
+import io
+import logging
+import re
+import zipfile
+from typing import List
+
+from app.services.pdf import pdf_service
+
+TAG_PATTERN = re.compile(r"<[^>]+>")
+
+
+def strip_tags(markup: str) -> str:
+    markup = re.sub(r"(?is)<(script|style)\b.*?</\1>", " ", markup)
+    markup = re.sub(r"(?i)</(p|div|li|tr|h[1-6])>|<br\s*/?>", "\n", markup)
+    return html.unescape(TAG_PATTERN.sub(" ", markup))
+
+
+def get_office_texts(content: bytes) -> List[str]:
+    """
+    The text of an office open xml file, without needing python-docx or
+    similar. Each slide of a deck is its own text.
+    """
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        names = archive.namelist()
+        slides = sorted(
+            (n for n in names if re.fullmatch(r"ppt/slides/slide\d+\.xml", n)),
+            key=lambda n: int(re.findall(r"\d+", n)[-1]),
+        )
+        parts = slides or [
+            n
+            for n in names
+            if n in ("word/document.xml", "xl/sharedStrings.xml")
+            or re.fullmatch(r"xl/worksheets/sheet\d+\.xml", n)
+        ]
+        texts = []
+        for name in parts:
+            xml = archive.read(name).decode("utf-8", errors="ignore")
+            xml = re.sub(r"</(w:p|a:p|si|row)>", "\n", xml)
+            texts.append(html.unescape(TAG_PATTERN.sub(" ", xml)))
+        return texts
+
+
+def get_texts(filename: str, content: bytes) -> List[str]:
+    """
+    Extract text from a corpus file: one text per pdf page or slide, or a
+    single text otherwise. The content is sniffed rather than trusting the
+    extension, since google docs are ingested as ".docx" plain text exports.
+
+    :param filename:
+    :param content:
+    :return:
+    """
+    try:
+        if content.startswith(b"%PDF"):
+            return pdf_service.extract_pages(content)
+        if content.startswith(b"PK"):
+            return get_office_texts(content)
+
+        text = content.decode("utf-8", errors="ignore")
+        if filename.endswith(".html") or text.lstrip()[:15].lower().startswith(("<!doctype", "<html")):
+            text = strip_tags(text)
+        return [text]
+    except Exception as e:
+        logging.warning("Unable to extract text from %s: %s", filename, e)
+        return []
+
+
+def split_passages(texts: List[str], max_chars: int = 1500) -> List[str]:
+    """
+    Split texts into passages of about `max_chars` on line breaks. Texts
+    are never merged, so a passage doesn't span pages or slides.
+    """
+    passages = []
+    for text in texts:
+        lines = [re.sub(r"\s+", " ", line).strip() for line in text.splitlines()]
+        parts: List[str] = []
+        size = 0
+        for line in filter(None, lines):
+            if parts and size + len(line) > max_chars:
+                passages.append("\n".join(parts))
+                parts, size = [], 0
+            parts.append(line[:max_chars])
+            size += len(line) + 1
+        if parts:
+            passages.append("\n".join(parts))
+
+    return passages
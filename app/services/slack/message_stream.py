@@ -0,0 +1,91 @@
+import logging
+import time
+from typing import Callable, List, Optional
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+from app.utils import chunker
+
+# the most blocks a slack message can have
+MAX_BLOCKS = 50
+
+
+class SlackMessageStream:
+    """
+    Posts a placeholder message and keeps updating it as text arrives.
+
+    Updates are throttled to one per `min_interval_secs` to stay inside
+    `chat.update`'s rate limit. `finish` always sends the final text.
+    Messages hold at most `MAX_BLOCKS` blocks, the final text's others are
+    posted as follow-up messages.
+    """
+
+    def __init__(
+        self,
+        client: WebClient,
+        channel: str,
+        render_blocks: Callable[[str], List],
+        min_interval_secs: float = 1.5,
+    ):
+        self.client = client
+        self.channel = channel
+        self.render_blocks = render_blocks
+        self.min_interval_secs = min_interval_secs
+        self.ts: Optional[str] = None
+        self.last_update = 0.0
+
+    def start(self, placeholder: str = "_Thinking..._") -> "SlackMessageStream":
+        resp = self.client.chat_postMessage(
+            channel=self.channel,
+            text=placeholder,
+            blocks=self.render_blocks(placeholder),
+        )
+        # a user id as the channel posts to the dm, updates need the dm's id
+        self.channel = resp["channel"]
+        self.ts = resp["ts"]
+        self.last_update = time.monotonic()
+        return self
+
+    def update(self, text: str):
+        if time.monotonic() - self.last_update < self.min_interval_secs:
+            return
+        text += " ..."
+        self._update(text, self.render_blocks(text)[:MAX_BLOCKS])
+
+    def finish(self, text: str):
+        """
+        Send the final text. If the message can't be updated, the whole text
+        is posted as a new message instead.
+        """
+        blocks = self.render_blocks(text)
+        if self._update(text, blocks[:MAX_BLOCKS]):
+            blocks = blocks[MAX_BLOCKS:]
+
+        for grp in chunker(blocks, MAX_BLOCKS):
+            try:
+                self.client.chat_postMessage(channel=self.channel, text=text[:3000], blocks=grp)
+            except SlackApiError as e:
+                logging.error("Failed to post answer to slack %s: %s", self.channel, e)
+                return
+
+    def _update(self, text: str, blocks: List) -> bool:
+        """
+        :return: whether the message was updated
+        """
+        if not self.ts:
+            return False
+
+        self.last_update = time.monotonic()
+        try:
+            self.client.chat_update(
+                channel=self.channel,
+                ts=self.ts,
+                text=text[:3000],
+                blocks=blocks,
+            )
+        except SlackApiError as e:
+            logging.warning("Failed to update slack message %s: %s", self.ts, e)
+            return False
+
+        return True
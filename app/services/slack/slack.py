@@ -1,10 +1,13 @@
+import hashlib
 import logging
 import os
 import re
+import tempfile
 import typing
-from typing import Dict, Optional, List
+from typing import IO, Dict, Optional, List, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 
 # renamed to avoid conflict with the fastapi
 from slack_bolt import App as SlackApp
@@ -13,7 +16,10 @@ from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 from slack_sdk.web import SlackResponse
 
-from app.utils import chunker
+from app.utils import LRUCache, chunker
+
+# user id -> users.info user, profiles rarely change
+_user_infos = LRUCache(maxsize=1024, ttl_secs=60 * 60)
 
 
 class SlackService:
@@ -26,6 +32,10 @@ class SlackService:
         self.socket_mode_handler = SocketModeHandler(
             self.slack_app, self.slack_app_token
         )
+        # file downloads reuse connections to files.slack.com
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        self.session.headers["Authorization"] = f"Bearer {self.slack_bot_token}"
 
     @property
     def slack_bot_token(self):
@@ -46,6 +56,29 @@ class SlackService:
     def run_bolt_app(self):
         self.socket_mode_handler.start()
 
+    def download_file(
+        self, file_url: str, chunk_size: int = 1024 * 1024
+    ) -> Tuple[str, IO[bytes], str]:
+        """
+        Stream a private slack file to a temporary file, hashing it on the
+        way. Files up to 8MB stay in memory.
+
+        :param file_url:
+        :param chunk_size:
+        :return: the file name, the file rewound to the start, and the
+            sha256 of its content
+        """
+        digest = hashlib.sha256()
+        spooled = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        with self.session.get(file_url, stream=True, timeout=60) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                digest.update(chunk)
+                spooled.write(chunk)
+
+        spooled.seek(0)
+        return os.path.split(resp.url)[-1], spooled, digest.hexdigest()
+
     @staticmethod
     def markdown_to_slack_blocks(markdown_text: str):
         """
@@ -177,8 +210,13 @@ class SlackService:
     #         raise
 
     def get_user_info(self, user_id: str):
+        user_info = _user_infos.get(user_id)
+        if user_info is not None:
+            return user_info
+
         try:
             response = self.slack_app.client.users_info(user=user_id)
+            _user_infos.set(user_id, response["user"])
             return response["user"]
         except Exception as e:
             logging.error("Error retrieving user info for id %s: %s", user_id, e)
@@ -4,6 +4,7 @@ from app.services.openai.openai_service import OpenAIService
 from app.services.slack import slack_service
 
 from app.slack.subcommands.ai.ai import handle_ai_subcommand
+from app.slack.subcommands.insights.insights import handle_insights_subcommand
 
 from app.utils import (
     is_valid_url,
@@ -15,12 +16,15 @@ def handle_get_command(ack, body, client, say):
     ack()
     command_parts = body.get("text", "").strip().lower()
     command_text, command_args = slack_service.command_parser(command_parts)
+    # questions keep their case
+    _command_text, raw_command_args = slack_service.command_parser(body.get("text", "").strip())
 
     # Extract the username and the text portion of the command
     user_id = body["user_id"]
-    user_info = client.users_info(user=user_id)
-    username = user_info["user"]["profile"]["display_name_normalized"]
-    email = user_info["user"]["profile"]["email"]
+    # cached, this runs before the modal opens and its trigger_id expires
+    user_info = slack_service.get_user_info(user_id)
+    username = user_info["profile"]["display_name_normalized"]
+    email = user_info["profile"]["email"]
     channel_id = body["channel_id"]
     response_url = body["response_url"]
 
@@ -33,5 +37,7 @@ def handle_get_command(ack, body, client, say):
 
     match command_text:
         case "ai":
-            handle_ai_subcommand(command_args, client, body)
+            handle_ai_subcommand(raw_command_args, client, body)
+        case "insights":
+            handle_insights_subcommand(command_args, client, body)
 
@@ -1,10 +1,32 @@
-from typing import Dict
+import json
+from typing import Dict, List
 
+# values are assistant names
+MODEL_OPTIONS: List[Dict] = [
+    {"text": {"type": "plain_text", "text": "competitor bot"}, "value": "competitor"},
+]
 
-def get_ai_insights_modal_view(model_choice: str | None = None) -> Dict:
+# values are the assistant's latency tiers, "auto" routes by the question
+ANSWER_DEPTH_OPTIONS: List[Dict] = [
+    {"text": {"type": "plain_text", "text": "Auto"}, "value": "auto"},
+    {"text": {"type": "plain_text", "text": "Quick lookup"}, "value": "fast"},
+    {"text": {"type": "plain_text", "text": "Thorough analysis"}, "value": "thorough"},
+]
+
+NEW_CONVERSATION_OPTION: Dict = {
+    "text": {"type": "plain_text", "text": "Start a new conversation"},
+    "value": "new",
+}
+
+
+def get_ai_insights_modal_view(
+    model_choice: str | None = None, private_metadata: Dict | None = None
+) -> Dict:
     opts: Dict = {
         "type": "modal",
         "callback_id": "ai_modal_view",
+        # where the command was run, so the submission can reply there
+        "private_metadata": json.dumps(private_metadata or {}),
         "title": {"type": "plain_text", "text": "Get AI Insights"},
         "submit": {"type": "plain_text", "text": "Submit"},
         "blocks": [
@@ -15,19 +37,37 @@ def get_ai_insights_modal_view(model_choice: str | None = None) -> Dict:
                     "type": "static_select",
                     "placeholder": {"type": "plain_text", "text": "Select a model"},
                     "action_id": "model_select",
-                    "options": [
-                        {
-                            "text": {"type": "plain_text", "text": "competitor bot"},
-                            "value": "competitor",
-                        }
-                        
-                    ],
+                    "options": MODEL_OPTIONS,
                 },
                 "label": {
                     "type": "plain_text",
                     "text": "Which Model?",
                 },
             },
+            {
+                "type": "input",
+                "block_id": "tier_choice",
+                "optional": True,
+                "element": {
+                    "type": "static_select",
+                    "action_id": "tier_select",
+                    "initial_option": ANSWER_DEPTH_OPTIONS[0],
+                    "options": ANSWER_DEPTH_OPTIONS,
+                },
+                "label": {"type": "plain_text", "text": "Answer depth"},
+            },
+            {
+                "type": "input",
+                "block_id": "competitor_choice",
+                "optional": True,
+                "element": {
+                    "type": "external_select",
+                    "action_id": "competitor_select",
+                    "placeholder": {"type": "plain_text", "text": "Any competitor"},
+                    "min_query_length": 0,
+                },
+                "label": {"type": "plain_text", "text": "Competitor"},
+            },
             {
                 "type": "input",
                 "block_id": "question",
@@ -41,6 +81,21 @@ def get_ai_insights_modal_view(model_choice: str | None = None) -> Dict:
                 },
                 "label": {"type": "plain_text", "text": "Question?"},
             },
+            {
+                "type": "input",
+                "block_id": "conversation",
+                "optional": True,
+                "element": {
+                    "type": "checkboxes",
+                    "action_id": "new_conversation",
+                    "options": [NEW_CONVERSATION_OPTION],
+                },
+                "label": {"type": "plain_text", "text": "Conversation"},
+                "hint": {
+                    "type": "plain_text",
+                    "text": "Questions follow up on your earlier ones in this channel.",
+                },
+            },
         ],
     }
 
@@ -3,8 +3,16 @@ from typing import Dict
 
 import slack_sdk
 
+from app.services.openai.warmup import warmup_service
 from app.services.slack import slack_service
-from app.slack.modals.get_ai_insights_modal import get_ai_insights_modal_view
+from app.slack.modals.get_ai_insights_modal import MODEL_OPTIONS, get_ai_insights_modal_view
+from app.slack.views import submit_question
+
+DEFAULT_MODEL = "competitor"
+
+
+def is_model_name(command_args: str) -> bool:
+    return command_args.lower() in [option["value"] for option in MODEL_OPTIONS]
 
 
 def handle_ai_subcommand(
@@ -12,12 +20,38 @@ def handle_ai_subcommand(
     client: slack_sdk.web.client.WebClient,
     body: Dict,
 ):
+    """
+    `ai <question>` answers in the channel right away, `ai` or `ai <model>`
+    opens the modal.
+    """
     response_url = body["response_url"]
+    metadata = {"channel_id": body.get("channel_id"), "response_url": response_url}
 
+    if command_args and not is_model_name(command_args):
+        try:
+            submit_question(
+                client,
+                body["user_id"],
+                DEFAULT_MODEL,
+                command_args,
+                "auto",
+                metadata,
+                in_channel=True,
+            )
+        except Exception as e:
+            logging.exception("Error answering %s inline", body["user_id"])
+            slack_service.send_ephemeral_message(response_url, message=f"Error: {e}")
+        return
+
+    model = command_args.lower() or DEFAULT_MODEL
     try:
         logging.info(command_args)
-        modal_view = get_ai_insights_modal_view(command_args)
+        modal_view = get_ai_insights_modal_view(
+            model, private_metadata={**metadata, "model": model}
+        )
         client.views_open(trigger_id=body["trigger_id"], view=modal_view)
+        # the model select defaults to the competitor bot
+        warmup_service.warm_in_background(model, body["user_id"])
 
         slack_service.send_ephemeral_message(
             response_url, message="Request made. Please wait a few moments..."
@@ -0,0 +1,80 @@
+import logging
+import os
+from typing import Dict, List, Tuple
+
+import slack_sdk
+
+from app.services.openai.insights import InsightsService
+from app.services.openai.openai_service import OpenAIService
+from app.services.slack import slack_service
+from app.slack.subcommands.ai.ai import is_model_name
+
+
+def get_insights_blocks(insights_service: InsightsService, competitor_filter: str) -> List[Dict]:
+    insights = insights_service.get_insights().get("insights", {})
+    blocks: List[Dict] = []
+    for competitor, topics in sorted(insights.items()):
+        if competitor_filter and competitor_filter not in competitor.lower():
+            continue
+
+        blocks.append(
+            {"type": "header", "text": {"type": "plain_text", "text": competitor}}
+        )
+        for topic, insight in topics.items():
+            blocks.append(
+                {
+                    "type": "section",
+                    "text": {
+                        "type": "mrkdwn",
+                        # section text is limited to 3000 characters
+                        "text": f"*{topic.capitalize()}*\n{insights_service.format_insight(insight)}"[:3000],
+                    },
+                }
+            )
+        blocks.append({"type": "divider"})
+
+    return blocks[:50]
+
+
+def parse_insights_args(command_args: str) -> Tuple[str, str]:
+    """
+    :return: the assistant named by the first argument, otherwise the one in
+        S3_EVENTS_ASSISTANT (defaults to competitor), and the competitor
+        filter
+    """
+    first, _, rest = command_args.strip().partition(" ")
+    if first and is_model_name(first):
+        return first.lower(), rest.strip()
+    return os.getenv("S3_EVENTS_ASSISTANT") or "competitor", command_args.strip()
+
+
+def handle_insights_subcommand(
+    command_args: str,
+    client: slack_sdk.web.client.WebClient,
+    body: Dict,
+):
+    """
+    `/cmd insights [assistant] [competitor]` shows an assistant's
+    precomputed competitor insights, optionally only for competitors whose
+    name contains the argument.
+    """
+    response_url = body["response_url"]
+
+    try:
+        assistant_name, competitor_filter = parse_insights_args(command_args)
+        insights_service = InsightsService(OpenAIService(assistant_name))
+        blocks = get_insights_blocks(insights_service, competitor_filter.lower())
+        if not blocks:
+            slack_service.send_ephemeral_message(
+                response_url,
+                message="There are no precomputed insights"
+                + (f" for {competitor_filter}" if competitor_filter else "")
+                + " yet.",
+            )
+            return
+
+        slack_service.send_ephemeral_message(
+            response_url, message="Competitor insights", blocks=blocks
+        )
+    except Exception as e:
+        logging.error(e)
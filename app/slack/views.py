@@ -1,35 +1,42 @@
 import logging
-from typing import Dict
+import time
+from concurrent.futures import Future
+from typing import Dict, List
 import json
 
 from slack_bolt import Ack
+from slack_sdk.errors import SlackApiError
 
 
+from app.services.metrics.timeline import add_stage, run_timeline, stage
 from app.services.slack import slack_service
+from app.services.slack.message_stream import SlackMessageStream
+from app.utils import chunker
 
 from ..services.openai.openai_service import OpenAIService
+from ..services.openai.async_openai_service import async_openai_runner
+from ..services.openai.question_scheduler import question_scheduler
+from ..services.openai.warmup import warmup_service
+from ..services.search.competitors import get_competitor_directory
+from ..services.openai.sessions import (
+    DEFAULT_SESSION_IDLE_SECS,
+    ConversationSession,
+    session_store,
+)
 
 
+# the most characters slack shows in a block's text
+RESPONSE_BLOCK_CHARS = 3000
 
 
-@slack_service.slack_app.view("ai_modal_view")
-def handle_get_ai_submission(ack, body, view, client):
-    ack()
-    user_id = body["user"]["id"]
-    values = body["view"]["state"]["values"]
-    question = values["question"]["question_input"]["value"]
-    model = values["model_choice"]["model_select"]["selected_option"]["value"]
-    # files = values["file_block_id"]["file_input_action_id_1"]["files"]
-    # file_urls = [f["url_private_download"] for f in files]
-
-    openai_serv = OpenAIService(model)
-
-    ai_response = openai_serv.ask_ai_assistant_question(question, [])
-
+def get_ai_response_blocks(
+    model: str, question: str, ai_response: str, asked_by: str | None = None
+) -> List[Dict]:
+    asker = f"<@{asked_by}>" if asked_by else "You"
     full_response_blocks = [
         {
             "type": "section",
-            "text": {"type": "mrkdwn", "text": f"*You asked the {model} assistant:*"},
+            "text": {"type": "mrkdwn", "text": f"*{asker} asked the {model} assistant:*"},
         },
         {
             "type": "rich_text",
@@ -41,16 +48,20 @@ def handle_get_ai_submission(ack, body, view, client):
             ],
         },
         {"type": "section", "text": {"type": "mrkdwn", "text": "*Response:*"}},
+    ]
+    # slack truncates long text in a block, so the response is split
+    full_response_blocks.extend(
         {
             "type": "rich_text",
             "elements": [
                 {
                     "type": "rich_text_preformatted",
-                    "elements": [{"type": "text", "text": ai_response}],
+                    "elements": [{"type": "text", "text": part}],
                 }
             ],
-        },
-    ]
+        }
+        for part in list(chunker(ai_response, RESPONSE_BLOCK_CHARS)) or [ai_response]
+    )
 
     full_response_blocks.extend(
         [
@@ -74,8 +85,296 @@ def handle_get_ai_submission(ack, body, view, client):
         ]
     )
 
-    slack_service.send_message(
-        user_or_ch_id=user_id,
-        blocks=full_response_blocks,
-        as_user=True,
+    return full_response_blocks
+
+
+def send_queue_notice(client, user_id: str, metadata: Dict, position: int):
+    message = (
+        f"You're #{position} in line, your answer will be sent here when it's ready."
+    )
+    if metadata.get("response_url"):
+        slack_service.send_ephemeral_message(metadata["response_url"], message)
+    elif metadata.get("channel_id"):
+        try:
+            client.chat_postEphemeral(
+                channel=metadata["channel_id"], user=user_id, text=message
+            )
+        except SlackApiError as e:
+            logging.warning("Unable to tell %s their place in line: %s", user_id, e)
+
+
+def get_session(
+    openai_serv: OpenAIService, user_id: str, channel_id: str | None, new_conversation: bool
+) -> ConversationSession | None:
+    sessions_config = openai_serv.ai_config.get("sessions")
+    if not sessions_config:
+        return None
+
+    assistant_name = openai_serv.ai_config["name"]
+    if new_conversation:
+        session_store.end(assistant_name, user_id, channel_id)
+    return session_store.get(
+        assistant_name,
+        user_id,
+        channel_id,
+        idle_secs=sessions_config.get("idle_secs", DEFAULT_SESSION_IDLE_SECS),
     )
+
+
+def use_warm_thread(
+    model: str, user_id: str, session: ConversationSession | None
+) -> ConversationSession | None:
+    """
+    Start a new conversation, or the question when there are no sessions,
+    on the thread created when the modal was opened.
+    """
+    if session is not None and (
+        session.thread_id or session.is_follow_up or session.lock.locked()
+    ):
+        return session
+
+    thread_id = warmup_service.take_thread(model, user_id)
+    if thread_id is None:
+        return session
+    if session is None:
+        return ConversationSession(thread_id=thread_id)
+
+    session.thread_id = thread_id
+    return session
+
+
+def start_in_channel_answer(
+    client, channel_id: str, user_id: str, model: str, question: str
+) -> SlackMessageStream | None:
+    """
+    Post a placeholder for the answer in the channel, to fill in once it's
+    ready. None if the bot can't post there.
+    """
+    try:
+        with stage("slack_post"):
+            return SlackMessageStream(
+                client,
+                channel_id,
+                lambda text: get_ai_response_blocks(model, question, text, asked_by=user_id),
+            ).start()
+    except SlackApiError as e:
+        logging.warning("Unable to answer %s in %s: %s", user_id, channel_id, e)
+        return None
+
+
+def start_dm_answer(client, user_id: str, model: str, question: str) -> SlackMessageStream | None:
+    """
+    Post a placeholder for a streamed answer in the user's dm. None if it
+    can't be posted.
+    """
+    try:
+        with stage("slack_post"):
+            return SlackMessageStream(
+                client,
+                user_id,
+                lambda text: get_ai_response_blocks(model, question, text),
+            ).start()
+    except SlackApiError as e:
+        logging.warning("Unable to stream the answer to %s: %s", user_id, e)
+        return None
+
+
+def answer_question(
+    openai_serv: OpenAIService,
+    client,
+    user_id: str,
+    model: str,
+    question: str,
+    tier: str,
+    session: ConversationSession | None = None,
+    submitted_at: float | None = None,
+    stream: SlackMessageStream | None = None,
+):
+    """
+    Answer a question and send it to the user, recording the time spent
+    waiting in the scheduler's queue and posting to slack with the rest of
+    the question's timeline.
+
+    :param submitted_at: when the question was submitted, from `time.monotonic()`
+    :param stream: a message already posted for the answer, see
+        `start_in_channel_answer`
+    """
+    with run_timeline(model):
+        if submitted_at is not None:
+            add_stage("queue", time.monotonic() - submitted_at)
+
+        streaming = openai_serv.ai_config.get("stream_answers")
+        if streaming and stream is None:
+            # post right away and fill in the answer as it is generated
+            stream = start_dm_answer(client, user_id, model, question)
+
+        if stream is not None:
+            try:
+                ai_response = openai_serv.ask_ai_assistant_question(
+                    question,
+                    [],
+                    on_text=stream.update if streaming else None,
+                    tier=tier,
+                    session=session,
+                )
+            except Exception as e:
+                # replace the placeholder instead of leaving it thinking
+                stream.finish(f"Error: {e}")
+                raise
+            with stage("slack_post"):
+                stream.finish(ai_response)
+            return
+
+        ai_response = openai_serv.ask_ai_assistant_question(
+            question, [], tier=tier, session=session
+        )
+
+        with stage("slack_post"):
+            slack_service.send_message(
+                user_or_ch_id=user_id,
+                blocks=get_ai_response_blocks(model, question, ai_response),
+                as_user=True,
+            )
+
+
+def submit_question(
+    client,
+    user_id: str,
+    model: str,
+    question: str,
+    tier: str,
+    metadata: Dict,
+    new_conversation: bool = False,
+    in_channel: bool = False,
+):
+    """
+    Schedule answering a question, and tell the user their place in line if
+    it has to wait.
+
+    :param metadata: the "channel_id" and "response_url" of the command
+    :param in_channel: answer in the channel, in a placeholder posted now,
+        instead of in a dm
+    """
+    submitted_at = time.monotonic()
+    channel_id = metadata.get("channel_id")
+    # warmed up when the modal was opened
+    openai_serv = warmup_service.get_service(model)
+    session = get_session(openai_serv, user_id, channel_id, new_conversation)
+    session = use_warm_thread(model, user_id, session)
+
+    stream = None
+    if in_channel and channel_id:
+        stream = start_in_channel_answer(client, channel_id, user_id, model, question)
+
+    if openai_serv.ai_config.get("use_async_client"):
+        # answered on the shared event loop, so no thread is held while
+        # waiting. Streamed answers are too, with their placeholder posted now
+        streaming = openai_serv.ai_config.get("stream_answers")
+        if streaming and stream is None:
+            stream = start_dm_answer(client, user_id, model, question)
+        on_text = stream.update if streaming and stream is not None else None
+
+        def send_answer(future: Future):
+            try:
+                ai_response = future.result()
+            except Exception as e:
+                logging.exception("Error answering %s's question", user_id)
+                ai_response = f"Error: {e}"
+
+            if stream is not None:
+                stream.finish(ai_response)
+                return
+            slack_service.send_message(
+                user_or_ch_id=user_id,
+                blocks=get_ai_response_blocks(model, question, ai_response),
+                as_user=True,
+            )
+
+        future, position = question_scheduler.submit_future(
+            lambda: async_openai_runner.submit(
+                model, question, tier=tier, session=session, on_text=on_text
+            ),
+            user_id=user_id,
+            channel_id=channel_id,
+        )
+        # the future is resolved on the event loop's thread, which mustn't
+        # wait on slack
+        future.add_done_callback(
+            lambda future: question_scheduler.executor.submit(send_answer, future)
+        )
+    else:
+        future, position = question_scheduler.submit(
+            lambda: answer_question(
+                openai_serv,
+                client,
+                user_id,
+                model,
+                question,
+                tier,
+                session,
+                submitted_at,
+                stream,
+            ),
+            user_id=user_id,
+            channel_id=channel_id,
+        )
+
+        def log_error(future: Future):
+            if future.exception() is not None:
+                logging.error("Error answering %s's question: %s", user_id, future.exception())
+
+        future.add_done_callback(log_error)
+
+    if position:
+        send_queue_notice(client, user_id, metadata, position)
+
+
+def scope_question(question: str, competitor: str | None) -> str:
+    if not competitor:
+        return question
+    return f"About {competitor}: {question}"
+
+
+@slack_service.slack_app.options("competitor_select")
+def handle_competitor_suggestions(ack, body):
+    """
+    Competitor names matching what's typed in the modal's competitor
+    field. Slack waits 3 seconds for these, so they come from the
+    in-memory `CompetitorDirectory`.
+    """
+    metadata = json.loads(body.get("view", {}).get("private_metadata") or "{}")
+    try:
+        ai_config = warmup_service.get_service(metadata.get("model") or "competitor").ai_config
+        names = get_competitor_directory(ai_config).search(body.get("value", ""), limit=100)
+    except Exception as e:
+        logging.warning("Unable to suggest competitors: %s", e)
+        names = []
+
+    ack(
+        options=[
+            {"text": {"type": "plain_text", "text": name[:75]}, "value": name[:150]}
+            for name in names
+        ]
+    )
+
+
+@slack_service.slack_app.view("ai_modal_view")
+def handle_get_ai_submission(ack, body, view, client):
+    ack()
+    user_id = body["user"]["id"]
+    values = body["view"]["state"]["values"]
+    question = values["question"]["question_input"]["value"]
+    model = values["model_choice"]["model_select"]["selected_option"]["value"]
+    tier_option = values.get("tier_choice", {}).get("tier_select", {}).get("selected_option")
+    tier = (tier_option or {}).get("value", "auto")
+    competitor_option = (
+        values.get("competitor_choice", {}).get("competitor_select", {}).get("selected_option")
+    )
+    question = scope_question(question, (competitor_option or {}).get("value"))
+    conversation = values.get("conversation", {}).get("new_conversation", {})
+    new_conversation = bool(conversation.get("selected_options"))
+    metadata = json.loads(body["view"].get("private_metadata") or "{}")
+    # files = values["file_block_id"]["file_input_action_id_1"]["files"]
+    # file_urls = [f["url_private_download"] for f in files]
+
+    submit_question(client, user_id, model, question, tier, metadata, new_conversation)
@@ -1,4 +1,10 @@
+import asyncio
 import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
 
 def chunker(seq, size):
     """
@@ -22,4 +28,160 @@ def is_valid_url(url):
         re.IGNORECASE,
     )
 
-    return re.match(regex, url) is not None
\ No newline at end of file
+    return re.match(regex, url) is not None
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize free text for use as a cache key. Case, whitespace, quote
+    styles and trailing punctuation are ignored.
+
+    :param text:
+    :return:
+    """
+    text = text.lower().translate(str.maketrans("‘’“”", "''\"\""))
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!. ")
+
+
+def format_age(secs: float) -> str:
+    """
+    A rough, human readable duration like "5 minutes" or "2 days".
+    """
+    for unit, unit_secs in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        if secs >= unit_secs:
+            count = int(secs // unit_secs)
+            return f"{count} {unit}{'s' if count != 1 else ''}"
+    return "less than a minute"
+
+
+class LRUCache:
+    """
+    A thread safe LRU cache with an optional time to live per entry.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl_secs: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl_secs = ttl_secs
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+
+            value, expires_at = self._data[key]
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_secs: Optional[float] = None):
+        ttl_secs = ttl_secs if ttl_secs is not None else self.ttl_secs
+        expires_at = time.monotonic() + ttl_secs if ttl_secs is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._data.pop(key)[0]
+
+    def items(self) -> list:
+        """
+        The unexpired entries, most recently used last.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value)
+                for key, (value, expires_at) in self._data.items()
+                if expires_at is None or expires_at > now
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_MISSING = object()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key. The first caller runs the
+    call, callers arriving while it's in flight wait for and share its
+    result or exception. Sync and asyncio callers share the same flights.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def join(self, key: Hashable) -> Tuple[Future, bool]:
+        """
+        :return: the flight for the key, and whether the caller leads it
+        """
+        with self._lock:
+            if key in self._flights:
+                return self._flights[key], False
+
+            future: Future = Future()
+            self._flights[key] = future
+            return future, True
+
+    def land(self, key: Hashable, future: Future, result: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            self._flights.pop(key, None)
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        :return: the result, and whether it was shared from another caller
+        """
+        future, leader = self.join(key)
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self.land(key, future, error=e)
+            raise
+
+        self.land(key, future, result)
+        return result, False
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        See `do`
+        """
+        future, leader = self.join(key)
+        if not leader:
+            return await asyncio.wrap_future(future), True
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            self.land(key, future, error=e)
+            raise
+
+        self.land(key, future, result)
+        return result, False